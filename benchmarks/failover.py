@@ -0,0 +1,345 @@
+"""Measure leader failover and recovery times of a local cluster under load
+
+Runs --nodes LockService nodes on loopback ports in this process, with
+--clients threads acquiring and releasing locks through any reachable
+node. Each trial takes out the current leader, either by stopping it
+(kill) or by dropping all Raft messages between it and the other nodes
+at the transport layer (partition), and measures:
+
+- time_to_leader: until another node is leader
+- time_to_acquire: until an acquire submitted after the fault succeeds
+- time_to_recover: until the old leader, restarted or reconnected, has
+  caught up with the new leader's commit index
+- lost: requests that got no answer within --request-timeout
+- retried: requests that failed, for example for lack of a leader, and
+  were retried on another node
+
+Clients stop using a node once it is taken out, like a client that fails
+over to another address. Results are reported as percentiles over the
+trials, and with --json written per trial with a histogram per measure,
+for tuning election timeouts and comparing runs.
+
+Usage:
+    python -m benchmarks.failover [--nodes 3] [--trials 20] [--fault kill|partition|both]
+                                  [--election-timeout 0.4,1.4] [--clients 8] [--json results.json]
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pysyncobj.tcp_connection import CONNECTION_STATE
+from benchmarks.load import histogram, percentile
+from src.lock_service import ELECTION_TIMEOUT, LockService
+from src.transport import ContactTrackingTransport
+
+logging.disable(logging.WARNING)
+
+FAULT_KILL = "kill"
+FAULT_PARTITION = "partition"
+MEASURES = ("time_to_leader", "time_to_acquire", "time_to_recover", "lost", "retried")
+# Seconds between checks while waiting for the cluster
+POLL_INTERVAL = 0.005
+# Seconds a failed request waits before it is retried
+RETRY_DELAY = 0.01
+
+
+class PartitionableTransport(ContactTrackingTransport):
+    """Raft transport that can be cut off from some nodes
+
+    Connections to the nodes in partitioned are closed on the next tick and
+    not made again until they are taken out. Messages in flight until then
+    are dropped."""
+
+    partitioned: frozenset[str] = frozenset()
+
+    def _onTick(self):
+        for node, connection in list(self._connections.items()):
+            if node.id in self.partitioned and connection.state != CONNECTION_STATE.DISCONNECTED:
+                connection.disconnect()
+        super()._onTick()
+
+    def _shouldConnect(self, node):
+        return node.id not in self.partitioned and super()._shouldConnect(node)
+
+    def _onIncomingMessageReceived(self, conn, message):
+        # The first message of an incoming connection is the address of the node
+        if isinstance(message, str) and message in self.partitioned:
+            conn.disconnect()
+            self._unknownConnections.discard(conn)
+            return
+        super()._onIncomingMessageReceived(conn, message)
+
+    def send(self, node, message):
+        if node.id in self.partitioned:
+            return False
+        return super().send(node, message)
+
+    def _onMessageReceived(self, node, message):
+        if node.id in self.partitioned:
+            return
+        super()._onMessageReceived(node, message)
+
+
+class PartitionableLockService(LockService):
+    """LockService whose Raft messages to and from chosen nodes are dropped"""
+    transport_class = PartitionableTransport
+
+    def set_partitioned(self, nodes: list[str])->None:
+        """Drop Raft messages to and from the nodes, an empty list heals the partition"""
+        self._SyncObj__transport.partitioned = frozenset(nodes)
+
+
+class Cluster:
+    """Nodes of a local cluster that can be taken out and brought back"""
+
+    def __init__(self, addresses: list[str], election_timeout: tuple[float, float]):
+        self.addresses = addresses
+        self.election_timeout = election_timeout
+        self.nodes = {address: self._start(address) for address in addresses}
+        # Nodes clients may send requests to
+        self.available = list(addresses)
+
+    def _start(self, address: str)->PartitionableLockService:
+        partners = [a for a in self.addresses if a != address]
+        return PartitionableLockService(address, partners, election_timeout=self.election_timeout)
+
+    def leader(self)->str:
+        """Get the address of an available node that is leader, wait for one"""
+        while True:
+            for address in list(self.available):
+                if self.nodes[address].is_leader():
+                    return address
+            time.sleep(POLL_INTERVAL)
+
+    def wait_settled(self, timeout: float = 30.0)->None:
+        """Wait until every node is ready and has applied the leader's commit index"""
+        deadline = time.monotonic() + timeout
+        leader = self.nodes[self.leader()]
+        while True:
+            commit_index = leader.raftCommitIndex
+            if all(node.is_ready() and node.raftLastApplied >= commit_index for node in self.nodes.values()):
+                return
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Cluster did not settle within {timeout}s")
+            time.sleep(POLL_INTERVAL)
+
+    def kill(self, address: str)->None:
+        self.available.remove(address)
+        self.nodes[address].destroy()
+
+    def restart(self, address: str)->PartitionableLockService:
+        self.nodes[address] = self._start(address)
+        self.available.append(address)
+        return self.nodes[address]
+
+    def partition(self, address: str)->None:
+        """Cut the node off from all others"""
+        self.available.remove(address)
+        others = [a for a in self.addresses if a != address]
+        self.nodes[address].set_partitioned(others)
+        for other in others:
+            self.nodes[other].set_partitioned([address])
+
+    def heal(self, address: str)->PartitionableLockService:
+        for node in self.nodes.values():
+            node.set_partitioned([])
+        self.available.append(address)
+        return self.nodes[address]
+
+    def destroy(self)->None:
+        for node in self.nodes.values():
+            node.destroy()
+
+
+class Clients:
+    """Client threads acquiring and releasing locks on any available node
+
+    Every request is logged as (started, finished, operation, outcome),
+    outcome being ok, error or timeout."""
+
+    def __init__(self, cluster: Cluster, clients: int, request_timeout: float):
+        self.__cluster = cluster
+        self.__request_timeout = request_timeout
+        self.__stopped = threading.Event()
+        self.log: list[tuple[float, float, str, str]] = []
+        leader = cluster.nodes[cluster.leader()]
+        sessions = [leader.create_session(f"failover-{i}", timeout=3600) for i in range(clients)]
+        self.__threads = [threading.Thread(target=self._run, args=(i, session_id), daemon=True)
+                          for i, session_id in enumerate(sessions)]
+        for thread in self.__threads:
+            thread.start()
+
+    def _request(self, operation: str, call, *args):
+        """Send a request to a random available node until it is answered or times out"""
+        rng = random.Random()
+        while not self.__stopped.is_set():
+            node = self.__cluster.nodes[rng.choice(self.__cluster.available)]
+            started = time.monotonic()
+            try:
+                result = getattr(node, call)(*args).result(timeout=self.__request_timeout)
+            except FutureTimeoutError:
+                self.log.append((started, time.monotonic(), operation, "timeout"))
+                return None
+            except Exception:
+                self.log.append((started, time.monotonic(), operation, "error"))
+                time.sleep(RETRY_DELAY)
+                continue
+            self.log.append((started, time.monotonic(), operation, "ok"))
+            return result
+        return None
+
+    def _run(self, index: int, session_id: str)->None:
+        count = 0
+        while not self.__stopped.is_set():
+            count += 1
+            # A fresh resource each time, an acquire that timed out may still have been granted
+            resource = f"failover/{index}/{count}"
+            fence_token = self._request("acquire", "acquire_lock_async", session_id, resource)
+            if fence_token:
+                self._request("release", "release_lock_async", session_id, resource, fence_token)
+
+    def stop(self)->None:
+        self.__stopped.set()
+        for thread in self.__threads:
+            thread.join()
+
+
+def wait_for(condition, timeout: float)->None:
+    """Wait until condition holds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Timed out after {timeout}s")
+        time.sleep(POLL_INTERVAL)
+
+
+def run_trial(cluster: Cluster, clients: Clients, fault: str, request_timeout: float, trial_timeout: float)->dict:
+    """Take out the leader, measure until the cluster serves again and the old leader caught up"""
+    cluster.wait_settled()
+    old_leader = cluster.leader()
+    log_start = len(clients.log)
+    fault_time = time.monotonic()
+    if fault == FAULT_KILL:
+        cluster.kill(old_leader)
+    else:
+        cluster.partition(old_leader)
+
+    def new_leader():
+        return any(cluster.nodes[address].is_leader() for address in cluster.available)
+    wait_for(new_leader, trial_timeout)
+    time_to_leader = time.monotonic() - fault_time
+
+    def acquired():
+        return any(started >= fault_time and operation == "acquire" and outcome == "ok"
+                   for started, _, operation, outcome in clients.log[log_start:])
+    wait_for(acquired, trial_timeout)
+    time_to_acquire = min(finished for started, finished, operation, outcome in clients.log[log_start:]
+                          if started >= fault_time and operation == "acquire" and outcome == "ok") - fault_time
+    # Requests in flight at the fault take up to request_timeout to be given up
+    time.sleep(request_timeout)
+    requests = clients.log[log_start:]
+
+    recover_time = time.monotonic()
+    node = cluster.restart(old_leader) if fault == FAULT_KILL else cluster.heal(old_leader)
+    leader = cluster.nodes[cluster.leader()]
+    commit_index = leader.raftCommitIndex
+    wait_for(lambda: node.raftLastApplied >= commit_index and node.get_leader() is not None, trial_timeout)
+    return {
+        "fault": fault,
+        "old_leader": old_leader,
+        "new_leader": str(leader.selfNode),
+        "time_to_leader": time_to_leader,
+        "time_to_acquire": time_to_acquire,
+        "time_to_recover": time.monotonic() - recover_time,
+        "lost": sum(1 for request in requests if request[3] == "timeout"),
+        "retried": sum(1 for request in requests if request[3] == "error"),
+        "requests": len(requests),
+    }
+
+
+def summarize(trials: list[dict])->dict:
+    """Get percentiles and a histogram of each measure over the trials, times in milliseconds"""
+    summary = {}
+    for measure in MEASURES:
+        scale = 1 if measure in ("lost", "retried") else 1000
+        values = sorted(trial[measure] * scale for trial in trials)
+        summary[measure] = {
+            "mean": sum(values) / len(values),
+            **{f"p{p}": percentile(values, p) for p in (50, 90, 99)},
+            "max": values[-1],
+        }
+        if scale != 1:
+            # histogram takes seconds and buckets by microseconds
+            summary[measure]["histogram_us"] = histogram([value / scale for value in values])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--fault", choices=(FAULT_KILL, FAULT_PARTITION, "both"), default="both",
+                        help="both alternates between the two")
+    parser.add_argument("--election-timeout", default=",".join(str(t) for t in ELECTION_TIMEOUT),
+                        help="Election timeout range in seconds, min,max")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--request-timeout", type=float, default=2.0)
+    parser.add_argument("--trial-timeout", type=float, default=30.0)
+    parser.add_argument("--base-port", type=int, default=14900)
+    parser.add_argument("--json", help="Write the results to this file, - for stdout")
+    args = parser.parse_args()
+
+    election_timeout = tuple(float(t) for t in args.election_timeout.split(","))
+    faults = [FAULT_KILL, FAULT_PARTITION] if args.fault == "both" else [args.fault]
+    addresses = [f"localhost:{args.base_port + i}" for i in range(args.nodes)]
+    cluster = Cluster(addresses, election_timeout)
+    trials = []
+    try:
+        cluster.wait_settled()
+        clients = Clients(cluster, args.clients, args.request_timeout)
+        print(f"{'trial':>5} {'fault':<10} {'leader ms':>10} {'acquire ms':>11} {'recover ms':>11} {'lost':>5} {'retried':>8}")
+        for i in range(args.trials):
+            trial = run_trial(cluster, clients, faults[i % len(faults)], args.request_timeout, args.trial_timeout)
+            trials.append(trial)
+            print(f"{i + 1:>5} {trial['fault']:<10} {trial['time_to_leader'] * 1000:>10.0f} "
+                  f"{trial['time_to_acquire'] * 1000:>11.0f} {trial['time_to_recover'] * 1000:>11.0f} "
+                  f"{trial['lost']:>5} {trial['retried']:>8}")
+        clients.stop()
+    finally:
+        cluster.destroy()
+
+    summaries = {fault: summarize([t for t in trials if t["fault"] == fault])
+                 for fault in faults if any(t["fault"] == fault for t in trials)}
+    for fault, summary in summaries.items():
+        print(f"\n{fault:<16} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+        for measure, stats in summary.items():
+            unit = "" if measure in ("lost", "retried") else " ms"
+            print(f"{measure + unit:<16} {stats['mean']:>8.0f} {stats['p50']:>8.0f} {stats['p90']:>8.0f} "
+                  f"{stats['p99']:>8.0f} {stats['max']:>8.0f}")
+
+    results = {
+        "config": {
+            "nodes": args.nodes,
+            "trials": args.trials,
+            "fault": args.fault,
+            "election_timeout": election_timeout,
+            "clients": args.clients,
+            "request_timeout": args.request_timeout,
+        },
+        "summary": summaries,
+        "trials": trials,
+    }
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
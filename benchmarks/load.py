@@ -0,0 +1,314 @@
+"""Drive a local cluster with a mix of lock service operations and report throughput and latency
+
+Starts --nodes LockService nodes on loopback ports, either all in this
+process or with every node but the first in its own process (--processes).
+Clients run on the first node, which is given the shortest election
+timeout so it usually leads. With --groups the group leaders are spread
+over the nodes, and the first node forwards writes to the others.
+
+Each client thread owns a session and repeatedly picks an operation by
+the weights of --mix:
+
+- create_session: create a session, deleted again when the run ends
+- keepalive: extend the client's session
+- acquire: lock a resource of the client's own, then release it
+- acquire_contended: try to lock one of --contended-resources shared
+  resources without waiting, release it if it was granted
+
+Every acquire that was granted is followed by a release, timed as its own
+operation. Operations in the first --warmup seconds are not recorded.
+
+Prints throughput and p50/p99/p999 latency per operation, and with --json
+writes the configuration and results, including a latency histogram per
+operation, for comparing runs. --baseline prints the change against the
+JSON of an earlier run.
+
+Usage:
+    python -m benchmarks.load [--nodes 3] [--processes] [--groups 1] [--clients 32] [--duration 10]
+                              [--mix create_session=1,keepalive=4,acquire=4,acquire_contended=1]
+                              [--json results.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from src.lock_service import BATCH_MAX_OPS, ELECTION_TIMEOUT, LockService
+from src.sharding import ShardedLockService
+
+logging.disable(logging.WARNING)
+
+OPERATIONS = ("create_session", "keepalive", "acquire", "acquire_contended")
+DEFAULT_MIX = "create_session=1,keepalive=4,acquire=4,acquire_contended=1"
+PERCENTILES = (50, 90, 99, 99.9)
+# Election timeout of the nodes other than the first, so the first one wins
+FOLLOWER_ELECTION_TIMEOUT = (ELECTION_TIMEOUT[1], ELECTION_TIMEOUT[1] + 1.0)
+# Sessions deleted at once after the run, well within the admission budget
+CLEANUP_CHUNK = 256
+
+
+def parse_mix(mix: str)->dict[str, float]:
+    """Parse operation weights given as name=weight,..."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name}, expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight) if weight else 1.0
+        if weights[name] < 0:
+            raise ValueError(f"Weight of {name} must not be negative, got {weight}")
+    if not any(weights.values()):
+        raise ValueError("At least one operation needs a positive weight")
+    return weights
+
+
+def percentile(samples: list[float], p: float)->float:
+    """Get the p-th percentile of sorted samples, nearest rank"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+def histogram(samples: list[float])->dict[str, int]:
+    """Count sorted latency samples in power of two buckets, keyed by the bucket's upper bound in microseconds"""
+    buckets = {}
+    for sample in samples:
+        bound = 1 << max(0, math.ceil(math.log2(max(sample * 1e6, 1))))
+        buckets[bound] = buckets.get(bound, 0) + 1
+    return {str(bound): count for bound, count in sorted(buckets.items())}
+
+
+def summarize(samples: list[float], errors: int, elapsed: float)->dict:
+    """Get the throughput and latency statistics of one operation, latencies in milliseconds"""
+    samples.sort()
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "ops_per_sec": len(samples) / elapsed,
+        "mean_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        **{f"p{p:g}_ms".replace(".", ""): percentile(samples, p) * 1000 for p in PERCENTILES},
+        "max_ms": samples[-1] * 1000 if samples else 0.0,
+        "histogram_us": histogram(samples),
+    }
+
+
+class Recorder:
+    """Latency samples and error counts of one client thread, so clients never share a lock"""
+
+    def __init__(self, record_after: float):
+        self.record_after = record_after
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.outcomes: dict[str, int] = {}
+
+    def timed(self, name: str, call, *args):
+        """Run call, record its latency under name and return its result, None if it raised"""
+        start = time.monotonic()
+        try:
+            result = call(*args)
+        except Exception:
+            if start >= self.record_after:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        if start >= self.record_after:
+            self.samples.setdefault(name, []).append(time.monotonic() - start)
+        return result
+
+    def count(self, outcome: str)->None:
+        if time.monotonic() >= self.record_after:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+
+def run_client(node, index: int, weights: dict[str, float], contended: int,
+               deadline: float, recorder: Recorder, created: list[str])->None:
+    """Issue operations picked by weight until deadline"""
+    rng = random.Random(index)
+    names = list(weights)
+    cumulative = [sum(list(weights.values())[:i + 1]) for i in range(len(names))]
+    session_id = node.create_session(f"load-{index}", timeout=600)
+    own = 0
+    while time.monotonic() < deadline:
+        name = rng.choices(names, cum_weights=cumulative)[0]
+        if name == "create_session":
+            new_session = recorder.timed(name, node.create_session, f"load-{index}", 600)
+            if new_session:
+                created.append(new_session)
+        elif name == "keepalive":
+            recorder.timed(name, node.keepalive, session_id)
+        else:
+            if name == "acquire":
+                own += 1
+                resource = f"load/{index}/{own}"
+            else:
+                resource = f"load/contended/{rng.randrange(contended)}"
+            fence_token = recorder.timed(name, node.acquire_lock, session_id, resource)
+            if name == "acquire_contended":
+                recorder.count("contended_granted" if fence_token else "contended_busy")
+            if fence_token:
+                recorder.timed("release", node.release_lock, session_id, resource, fence_token)
+    created.append(session_id)
+
+
+def start_node(address: str, partners: list[str], groups: int, election_timeout: tuple[float, float],
+               batch_max_ops: int):
+    if groups > 1:
+        # Groups spread their leaders over the nodes, see ShardedLockService
+        return ShardedLockService(address, partners, groups, batch_max_ops=batch_max_ops)
+    return LockService(address, partners, election_timeout=election_timeout, batch_max_ops=batch_max_ops)
+
+
+def serve(address: str, partners: list[str], groups: int, batch_max_ops: int)->None:
+    """Run a node until stdin is closed, the node of a --processes run"""
+    node = start_node(address, partners, groups, FOLLOWER_ELECTION_TIMEOUT, batch_max_ops)
+    sys.stdin.read()
+    node.destroy()
+
+
+def start_cluster(args)->tuple[object, list, list]:
+    """Start the nodes, return the node clients run on, the other in-process nodes and the node processes"""
+    addresses = [f"localhost:{args.base_port + i * args.port_stride}" for i in range(args.nodes)]
+    processes, others = [], []
+    for i, address in enumerate(addresses[1:], start=1):
+        partners = [a for a in addresses if a != address]
+        if args.processes:
+            command = [sys.executable, "-m", "benchmarks.load", "--serve", address,
+                       "--partners", ",".join(partners), "--groups", str(args.groups),
+                       "--batch-max-ops", str(args.batch_max_ops)]
+            processes.append(subprocess.Popen(command, stdin=subprocess.PIPE))
+        else:
+            others.append(start_node(address, partners, args.groups, FOLLOWER_ELECTION_TIMEOUT,
+                                     args.batch_max_ops))
+    node = start_node(addresses[0], addresses[1:], args.groups, ELECTION_TIMEOUT, args.batch_max_ops)
+    groups = node.groups if args.groups > 1 else [node]
+    deadline = time.monotonic() + 30
+    while any(group.get_leader() is None for group in groups) or not node.is_ready():
+        if time.monotonic() > deadline:
+            raise RuntimeError("No leader was elected within 30s")
+        time.sleep(0.1)
+    return node, others, processes
+
+
+def compare(results: dict, baseline: dict)->None:
+    """Print the change of throughput and p99 latency against an earlier run"""
+    print(f"\n{'vs baseline':<20} {'ops/sec':>10} {'p99':>10}")
+    for name, stats in results["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before["ops_per_sec"] or not before["p99_ms"]:
+            continue
+        throughput = (stats["ops_per_sec"] / before["ops_per_sec"] - 1) * 100
+        p99 = (stats["p99_ms"] / before["p99_ms"] - 1) * 100
+        print(f"{name:<20} {throughput:>+9.1f}% {p99:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=1)
+    parser.add_argument("--processes", action="store_true", help="Run the nodes but the first in processes of their own")
+    parser.add_argument("--groups", type=int, default=1, help="Raft groups per node")
+    parser.add_argument("--base-port", type=int, default=14500)
+    parser.add_argument("--port-stride", type=int, default=100, help="Port distance between nodes")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--contended-resources", type=int, default=4)
+    parser.add_argument("--batch-max-ops", type=int, default=BATCH_MAX_OPS)
+    parser.add_argument("--json", help="Write the results to this file, - for stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--partners", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, [p for p in args.partners.split(",") if p], args.groups, args.batch_max_ops)
+        return
+    weights = parse_mix(args.mix)
+
+    node, others, processes = start_cluster(args)
+    try:
+        start = time.monotonic()
+        record_after = start + args.warmup
+        deadline = record_after + args.duration
+        recorders = [Recorder(record_after) for _ in range(args.clients)]
+        created: list[str] = []
+        threads = [threading.Thread(target=run_client,
+                                    args=(node, i, weights, args.contended_resources, deadline, recorders[i], created))
+                   for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - record_after
+        for i in range(0, len(created), CLEANUP_CHUNK):
+            for future in [node.delete_session_async(session_id) for session_id in created[i:i + CLEANUP_CHUNK]]:
+                future.result()
+    finally:
+        node.destroy()
+        for other in others:
+            other.destroy()
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    outcomes: dict[str, int] = {}
+    for recorder in recorders:
+        for name, values in recorder.samples.items():
+            samples.setdefault(name, []).extend(values)
+        for name, count in recorder.errors.items():
+            errors[name] = errors.get(name, 0) + count
+        for name, count in recorder.outcomes.items():
+            outcomes[name] = outcomes.get(name, 0) + count
+    operations = {name: summarize(samples.get(name, []), errors.get(name, 0), elapsed)
+                  for name in (*OPERATIONS, "release") if name in samples or name in errors}
+    results = {
+        "config": {
+            "nodes": args.nodes,
+            "processes": args.processes,
+            "groups": args.groups,
+            "clients": args.clients,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": weights,
+            "contended_resources": args.contended_resources,
+            "batch_max_ops": args.batch_max_ops,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "total_ops_per_sec": sum(len(values) for values in samples.values()) / elapsed,
+        "outcomes": outcomes,
+        "operations": operations,
+    }
+
+    print(f"{'operation':<20} {'ops/sec':>10} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'errors':>7}")
+    for name, stats in operations.items():
+        print(f"{name:<20} {stats['ops_per_sec']:>10.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['p999_ms']:>8.2f} {stats['errors']:>7}")
+    print(f"{'total':<20} {results['total_ops_per_sec']:>10.1f}")
+    if outcomes:
+        print(", ".join(f"{name}: {count}" for name, count in sorted(outcomes.items())))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Measure memory per session and lock, and snapshot size and time, for the state layouts
+
+Builds the replicated state for --count sessions holding one lock each,
+in the old layout (a dict per session and lock, lists of held locks) and
+in the slotted record layout the state machine uses now, then compares:
+
+- bytes per session and per lock, measured with tracemalloc
+- size and time of a pysyncobj default snapshot (gzipped pickle) of each
+- size and time of the compact binary snapshot of src/snapshot.py
+
+Usage:
+    python -m benchmarks.memory [--count 1000000] [--clients 1000]
+"""
+import argparse
+import gc
+import gzip
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from src.records import Lock, Session
+from src.snapshot import write_snapshot
+
+# The raft metadata a custom serializer receives, contents do not matter here
+RAFT_META = ((b"\x00", 2, 1), (b"\x00", 1, 1), {"localhost:4321"})
+
+
+def dict_sessions(count: int, clients: int)->dict:
+    """Build sessions in the old layout, a dict per record"""
+    sessions = {}
+    now = time.time()
+    for i in range(count):
+        session_id = str(uuid.uuid4())
+        sessions[session_id] = {
+            "session_id": session_id,
+            "client_id": f"client-{i % clients}",
+            "timeout": 60,
+            "created_at": now + i * 1e-4,
+            "last_keepalive": now + i * 1e-4,
+            "expires_at": now + i * 1e-4 + 60,
+            "locks_held": [],
+            "waiting_on": [],
+        }
+    return sessions
+
+
+def dict_locks(sessions: dict)->dict:
+    """Give every session one lock in the old layout"""
+    locks = {}
+    now = time.time()
+    for i, session in enumerate(sessions.values()):
+        resource = f"resource-{i}"
+        locks[resource] = {
+            "resource": resource,
+            "session_id": session['session_id'],
+            "fence_token": i + 1,
+            "acquired_at": now + i * 1e-4,
+        }
+        session['locks_held'].append(resource)
+    return locks
+
+
+def record_sessions(count: int, clients: int)->dict:
+    """Build sessions the way the state machine does, as slotted records"""
+    sessions = {}
+    now = time.time()
+    for i in range(count):
+        session_id = str(uuid.uuid4())
+        created_at = now + i * 1e-4
+        sessions[session_id] = Session(session_id, sys.intern(f"client-{i % clients}"), 60,
+                                       created_at, created_at, created_at + 60)
+    return sessions
+
+
+def record_locks(sessions: dict)->dict:
+    """Give every session one lock, as slotted records"""
+    locks = {}
+    now = time.time()
+    for i, session in enumerate(sessions.values()):
+        resource = f"resource-{i}"
+        locks[resource] = Lock(resource, session.session_id, i + 1, now + i * 1e-4)
+        session.locks_held[resource] = None
+    return locks
+
+
+def measure(build_sessions, build_locks, count: int, clients: int)->tuple[dict, float, float]:
+    """Build the state under tracemalloc, return (state, bytes per session, bytes per lock)
+
+    Session IDs and resource names are counted, they are part of the state."""
+    gc.collect()
+    tracemalloc.start()
+    sessions = build_sessions(count, clients)
+    sessions_bytes, _ = tracemalloc.get_traced_memory()
+    locks = build_locks(sessions)
+    total_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"sessions": sessions, "locks": locks}, sessions_bytes / count, (total_bytes - sessions_bytes) / count
+
+
+def pickle_snapshot(path: str, state: dict)->None:
+    """pysyncobj's default snapshot, a gzipped pickle of the state"""
+    with open(path, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as g:
+            pickle.dump(state, g)
+
+
+def binary_snapshot(path: str, state: dict)->None:
+    write_snapshot(path, RAFT_META, {
+        **state,
+        "fence_counter": len(state['locks']),
+        "lease_grace_start": 0.0,
+        "waiters": {},
+    })
+
+
+def timed(write, path: str, state: dict)->tuple[float, int]:
+    start = time.perf_counter()
+    write(path, state)
+    return time.perf_counter() - start, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--clients", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot")
+        print(f"{'layout':>8} {'B/session':>10} {'B/lock':>8} {'snapshot':>10} {'MB':>8} {'seconds':>8}")
+        layouts = (("dict", dict_sessions, dict_locks), ("records", record_sessions, record_locks))
+        for name, build_sessions, build_locks in layouts:
+            state, per_session, per_lock = measure(build_sessions, build_locks, args.count, args.clients)
+            writers = [("pickle", pickle_snapshot)]
+            if name == "records":
+                writers.append(("binary", binary_snapshot))
+            for snapshot, write in writers:
+                seconds, size = timed(write, path, state)
+                print(f"{name:>8} {per_session:>10.0f} {per_lock:>8.0f} {snapshot:>10} {size / 1e6:>8.1f} {seconds:>8.2f}")
+            del state
+            gc.collect()
+
+
+if __name__ == '__main__':
+    main()
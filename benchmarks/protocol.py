@@ -0,0 +1,233 @@
+"""Compare the server CPU cost per operation of the REST API and the binary protocol
+
+Runs a single node in a subprocess serving the REST API, from Flask (rest)
+or aiohttp (rest-async), and the binary protocol (binary) on its own port,
+with logging off so it does not dominate. --clients threads acquire and
+release locks of their own through each path in turn, for --duration
+seconds after --warmup, and the node's CPU time is read from /proc.
+
+The direct path calls the LockService of an in-process node with the same
+load and no protocol at all. Its CPU per operation is the cost of Raft and
+the state machine, so the CPU a path spends above it is what parsing,
+framing and the HTTP or TCP server cost.
+
+Prints throughput, p50/p99 latency, CPU microseconds per operation and the
+protocol overhead per operation of each path. --json writes the results.
+
+Usage:
+    python -m benchmarks.protocol [--paths direct,rest,rest-async,binary] [--clients 16]
+                                  [--duration 5] [--json protocol.json]
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from benchmarks.load import summarize
+from src.binary_client import BinaryLockClient
+from src.client import LockClient
+from src.lock_service import LockService
+
+logging.disable(logging.WARNING)
+
+PATHS = ("direct", "rest", "rest-async", "binary")
+SERVER_MODES = {"rest": "flask", "rest-async": "async", "binary": "flask"}
+
+
+def serve(raft_port: int, api_port: int, binary_port: int, server_mode: str)->None:
+    """Run the node of a path until the process is killed"""
+    from src.binary_protocol import BinaryProtocolServer
+    lock_service = LockService(f"localhost:{raft_port}", [])
+    BinaryProtocolServer(lock_service, binary_port, host="localhost")
+    if server_mode == "async":
+        from src.async_app import create_async_app
+        from aiohttp import web
+        web.run_app(create_async_app(lock_service), host="localhost", port=api_port, print=None, access_log=None)
+    else:
+        from src.app import create_app
+        create_app(lock_service).run(host="localhost", port=api_port, threaded=True)
+
+
+def cpu_seconds(pid: int)->float:
+    """Get the user and system CPU time of a process"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15, counted after the command name
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def wait_for_port(port: int, timeout: float = 30.0)->None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Nothing listens on port {port} after {timeout}s")
+            time.sleep(0.1)
+
+
+class DirectClient:
+    """The calls of a client, straight to an in-process LockService"""
+
+    def __init__(self, lock_service: LockService):
+        self.__lock_service = lock_service
+
+    def create_session(self, client_id: str)->str:
+        return self.__lock_service.create_session(client_id, 3600)
+
+    def acquire(self, session_id: str, resource: str)->int:
+        return self.__lock_service.acquire_lock_async(session_id, resource).result()
+
+    def release(self, session_id: str, resource: str, fence_token: int)->None:
+        self.__lock_service.release_lock_async(session_id, resource, fence_token).result()
+
+
+class RestClient:
+    def __init__(self, client: LockClient):
+        self.__client = client
+
+    def create_session(self, client_id: str)->str:
+        return self.__client.session(client_id, timeout=3600, keepalive=False).session_id
+
+    def acquire(self, session_id: str, resource: str)->int:
+        return self.__client.call("POST", f"/sessions/{session_id}/locks/{resource}", {},
+                                  resource=resource)["fence_token"]
+
+    def release(self, session_id: str, resource: str, fence_token: int)->None:
+        self.__client.call("DELETE", f"/sessions/{session_id}/locks/{resource}", {"fence_token": fence_token},
+                           resource=resource)
+
+
+class BinaryClient:
+    def __init__(self, client: BinaryLockClient):
+        self.__client = client
+
+    def create_session(self, client_id: str)->str:
+        return self.__client.create_session(client_id, 3600)
+
+    def acquire(self, session_id: str, resource: str)->int:
+        return self.__client.acquire(session_id, resource)
+
+    def release(self, session_id: str, resource: str, fence_token: int)->None:
+        self.__client.release(session_id, resource, fence_token)
+
+
+def run_load(client, clients: int, warmup: float, duration: float, cpu)->dict:
+    """Acquire and release from client threads, return throughput, latency and CPU per operation"""
+    sessions = [client.create_session(f"protocol-{i}") for i in range(clients)]
+    samples: list[list[float]] = [[] for _ in range(clients)]
+    errors = [0] * clients
+    started = time.monotonic()
+    record_after = started + warmup
+    deadline = record_after + duration
+
+    def run(index: int):
+        count = 0
+        while True:
+            start = time.monotonic()
+            if start >= deadline:
+                return
+            count += 1
+            resource = f"protocol/{index}/{count}"
+            try:
+                fence_token = client.acquire(sessions[index], resource)
+                acquired = time.monotonic()
+                client.release(sessions[index], resource, fence_token)
+            except Exception:
+                errors[index] += 1
+                continue
+            if start >= record_after:
+                samples[index].extend((acquired - start, time.monotonic() - acquired))
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(max(0.0, record_after - time.monotonic()))
+    cpu_before = cpu()
+    for thread in threads:
+        thread.join()
+    cpu_after = cpu()
+    result = summarize([sample for client_samples in samples for sample in client_samples], sum(errors), duration)
+    result["cpu_us_per_op"] = (cpu_after - cpu_before) / max(result["count"], 1) * 1e6
+    return result
+
+
+def run_path(path: str, args)->dict:
+    if path == "direct":
+        lock_service = LockService(f"localhost:{args.base_port}", [])
+        try:
+            while not lock_service.is_ready():
+                time.sleep(0.1)
+            return run_load(DirectClient(lock_service), args.clients, args.warmup, args.duration, time.process_time)
+        finally:
+            lock_service.destroy()
+
+    raft_port, api_port, binary_port = args.base_port + 1, args.base_port + 2, args.base_port + 3
+    command = [sys.executable, "-m", "benchmarks.protocol", "--serve", SERVER_MODES[path],
+               "--base-port", str(args.base_port)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(binary_port)
+        wait_for_port(api_port)
+        if path == "binary":
+            client = BinaryClient(BinaryLockClient(f"localhost:{binary_port}"))
+        else:
+            client = RestClient(LockClient(f"localhost:{api_port}", pool_size=args.clients))
+        # The node leads once it answers a write
+        client.create_session("protocol-ready")
+        return run_load(client, args.clients, args.warmup, args.duration, lambda: cpu_seconds(process.pid))
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", default=",".join(PATHS), help=f"Comma separated, of {', '.join(PATHS)}")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--base-port", type=int, default=14700)
+    parser.add_argument("--json", help="Write the results to this file, - for stdout")
+    parser.add_argument("--serve", choices=("flask", "async"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.base_port + 1, args.base_port + 2, args.base_port + 3, args.serve)
+        return
+
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    for path in paths:
+        if path not in PATHS:
+            parser.error(f"Unknown path {path}, expected one of {', '.join(PATHS)}")
+    results = {path: run_path(path, args) for path in paths}
+
+    floor = results["direct"]["cpu_us_per_op"] if "direct" in results else None
+    print(f"{'path':<12} {'ops/sec':>9} {'p50 ms':>8} {'p99 ms':>8} {'cpu us/op':>10} {'overhead us/op':>15}")
+    for path, stats in results.items():
+        if floor is not None:
+            stats["overhead_us_per_op"] = stats["cpu_us_per_op"] - floor
+        overhead = f"{stats['overhead_us_per_op']:>15.0f}" if floor is not None else f"{'-':>15}"
+        print(f"{path:<12} {stats['ops_per_sec']:>9.0f} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+              f"{stats['cpu_us_per_op']:>10.0f} {overhead}")
+
+    output = {
+        "config": {"clients": args.clients, "duration": args.duration, "warmup": args.warmup},
+        "paths": results,
+    }
+    if args.json == "-":
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
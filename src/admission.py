@@ -0,0 +1,106 @@
+import math
+import threading
+from .metrics import ADMISSION_REJECTIONS
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# Replicated writes a node lets wait for their commit at once
+MAX_IN_FLIGHT_WRITES = 1024
+# Commit latency above which new work is turned away
+MAX_COMMIT_LATENCY = 0.5
+# Share of the in-flight budget new work may use, the rest is kept for
+# writes that keep sessions alive and free locks
+LOW_PRIORITY_SHARE = 0.75
+# Weight of the latest commit in the moving average of commit latency
+LATENCY_SMOOTHING = 0.05
+# Bounds of the time a rejected client is told to wait
+MIN_RETRY_AFTER = 0.1
+MAX_RETRY_AFTER = 10.0
+
+# Keepalives, releases and session deletes: admitted while any budget is left
+PRIORITY_HIGH = "high"
+# Acquires and session creation: new work, rejected first under load
+PRIORITY_LOW = "low"
+
+
+class Overloaded(Exception):
+    """A write was rejected because the node has too many writes waiting for their commit
+
+    retry_after is the time in seconds the client should wait before
+    trying again."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self)->str:
+        """Retry-After header value, whole seconds"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionController:
+    """Bounded budget of replicated writes waiting for their commit
+
+    A write is admitted while fewer than max_in_flight writes are pending,
+    low priority writes only up to low_priority_share of them. Low priority
+    writes are also turned away while the moving average of commit latency
+    is above max_commit_latency, so queues stop growing before the budget
+    runs out. Keepalives and releases get the rest of the budget, which
+    keeps sessions alive and locks moving when acquires saturate the node.
+
+    Rejections are immediate, the caller is told to retry after about the
+    current commit latency."""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_WRITES,
+                 max_commit_latency: float = MAX_COMMIT_LATENCY,
+                 low_priority_share: float = LOW_PRIORITY_SHARE):
+        if max_in_flight < 1:
+            raise ValueError(f"In-flight write budget must be at least 1, got {max_in_flight}")
+        self.max_in_flight = max_in_flight
+        self.max_commit_latency = max_commit_latency
+        self.__limits = {
+            PRIORITY_HIGH: max_in_flight,
+            PRIORITY_LOW: max(1, int(max_in_flight * low_priority_share)),
+        }
+        self.__rejections = {priority: ADMISSION_REJECTIONS.labels(priority) for priority in self.__limits}
+        self.__in_flight = 0
+        self.__commit_latency = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def in_flight(self)->int:
+        return self.__in_flight
+
+    @property
+    def commit_latency(self)->float:
+        """Moving average of the commit latency of admitted writes, in seconds"""
+        return self.__commit_latency
+
+    def retry_after(self)->float:
+        """Time a rejected client should wait, about the time the writes ahead of it take to commit"""
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, self.__commit_latency))
+
+    def admit(self, priority: str)->None:
+        """Take a slot of the budget, raises Overloaded when there is none for this priority
+
+        Every admitted write must be given back with done."""
+        with self.__lock:
+            if self.__in_flight >= self.__limits[priority]:
+                reason = f"{self.__in_flight} writes waiting for their commit"
+            elif (priority == PRIORITY_LOW and self.__in_flight
+                    and self.__commit_latency > self.max_commit_latency):
+                reason = f"commit latency of {self.__commit_latency * 1000:.0f}ms"
+            else:
+                self.__in_flight += 1
+                return
+        self.__rejections[priority].inc()
+        raise Overloaded(f"Node is overloaded, {reason}", self.retry_after())
+
+    def done(self, commit_seconds: float)->None:
+        """Give back the slot of a write that committed or failed after commit_seconds"""
+        with self.__lock:
+            self.__in_flight -= 1
+            self.__commit_latency += LATENCY_SMOOTHING * (commit_seconds - self.__commit_latency)
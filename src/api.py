@@ -0,0 +1,832 @@
+from dataclasses import dataclass, field
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from typing import Any, Callable, Generator, Optional
+import json
+import re
+import time
+from .admission import Overloaded
+from .config import get_node_config, get_admission_config, get_api_addresses, get_batching_config, get_sharding_config, get_storage_config
+from .forwarding import LeaderForwarder
+from .lock_service import LockService, READ_LINEARIZABLE, READ_STALE, DEFAULT_LIST_LIMIT, LOCK_EXCLUSIVE
+from .metrics import render_gauge, render_metrics
+from .profiler import DEFAULT_PROFILE_INTERVAL, DEFAULT_PROFILE_SECONDS, PROFILER, ProfilerBusy
+from .sharding import ShardedLockService
+from .watch import CursorExpired, DEFAULT_WATCH_LIMIT, DEFAULT_WATCH_TIMEOUT, MAX_WATCH_TIMEOUT, SSE_HEARTBEAT_INTERVAL, format_sse
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# How long a linearizable read may wait for the local apply to catch up
+READ_TIMEOUT = 5.0
+
+JSON_CONTENT_TYPE = "application/json"
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SSE_CONTENT_TYPE = "text/event-stream"
+
+
+# The REST handlers are written once, here, and served by both the Flask
+# app and the aiohttp app. A handler is a generator function taking the
+# lock service and an ApiRequest. It yields a Wait for every future it
+# needs the result of and a Blocking for every call that may block, and
+# returns an ApiResponse. Handlers that do neither are plain functions
+# that return it. The Flask app resolves them on the request thread, the
+# aiohttp app awaits them on the event loop.
+
+@dataclass(slots=True)
+class Wait:
+    """Wait for a lock service future, the handler gets its result
+
+    A timeout is thrown into the handler as FutureTimeoutError and leaves
+    the future running, handlers cancel it themselves if they have to."""
+    future: Future
+    timeout: Optional[float] = None
+
+
+@dataclass(slots=True)
+class Blocking:
+    """Run a call that blocks its thread, the handler gets its result"""
+    func: Callable
+    args: tuple = ()
+
+
+@dataclass(slots=True)
+class ApiResponse:
+    """Response of a handler
+
+    body is a JSON value, or text of the given content type. A stream
+    response sends the str chunks of stream as they are produced, and
+    stream may yield Wait like a handler."""
+    status: int
+    body: Any = None
+    headers: dict = field(default_factory=dict)
+    content_type: str = JSON_CONTENT_TYPE
+    stream: Optional[Generator] = None
+
+
+class ApiError(Exception):
+    """Ends a handler with an error response"""
+
+    def __init__(self, status: int, body: dict, headers: Optional[dict] = None):
+        super().__init__(body.get("error"))
+        self.response = ApiResponse(status, body, headers or {})
+
+
+@dataclass(slots=True)
+class ApiRequest:
+    """The parts of an HTTP request the handlers read
+
+    query and headers are the mappings of the web framework, headers is
+    case-insensitive."""
+    method: str
+    path: str
+    path_params: dict
+    query: Any
+    headers: Any
+    body: bytes
+    content_type: str
+
+    @property
+    def is_json(self)->bool:
+        return self.content_type == JSON_CONTENT_TYPE or self.content_type.endswith("+json")
+
+    def json(self):
+        """Parse the body as JSON, a 400 error if it is not valid"""
+        try:
+            return json.loads(self.body)
+        except ValueError as e:
+            raise ApiError(400, {
+                "error": "Request body is not valid JSON",
+                "reason": str(e),
+            })
+
+    def optional_json(self)->dict:
+        """Get the JSON object of an optional body, empty without one"""
+        if not self.body or not self.is_json:
+            return {}
+        data = self.json()
+        return data if isinstance(data, dict) else {}
+
+    def query_number(self, name: str, default, type_: type = float):
+        """Get a numeric query parameter, a 400 error if it is not a number"""
+        value = self.query.get(name)
+        if value is None:
+            return default
+        try:
+            return type_(value)
+        except ValueError:
+            raise ApiError(400, {
+                "error": f"Query parameter {name} must be a number",
+                name: value,
+            })
+
+
+def build_lock_service()->LockService:
+    """Start the Raft node configured by environment variables
+
+    With RAFT_GROUPS above 1 the node hosts that many Raft groups."""
+    current_node, partner_nodes = get_node_config()
+    service_config = {**get_storage_config(), **get_batching_config(), **get_admission_config()}
+    sharding_config = get_sharding_config()
+    if sharding_config["groups"] > 1:
+        return ShardedLockService(current_node, partner_nodes, **sharding_config, **service_config)
+    return LockService(current_node, partner_nodes, **service_config)
+
+def build_forwarder(lock_service: LockService)->LeaderForwarder:
+    """Create the leader forwarder for the nodes of the cluster"""
+    nodes = [str(lock_service.selfNode), *(str(node) for node in lock_service.otherNodes)]
+    api_addresses = get_api_addresses(nodes)
+    if isinstance(lock_service, ShardedLockService):
+        api_addresses = lock_service.group_api_addresses(api_addresses)
+    return LeaderForwarder(lock_service, api_addresses)
+
+def health_payload(lock_service: LockService)->dict:
+    """Health check body"""
+    return {
+        "service": "lock.io",
+        "status": "healthy",
+        "version": "0.1.0",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "is_leader": lock_service.is_leader(),
+        "leader": lock_service.get_leader(),
+        "is_ready": lock_service.is_ready(),
+    }
+
+def raft_status_payload(lock_service: LockService)->dict:
+    """Raft status of a single group"""
+    status = lock_service.getStatus()
+    states = ["FOLLOWER", "CANDIDATE", "LEADER"]
+
+    return {
+        "node": str(lock_service.selfNode),
+        "state": states[status['state']],
+        "leader": str(status['leader']) if status['leader'] else None,
+        "term": status['raft_term'],
+        "has_quorum": status['has_quorum'],
+        "is_ready": lock_service.is_ready(),
+        "uptime": status['uptime'],
+        "staleness_ms": lock_service.get_staleness_ms(),
+    }
+
+def cluster_status_payload(lock_service: LockService)->dict:
+    """Cluster status body
+
+    A sharded node reports its first group at the top level and every
+    group under groups."""
+    if isinstance(lock_service, ShardedLockService):
+        groups = [raft_status_payload(group) for group in lock_service.groups]
+        return {
+            **groups[0],
+            "is_ready": lock_service.is_ready(),
+            "groups": groups,
+            "stats": lock_service.get_stats(),
+        }
+    return {
+        **raft_status_payload(lock_service),
+        "stats": lock_service.get_stats(),
+    }
+
+def metrics_payload(lock_service: LockService)->str:
+    """Prometheus metrics body
+
+    The counters and histograms of the process plus gauges of the state
+    and of every Raft group, read at scrape time."""
+    stats = lock_service.get_stats()
+    groups = lock_service.groups if isinstance(lock_service, ShardedLockService) else [lock_service]
+    statuses = [({"group": str(i)}, group.getStatus()) for i, group in enumerate(groups)]
+    gauges = [
+        *render_gauge("lockio_sessions", "Sessions in the replicated state", [({}, stats['total_session'])]),
+        *render_gauge("lockio_expired_sessions", "Sessions past their lease not reaped yet",
+                      [({}, stats['expired_sessions'])]),
+        *render_gauge("lockio_locks", "Locked resources", [({}, stats['total_locks'])]),
+        *render_gauge("lockio_raft_is_leader", "1 if this node leads the group",
+                      [(labels, int(group.is_leader())) for (labels, _), group in zip(statuses, groups)]),
+        *render_gauge("lockio_raft_term", "Current Raft term",
+                      [(labels, status['raft_term']) for labels, status in statuses]),
+        *render_gauge("lockio_raft_commit_index", "Raft commit index",
+                      [(labels, status['commit_idx']) for labels, status in statuses]),
+        *render_gauge("lockio_raft_last_applied", "Last Raft log index applied to the state",
+                      [(labels, status['last_applied']) for labels, status in statuses]),
+        *render_gauge("lockio_raft_log_entries", "Raft log entries kept since the last snapshot",
+                      [(labels, status['log_len']) for labels, status in statuses]),
+        *render_gauge("lockio_writes_in_flight", "Client writes admitted and waiting for their commit",
+                      [({"group": str(i)}, group.writes_in_flight) for i, group in enumerate(groups)]),
+        *render_gauge("lockio_staleness_seconds", "Time since this node applied a known leader commit index",
+                      [({"group": str(i)}, group.get_staleness_ms() / 1000) for i, group in enumerate(groups)]),
+    ]
+    return render_metrics(gauges)
+
+def overloaded_response(error: Overloaded)->ApiResponse:
+    """503 answer to a write rejected by admission control"""
+    return ApiResponse(503, {
+        "error": str(error),
+        "retry_after_ms": round(error.retry_after * 1000),
+    }, {"Retry-After": error.retry_after_header})
+
+def error_response(error: Exception)->ApiResponse:
+    """Response of a handler that raised, re-raises errors that are not meant for the client"""
+    if isinstance(error, ApiError):
+        return error.response
+    if isinstance(error, Overloaded):
+        return overloaded_response(error)
+    raise error
+
+def forward_timeout(request: ApiRequest)->Optional[float]:
+    """Get the extra forwarding timeout of a request the leader has to serve, None to serve it here
+
+    Writes and linearizable reads go to the leader, a blocking acquire
+    may take its wait_timeout longer."""
+    is_write = request.method in ("POST", "DELETE")
+    if not is_write and request.query.get("consistency") != READ_LINEARIZABLE:
+        return None
+    wait_timeout = None
+    if request.body and request.is_json:
+        try:
+            data = request.json()
+        except ApiError:
+            # The leader answers it with a 400 all the same
+            data = None
+        wait_timeout = data.get("wait_timeout") if isinstance(data, dict) else None
+    try:
+        return float(wait_timeout or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def is_retryable(request: ApiRequest)->bool:
+    """Check if a request may be sent to the leader again after it may have been applied
+
+    Reads and writes with a request ID are, the leader applies those once."""
+    if request.method == "GET":
+        return True
+    try:
+        data = request.json() if request.body and request.is_json else None
+    except ApiError:
+        return False
+    return isinstance(data, dict) and isinstance(data.get("request_id"), str) and bool(data["request_id"])
+
+
+def get_request_data(request: ApiRequest, *required_fields)->dict:
+    """Get the JSON object body of a request, a 400 error if it is missing or lacks a field"""
+    if not request.is_json:
+        raise ApiError(400, {
+            "error": "Request must be of Content-Type application/json"
+        })
+    data = request.json()
+    if not isinstance(data, dict):
+        raise ApiError(400, {
+            "error": "Request body must be a JSON object"
+        })
+    missing_fields = [field for field in required_fields if field not in data]
+    if missing_fields:
+        raise ApiError(400, {
+            "error": "Required missing field",
+            "fields": missing_fields,
+        })
+    return data
+
+def check_request_id(lock_service: LockService, data: dict)->Optional[str]:
+    """Get the optional request_id of a write, a retry with the same one gets the first result"""
+    request_id = data.get("request_id")
+    try:
+        lock_service.check_request_id(request_id)
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+        })
+    return request_id
+
+def check_read_consistency(lock_service: LockService, request: ApiRequest):
+    """Honour the consistency and max_staleness_ms query parameters of a read
+
+    Without a consistency parameter the read is served from local state.
+    With several Raft groups, a read of a session is checked against the
+    group that owns the session, and the locks it holds in other groups are
+    as of this node's copy of them."""
+    consistency = request.query.get("consistency")
+    if consistency is None:
+        return
+    if consistency not in (READ_LINEARIZABLE, READ_STALE):
+        raise ApiError(400, {
+            "error": "Invalid consistency",
+            "consistency": consistency,
+            "allowed": [READ_LINEARIZABLE, READ_STALE],
+        })
+    max_staleness_ms = request.query_number("max_staleness_ms", None)
+    # A read of one resource or session only depends on the group that owns it
+    group = lock_service.route(request.path_params.get("resource"), request.path_params.get("session_id"))
+    try:
+        readable = yield Wait(group.read_barrier_async(consistency, max_staleness_ms), READ_TIMEOUT)
+    except FutureTimeoutError:
+        readable = False
+    if not readable:
+        raise ApiError(503, {
+            "error": "Read consistency not available on this node",
+            "consistency": consistency,
+            "leader": group.get_leader(),
+        })
+
+def invalid_session(session_id: str)->ApiResponse:
+    return ApiResponse(400, {
+        "error": "Invalid session",
+        "session_id": session_id,
+    })
+
+
+def health_check(lock_service: LockService, request: ApiRequest):
+    """Health check for the service"""
+    return ApiResponse(200, health_payload(lock_service))
+
+def create_session(lock_service: LockService, request: ApiRequest):
+    """Create a client session
+    Request:
+        {
+            "client_id": "string",
+            "timeout": int,
+            "request_id": "string"
+        }
+    Response:
+    {
+        "session_id": "uuid",
+        "client_id": "string",
+        "timeout": int,
+        "keepalive_interval": int
+    }
+
+    Every write takes an optional request_id. A retry with the same
+    request_id gets the result of the first attempt, here the same
+    session, instead of applying the write again. Here it must be a UUID,
+    and a retry with another client_id or timeout gets a 409.
+    """
+    logger.info("Entering create_session")
+    data = get_request_data(request, "client_id")
+    request_id = data.get("request_id")
+    client_id = data['client_id']
+    timeout = data.get("timeout", 60)
+    try:
+        lock_service.check_client_id(client_id)
+        lock_service.check_session_request_id(request_id)
+        lock_service.check_timeout(timeout)
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+        })
+    logger.info(f"Creating session for client {client_id} and timeout {timeout}")
+    session_id = yield Wait(lock_service.create_session_async(client_id, timeout, request_id=request_id))
+    if session_id is None:
+        return ApiResponse(409, {
+            "error": "request_id was used to create a session with other parameters",
+            "request_id": request_id,
+        })
+
+    logger.info(f"Session created {session_id}")
+    return ApiResponse(201, {
+        "session_id": session_id,
+        "client_id": client_id,
+        "timeout": timeout,
+        "keepalive_interval": timeout//3,
+    })
+
+def get_session_info(lock_service: LockService, request: ApiRequest):
+    """Get session details as a dict"""
+    yield from check_read_consistency(lock_service, request)
+    session_id = request.path_params['session_id']
+    session = lock_service.get_session_info(session_id)
+    if not session:
+        return invalid_session(session_id)
+    return ApiResponse(200, session)
+
+def keepalive(lock_service: LockService, request: ApiRequest):
+    """Extend session lifetime"""
+    session_id = request.path_params['session_id']
+    success = yield Wait(lock_service.keepalive_async(session_id))
+    if not success:
+        return invalid_session(session_id)
+    return ApiResponse(200, {
+        "success": True,
+        "session_id": session_id,
+    })
+
+def delete_session(lock_service: LockService, request: ApiRequest):
+    """Delete a client session"""
+    session_id = request.path_params['session_id']
+    success = yield Wait(lock_service.delete_session_async(session_id))
+    if not success:
+        return invalid_session(session_id)
+    return ApiResponse(200, {
+        "deleted": True,
+        "session_id": session_id
+    })
+
+def acquire_lock(lock_service: LockService, request: ApiRequest):
+    """Acquire a lock on a resource
+    Request (optional):
+        {
+            "wait_timeout": float,
+            "hierarchical": bool,
+            "mode": "exclusive" | "shared" | "semaphore",
+            "permits": int,
+            "request_id": "string"
+        }
+    With wait_timeout the request waits in a FIFO queue until the
+    lock is handed over or the timeout passes. A hierarchical lock
+    also covers every resource below it, like tenant/db covers
+    tenant/db/table, and never waits. Shared locks are held by any
+    number of sessions at once, semaphores by up to permits sessions.
+    A request that fails while it waits leaves the queue.
+    """
+    session_id = request.path_params['session_id']
+    resource = request.path_params['resource']
+    data = request.optional_json()
+    wait_timeout = data.get("wait_timeout")
+    hierarchical = data.get("hierarchical", False)
+    mode = data.get("mode", LOCK_EXCLUSIVE)
+    permits = data.get("permits")
+    request_id = data.get("request_id")
+    try:
+        lock_service.check_lock_mode(mode, permits, hierarchical)
+        lock_service.check_wait_timeout(wait_timeout)
+        lock_service.check_request_id(request_id)
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+            "resource": resource,
+        })
+
+    if not wait_timeout or hierarchical:
+        fence_token = yield Wait(lock_service.acquire_lock_async(
+            session_id, resource, hierarchical, mode, permits, request_id,
+        ))
+    else:
+        grant = lock_service.acquire_lock_waiting_async(session_id, resource, mode, permits, request_id)
+        try:
+            fence_token = yield Wait(grant, wait_timeout)
+        except FutureTimeoutError:
+            logger.info(f"Wait for resource {resource} by session {session_id} timed out")
+            fence_token = yield Wait(lock_service.cancel_wait_async(session_id, resource))
+        except BaseException:
+            lock_service.abandon_wait(session_id, resource, grant)
+            raise
+
+    if not fence_token:
+        return ApiResponse(409, {
+            "acquired": False,
+            "error": "Lock acquisition failed",
+            "resource": resource,
+        })
+    return ApiResponse(201, {
+        "acquired": True,
+        "fence_token": fence_token,
+        "resource": resource,
+    })
+
+def release_lock(lock_service: LockService, request: ApiRequest):
+    """Release lock on a resource"""
+    data = get_request_data(request, "fence_token")
+    request_id = check_request_id(lock_service, data)
+    session_id = request.path_params['session_id']
+    resource = request.path_params['resource']
+    success = yield Wait(lock_service.release_lock_async(session_id, resource, data['fence_token'], request_id))
+    if not success:
+        return ApiResponse(400, {
+            "error": "Failed to release lock ",
+            "resource": resource,
+            "reason": "Invalid session, resource or fence token"
+        })
+    return ApiResponse(200, {
+        "released": True,
+        "resource": resource
+    })
+
+def acquire_locks(lock_service: LockService, request: ApiRequest):
+    """Acquire locks on a list of resources, all or nothing
+    Request:
+        {
+            "resources": ["string"]
+        }
+    Response:
+    {
+        "acquired": true,
+        "fence_tokens": {"resource": int}
+    }
+    """
+    data = get_request_data(request, "resources")
+    request_id = check_request_id(lock_service, data)
+    resources = data['resources']
+    try:
+        lock_service.check_resources(resources)
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+        })
+    session_id = request.path_params['session_id']
+    fence_tokens = yield Wait(lock_service.acquire_locks_async(session_id, resources, request_id))
+    if fence_tokens is None:
+        return ApiResponse(409, {
+            "acquired": False,
+            "error": "Lock acquisition failed",
+            "resources": resources,
+        })
+    return ApiResponse(201, {
+        "acquired": True,
+        "fence_tokens": fence_tokens,
+    })
+
+def release_locks(lock_service: LockService, request: ApiRequest):
+    """Release a set of locks, all or nothing
+    Request:
+        {
+            "locks": {"resource": fence_token}
+        }
+    """
+    data = get_request_data(request, "locks")
+    request_id = check_request_id(lock_service, data)
+    locks = data['locks']
+    try:
+        lock_service.check_fence_tokens(locks)
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+        })
+    session_id = request.path_params['session_id']
+    success = yield Wait(lock_service.release_locks_async(session_id, locks, request_id))
+    if not success:
+        return ApiResponse(400, {
+            "error": "Failed to release locks",
+            "resources": list(locks),
+            "reason": "Invalid session, resource or fence token"
+        })
+    return ApiResponse(200, {
+        "released": True,
+        "resources": list(locks),
+    })
+
+def get_session_locks(lock_service: LockService, request: ApiRequest):
+    """Get all locks held by this session"""
+    yield from check_read_consistency(lock_service, request)
+    session_id = request.path_params['session_id']
+    locks = lock_service.get_all_session_locks(session_id)
+    if locks is None:
+        return invalid_session(session_id)
+    return ApiResponse(200, {
+        "total_locks": len(locks),
+        "locks": locks,
+    })
+
+def stats(lock_service: LockService, request: ApiRequest):
+    """Get the service stats"""
+    yield from check_read_consistency(lock_service, request)
+    return ApiResponse(200, lock_service.get_stats())
+
+def cleanup(lock_service: LockService, request: ApiRequest):
+    """Clean up expired sessions and release its locks"""
+    # Drains the expiry index in several commits
+    cleaned = yield Blocking(lock_service.release_expired_sessions)
+    return ApiResponse(200, {
+        "cleanup": "completed",
+        "count": cleaned
+    })
+
+def list_locks(lock_service: LockService, request: ApiRequest):
+    """List the locks on resources under a prefix, a page at a time
+    Query:
+        prefix: resource name prefix, 'tenant/db/' lists below tenant/db
+        limit: page size
+        cursor: next_cursor of the previous page
+    Response:
+    {
+        "prefix": "string",
+        "count": int,
+        "locks": [lock],
+        "next_cursor": "string" or null
+    }
+    """
+    yield from check_read_consistency(lock_service, request)
+    prefix = request.query.get("prefix", "")
+    limit = request.query_number("limit", DEFAULT_LIST_LIMIT, int)
+    cursor = request.query.get("cursor")
+    locks, next_cursor = lock_service.list_locks(prefix, limit, cursor)
+    return ApiResponse(200, {
+        "prefix": prefix,
+        "count": lock_service.count_locks(prefix),
+        "locks": locks,
+        "next_cursor": next_cursor,
+    })
+
+def lock_info(lock_service: LockService, request: ApiRequest):
+    """Get the lock information on a resource"""
+    yield from check_read_consistency(lock_service, request)
+    resource = request.path_params['resource']
+    info = lock_service.get_lock_info(resource)
+    if not info:
+        return ApiResponse(200, {
+            "locked": False,
+            "resource": resource
+        })
+    return ApiResponse(200, {
+        "locked": True,
+        **info,
+    })
+
+def read_events(lock_service: LockService, cursor: Optional[str], prefix: str, *args)->tuple[list[dict], str]:
+    """Read events for a watcher, a 410 error for an expired cursor and a 400 error for a malformed one"""
+    try:
+        return lock_service.read_events(cursor, prefix, *args)
+    except CursorExpired as e:
+        raise ApiError(410, {
+            "error": "Watch cursor expired, re-read the state and watch from cursor",
+            "reason": str(e),
+            "cursor": lock_service.watch_cursor(),
+        })
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+            "cursor": cursor,
+        })
+
+def wait_events(lock_service: LockService, cursor: str, timeout: float):
+    """Wait for events after cursor, False on timeout"""
+    waiter = lock_service.wait_events_async(cursor)
+    try:
+        yield Wait(waiter, max(0.0, timeout))
+    except FutureTimeoutError:
+        waiter.cancel()
+        return False
+    return True
+
+def watch(lock_service: LockService, request: ApiRequest):
+    """Long-poll for lock, session and leader events after a cursor
+    Query:
+        cursor: cursor of the previous response, omit to get the current one
+        prefix: only lock events on resources under this prefix
+        timeout: seconds to wait for an event
+        limit: page size
+    Response:
+    {
+        "events": [event],
+        "cursor": "string"
+    }
+    An expired cursor gets a 410 with the current cursor.
+    """
+    cursor = request.query.get("cursor")
+    prefix = request.query.get("prefix", "")
+    limit = request.query_number("limit", DEFAULT_WATCH_LIMIT, int)
+    timeout = min(request.query_number("timeout", DEFAULT_WATCH_TIMEOUT), MAX_WATCH_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    events, next_cursor = read_events(lock_service, cursor, prefix, limit)
+    while cursor is not None and not events:
+        if not (yield from wait_events(lock_service, next_cursor, deadline - time.monotonic())):
+            break
+        events, next_cursor = read_events(lock_service, next_cursor, prefix, limit)
+    return ApiResponse(200, {
+        "events": events,
+        "cursor": next_cursor,
+    })
+
+def watch_events(lock_service: LockService, request: ApiRequest):
+    """Stream lock, session and leader events as server-sent events
+
+    Resumes after the Last-Event-ID header or the cursor query
+    parameter, or starts at the current cursor. Takes a prefix like
+    /watch."""
+    cursor = request.headers.get("Last-Event-ID") or request.query.get("cursor")
+    prefix = request.query.get("prefix", "")
+    events, cursor = read_events(lock_service, cursor, prefix)
+
+    def stream(events: list[dict], cursor: str):
+        yield f"retry: 1000\n{format_sse(events, cursor)}"
+        while True:
+            if not (yield from wait_events(lock_service, cursor, SSE_HEARTBEAT_INTERVAL)):
+                yield ": heartbeat\n\n"
+                continue
+            try:
+                events, cursor = lock_service.read_events(cursor, prefix)
+            except CursorExpired as e:
+                # Clients re-read their state, then resume from the current cursor
+                yield format_sse([{"type": "expired", "reason": str(e)}], lock_service.watch_cursor())
+                return
+            yield format_sse(events, cursor)
+
+    return ApiResponse(200, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                       content_type=SSE_CONTENT_TYPE, stream=stream(events, cursor))
+
+def cluster_status(lock_service: LockService, request: ApiRequest):
+    return ApiResponse(200, cluster_status_payload(lock_service))
+
+def metrics(lock_service: LockService, request: ApiRequest):
+    """Get the metrics of this node in the Prometheus text format"""
+    return ApiResponse(200, metrics_payload(lock_service), content_type=METRICS_CONTENT_TYPE)
+
+def profile(lock_service: LockService, request: ApiRequest):
+    """Sample the stacks of every thread of this node for a while
+    Query:
+        seconds: how long to sample
+        interval_ms: time between samples
+    Response: folded stacks, one line per stack with its sample count
+    """
+    seconds = request.query_number("seconds", DEFAULT_PROFILE_SECONDS)
+    interval_ms = request.query_number("interval_ms", DEFAULT_PROFILE_INTERVAL * 1000)
+    try:
+        # Sleeps between samples
+        stacks = yield Blocking(PROFILER.profile, (seconds, interval_ms / 1000))
+    except ValueError as e:
+        raise ApiError(400, {
+            "error": str(e),
+        })
+    except ProfilerBusy as e:
+        raise ApiError(409, {
+            "error": str(e),
+        })
+    return ApiResponse(200, stacks, content_type=TEXT_CONTENT_TYPE)
+
+
+# (method, path, handler) of every REST route, paths in Flask syntax
+ROUTES = [
+    ("GET", "/health", health_check),
+    ("POST", "/sessions", create_session),
+    ("GET", "/sessions/<session_id>", get_session_info),
+    ("POST", "/sessions/<session_id>/keepalive", keepalive),
+    ("DELETE", "/sessions/<session_id>", delete_session),
+    ("POST", "/sessions/<session_id>/locks/<path:resource>", acquire_lock),
+    ("DELETE", "/sessions/<session_id>/locks/<path:resource>", release_lock),
+    ("POST", "/sessions/<session_id>/locks", acquire_locks),
+    ("DELETE", "/sessions/<session_id>/locks", release_locks),
+    ("GET", "/sessions/<session_id>/locks", get_session_locks),
+    ("GET", "/admin/stats", stats),
+    ("POST", "/admin/cleanup", cleanup),
+    ("GET", "/admin/locks", list_locks),
+    ("GET", "/admin/locks/<path:resource>", lock_info),
+    ("GET", "/watch", watch),
+    ("GET", "/watch/events", watch_events),
+    ("GET", "/cluster/status", cluster_status),
+    ("GET", "/metrics", metrics),
+    ("GET", "/admin/profile", profile),
+]
+
+def aiohttp_path(path: str)->str:
+    """Convert a Flask route path to aiohttp syntax, <path:resource> is {resource:.+}"""
+    path = re.sub(r"<path:(\w+)>", r"{\1:.+}", path)
+    return re.sub(r"<(\w+)>", r"{\1}", path)
+
+
+def resume(handler: Generator, value=None, error: Optional[BaseException] = None)->tuple[bool, Any]:
+    """Send a result or throw an error into a handler, returns (done, yielded item or return value)"""
+    try:
+        if error is not None:
+            return False, handler.throw(error)
+        return False, handler.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+def _resolve(item)->Any:
+    """Get the result of a Wait or Blocking on this thread"""
+    if isinstance(item, Wait):
+        return item.future.result(item.timeout)
+    if isinstance(item, Blocking):
+        return item.func(*item.args)
+    raise TypeError(f"Handlers yield Wait or Blocking, got {item!r}")
+
+def start(handler: Callable, lock_service: LockService, request: ApiRequest)->tuple[Optional[Generator], ApiResponse]:
+    """Call a handler, returns (None, response) when it is done right away and (handler steps, None) otherwise"""
+    try:
+        steps = handler(lock_service, request)
+    except (ApiError, Overloaded) as e:
+        return None, error_response(e)
+    if isinstance(steps, ApiResponse):
+        return None, steps
+    return steps, None
+
+def serve(handler: Callable, lock_service: LockService, request: ApiRequest)->ApiResponse:
+    """Serve a request on this thread, blocking on every Wait and Blocking"""
+    steps, response = start(handler, lock_service, request)
+    value, error = None, None
+    while steps is not None:
+        try:
+            done, item = resume(steps, value, error)
+        except (ApiError, Overloaded) as e:
+            return error_response(e)
+        if done:
+            return item
+        value, error = None, None
+        try:
+            value = _resolve(item)
+        except Exception as e:
+            error = e
+    return response
+
+def iter_stream(stream: Generator):
+    """Yield the str chunks of a stream response, blocking on every Wait in between"""
+    value, error = None, None
+    while True:
+        done, item = resume(stream, value, error)
+        if done:
+            return
+        value, error = None, None
+        if isinstance(item, str):
+            yield item
+            continue
+        try:
+            value = _resolve(item)
+        except Exception as e:
+            error = e
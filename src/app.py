@@ -1,227 +1,97 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timezone
-from typing import Optional
-from .config import get_node_config, get_api_port
+from typing import Callable, Optional
+from .api import (
+    JSON_CONTENT_TYPE, ROUTES, ApiRequest, ApiResponse, build_forwarder, build_lock_service, forward_timeout,
+    is_retryable, iter_stream, serve,
+)
+from .config import get_api_port, get_binary_port, get_server_mode
+from .forwarding import FORWARDED_HEADER, LeaderForwarder
 from .lock_service import LockService
 import logging
 logging.basicConfig(level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
-current_node, partner_nodes = get_node_config()
-lock_service = LockService(current_node, partner_nodes)
 
-def create_app():
+def api_request()->ApiRequest:
+    """Get the current Flask request for the handlers of api.py"""
+    return ApiRequest(request.method, request.path, request.view_args or {}, request.args, request.headers,
+                      request.get_data(), request.mimetype)
 
-    app = Flask(__name__)
-    CORS(app)
-    @app.route("/", methods=['GET'])
-    def dashboard():
-        return app.send_static_file("index.html")
-        
-    @app.route("/health", methods=['GET'])
-    def health_check():
-        """Health check for the service"""
-        return jsonify({
-            "service": "lock.io",
-            "status": "healthy",
-            "version": "0.1.0",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "is_leader": lock_service.is_leader(),
-            "leader": lock_service.get_leader(),
-            "is_ready": lock_service.is_ready(),
-        })
-
-    def validate_request(*required_fields):
-        """Validate the request"""
-        if not request.is_json:
-            return jsonify({
-                "error": "Request must be of Content-Type application/json"
-            }), 400
-
-        data = request.get_json()
-        missing_fields = []
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return jsonify({
-                "error": "Required missing field",
-                "fields": missing_fields,
-            }), 400
-
-        return None
-
-    def get_request_data(*required_fields)->tuple[str, dict]:
-        error = validate_request(*required_fields)
-        if error:
-            return None, error
-        return request.get_json(), ""
-        
-    @app.route("/sessions", methods=['POST'])
-    def create_session():
-        """Create a client session
-        Request:
-            {
-                "client_id": "string",
-                "timeout": int
-            }
-        Response: 
-        {
-            "session_id": "uuid",
-            "client_id": "string",
-            "timeout": int,
-            "keepalive_interval": int
-        }
-
-        """
-        logger.info("Entering create_session")
-        data, error = get_request_data("client_id")
-        if error:
-            return error
-        client_id = data['client_id']
-        timeout = data.get("timeout", 60)
-        logger.info(f"Creating session for client {client_id} and timeout {timeout}")
-        session_id = lock_service.create_session(client_id, timeout)
+def flask_response(response: ApiResponse)->Response:
+    """Turn a handler response into a Flask response"""
+    if response.stream is not None:
+        result = Response(stream_with_context(iter_stream(response.stream)), content_type=response.content_type)
+    elif response.content_type == JSON_CONTENT_TYPE:
+        result = jsonify(response.body)
+    else:
+        result = Response(response.body, content_type=response.content_type)
+    result.status_code = response.status
+    result.headers.update(response.headers)
+    return result
 
-        logger.info(f"Session created {session_id}")
-        return jsonify({
-            "session_id": session_id,
-            "client_id": client_id,
-            "timeout": timeout,
-            "keepalive_interval": timeout//3,
-        }), 201
+def create_app(lock_service: LockService, forwarder: Optional[LeaderForwarder] = None):
+    """Create the Flask app serving the REST routes of api.py, one thread per request"""
 
-    @app.route("/sessions/<string:session_id>", methods=['GET'])
-    def get_session_info(session_id:str)->Optional[dict]:
-        """Get session details as a dict"""
-        session = lock_service.get_session_info(session_id)
-        if not session:
-            return {
-                "error": "Invalid session",
-                "session_id": session_id,
-            }, 400
-        return jsonify(session), 200
+    if forwarder is None:
+        forwarder = build_forwarder(lock_service)
 
-    @app.route("/sessions/<string:session_id>/keepalive", methods=['POST'])
-    def keepalive(session_id:str)->bool:
-        """Extend session lifetime"""
-        success = lock_service.keepalive(session_id)
-        if not success:
-            return {
-                "error": "Invalid session",
-                "session_id": session_id,
-            }, 400
-        return {
-            "success": True,
-            "session_id": session_id,
-        }, 200
-
-    @app.route("/sessions/<string:session_id>", methods=['DELETE'])
-    def delete_session(session_id:str)->bool:
-        """Delete a client session"""
-        success = lock_service.delete_session(session_id)
-        if not success:
-            return jsnoify({
-                "error": "Invalid session",
-                "session_id": session_id,
-            }), 400
-        return jsonify({
-            "deleted": True,
-            "session_id": session_id
-        }), 200
-
-    @app.route("/sessions/<string:session_id>/locks/<string:resource>", methods=['POST'])
-    def acquire_lock(session_id:str, resource:str)->Optional[int]:
-        """Acquire a lock on a resource"""
-        fence_token = lock_service.acquire_lock(session_id, resource)
-        if not fence_token:
-            return jsonify({
-                "acquired": False,
-                "error": "Lock acquisition failed",
-                "resource": resource,
-            }), 409
-        return jsonify({
-            "acquired": True,
-            "fence_token": fence_token,
-            "resource": resource,
-        }), 201
-
-    @app.route("/sessions/<string:session_id>/locks/<string:resource>", methods=['DELETE'])
-    def release_lock(session_id:str, resource:str)->bool:
-        """Release lock on a resource"""
-        data, error = get_request_data("fence_token")
-        if error:
-            return error
-        fence_token = data['fence_token']
-        success = lock_service.release_lock(session_id, resource, fence_token)
-        if not success:
-            return jsonify({
-                "error": "Failed to release lock ",
-                "resource": resource,
-                "reason": "Invalid session, resource or fence token"
-            }), 400
-        return jsonify({
-            "released": True,
-            "resource": resource
-        }), 200
+    app = Flask(__name__)
+    CORS(app)
 
-    @app.route("/sessions/<string:session_id>/locks", methods=['GET'])
-    def get_session_locks(session_id:str):
-        """Get all locks held by this session"""
-        locks = lock_service.get_all_session_locks(session_id)
-        if locks:
-            return jsonify({
-                "total_locks": len(locks),
-                "locks": locks,
-            }), 200
-    
-    @app.route("/admin/stats", methods=['GET'])
-    def stats():
-        """Get the service stats"""
-        stats = lock_service.get_stats()
-        return jsonify(stats), 200
-    
+    @app.before_request
+    def forward_to_leader():
+        """Proxy writes and linearizable reads on a follower to the leader"""
+        if request.headers.get(FORWARDED_HEADER):
+            return None
+        path_params = request.view_args or {}
+        resource = path_params.get("resource")
+        session_id = path_params.get("session_id")
+        if forwarder.leader_api_address(resource, session_id) is None:
+            return None
+        forwarded = api_request()
+        extra_timeout = forward_timeout(forwarded)
+        if extra_timeout is None:
+            return None
+
+        path = request.path
+        if request.query_string:
+            path = f"{path}?{request.query_string.decode()}"
+        status, headers, body = forwarder.forward(
+            request.method, path, forwarded.body, dict(request.headers),
+            extra_timeout=extra_timeout, resource=resource, retryable=is_retryable(forwarded), session_id=session_id,
+        )
+        return Response(body, status=status, headers=headers)
+
+    @app.after_request
+    def add_node_header(response):
+        """Tell the client which node served the request"""
+        response.headers.setdefault("X-Lockio-Node", str(lock_service.selfNode))
+        return response
 
-    @app.route("/admin/cleanup", methods=['POST'])
-    def cleanup()->int:
-        """Clean up expired sessions and release its locks"""
-        cleaned = lock_service.release_expired_sessions()
-        return jsonify({
-            "cleanup": "completed",
-            "count": cleaned
-        }), 200
+    @app.route("/", methods=['GET'])
+    def dashboard():
+        return app.send_static_file("index.html")
 
-    @app.route("/admin/locks/<string:resource>", methods=['GET'])
-    def lock_info(resource:str):
-        """Get the lock information on a resource"""
-        lock_info = lock_service.get_lock_info(resource)
-        if not lock_info:
-            return jsonify({
-                "locked": False,
-                "resource": resource
-            }), 200
-        return jsonify({
-            "locked": True,
-            **lock_info,
-        }), 200
+    def view(handler: Callable):
+        def serve_request(**path_params):
+            return flask_response(serve(handler, lock_service, api_request()))
+        return serve_request
 
-    @app.route("/cluster/status", methods=['GET'])
-    def cluster_status():
-        status = lock_service.getStatus()
-        states = ["FOLLOWER", "CANDIDATE", "LEADER"]
-        
-        return jsonify({
-            "node": str(lock_service.selfNode),
-            "state": states[status['state']],
-            "leader": str(status['leader']) if status['leader'] else None,
-            "term": status['raft_term'],
-            "has_quorum": status['has_quorum'],
-            "is_ready": lock_service.is_ready(),
-            "uptime": status['uptime'],
-            "stats": lock_service.get_stats(),
-        })
+    for method, path, handler in ROUTES:
+        app.add_url_rule(path, handler.__name__, view(handler), methods=[method])
     return app
+
 if __name__ == '__main__':
-    app = create_app()
+    lock_service = build_lock_service()
     port = get_api_port()
-    app.run(host="0.0.0.0", port=port, debug=True, use_reloader=False)
+    binary_port = get_binary_port()
+    if binary_port is not None:
+        from .binary_protocol import BinaryProtocolServer
+        BinaryProtocolServer(lock_service, binary_port)
+    if get_server_mode() == "async":
+        from .async_app import run_async_app
+        run_async_app(lock_service, port)
+    else:
+        create_app(lock_service).run(host="0.0.0.0", port=port, threaded=True)
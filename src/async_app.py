@@ -0,0 +1,216 @@
+from typing import Callable, Optional
+import asyncio
+import os
+import aiohttp
+from aiohttp import web
+from .admission import Overloaded
+from .api import (
+    JSON_CONTENT_TYPE, ROUTES, ApiError, ApiRequest, ApiResponse, Blocking, Wait, aiohttp_path, build_forwarder,
+    error_response, forward_timeout, is_retryable, resume, start,
+)
+from .connection_pool import POOL_SIZE
+from .forwarding import (
+    FORWARDED_HEADER, FORWARD_ATTEMPTS, FORWARD_TIMEOUT, LeaderForwarder, _HOP_BY_HOP_HEADERS, forward_error,
+)
+from .lock_service import LockService
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+
+async def _result(item):
+    """Await the result of a Wait or Blocking without blocking the event loop"""
+    if isinstance(item, Wait):
+        # Shielded, so a timeout leaves the lock service future running
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(item.future)), item.timeout)
+    if isinstance(item, Blocking):
+        return await asyncio.to_thread(item.func, *item.args)
+    raise TypeError(f"Handlers yield Wait or Blocking, got {item!r}")
+
+
+async def serve_async(handler: Callable, lock_service: LockService, request: ApiRequest)->ApiResponse:
+    """Serve a request on the event loop, see api.serve"""
+    steps, response = start(handler, lock_service, request)
+    value, error = None, None
+    while steps is not None:
+        try:
+            done, item = resume(steps, value, error)
+        except (ApiError, Overloaded) as e:
+            return error_response(e)
+        if done:
+            return item
+        value, error = None, None
+        try:
+            value = await _result(item)
+        except Exception as e:
+            error = e
+    return response
+
+
+async def api_request(request: web.Request)->ApiRequest:
+    """Get an aiohttp request for the handlers of api.py"""
+    return ApiRequest(request.method, request.path, dict(request.match_info), request.query, request.headers,
+                      await request.read(), request.content_type)
+
+
+def aiohttp_response(response: ApiResponse)->web.Response:
+    """Turn a handler response into an aiohttp response"""
+    if response.content_type == JSON_CONTENT_TYPE:
+        return web.json_response(response.body, status=response.status, headers=response.headers)
+    return web.Response(body=response.body.encode(), status=response.status,
+                        headers={**response.headers, "Content-Type": response.content_type})
+
+
+class AsyncLeaderForwarder:
+    """Proxies API requests to the leader over a pooled aiohttp client session"""
+
+    def __init__(self, forwarder: LeaderForwarder):
+        self.__forwarder = forwarder
+        self.__session: Optional[aiohttp.ClientSession] = None
+
+    def leader_api_address(self, resource: Optional[str] = None, session_id: Optional[str] = None)->Optional[str]:
+        return self.__forwarder.leader_api_address(resource, session_id)
+
+    def _get_session(self)->aiohttp.ClientSession:
+        if self.__session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=POOL_SIZE * 4, keepalive_timeout=60)
+            self.__session = aiohttp.ClientSession(connector=connector)
+        return self.__session
+
+    async def forward(self, method: str, path: str, body: bytes, headers: dict,
+                      extra_timeout: float = 0.0, resource: Optional[str] = None,
+                      retryable: bool = False, session_id: Optional[str] = None)->web.Response:
+        """Send a request to the leader, see LeaderForwarder.forward"""
+        headers = {k: v for k, v in headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS}
+        headers[FORWARDED_HEADER] = "1"
+        timeout = aiohttp.ClientTimeout(total=FORWARD_TIMEOUT + extra_timeout)
+
+        api_address = None
+        for _ in range(FORWARD_ATTEMPTS):
+            api_address = self.leader_api_address(resource, session_id)
+            if api_address is None:
+                return self._error(*forward_error(503, "No leader to forward the request to", None))
+            try:
+                async with self._get_session().request(
+                    method, f"http://{api_address}{path}", data=body, headers=headers, timeout=timeout,
+                ) as response:
+                    data = await response.read()
+            except aiohttp.ClientConnectorError as e:
+                # Nothing reached the leader
+                logger.warning(f"Connecting to leader {api_address} failed: {e}")
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Leader {api_address} did not answer: {e}")
+                if retryable:
+                    continue
+                if isinstance(e, asyncio.TimeoutError):
+                    return self._error(*forward_error(504, "The leader did not answer in time, "
+                                                      "the request may have been applied", api_address))
+                return self._error(*forward_error(503, "The leader did not answer, "
+                                                  "the request may have been applied", api_address))
+            response_headers = {k: v for k, v in response.headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS}
+            return web.Response(body=data, status=response.status, headers=response_headers)
+        return self._error(*forward_error(503, "Forwarding to the leader failed", api_address))
+
+    @staticmethod
+    def _error(status: int, body: dict)->web.Response:
+        return web.json_response(body, status=status)
+
+    async def close(self)->None:
+        if self.__session is not None:
+            await self.__session.close()
+
+
+def create_async_app(lock_service: LockService, forwarder: Optional[LeaderForwarder] = None)->web.Application:
+    """Create the aiohttp app serving the REST routes of api.py from one event loop"""
+
+    if forwarder is None:
+        forwarder = build_forwarder(lock_service)
+    async_forwarder = AsyncLeaderForwarder(forwarder)
+
+    @web.middleware
+    async def forward_to_leader(request: web.Request, handler):
+        """Proxy writes and linearizable reads on a follower to the leader"""
+        resource = request.match_info.get("resource")
+        session_id = request.match_info.get("session_id")
+        if request.headers.get(FORWARDED_HEADER) or async_forwarder.leader_api_address(resource, session_id) is None:
+            return await handler(request)
+        forwarded = await api_request(request)
+        extra_timeout = forward_timeout(forwarded)
+        if extra_timeout is None:
+            return await handler(request)
+        return await async_forwarder.forward(
+            request.method, request.path_qs, forwarded.body, dict(request.headers),
+            extra_timeout=extra_timeout, resource=resource, retryable=is_retryable(forwarded), session_id=session_id,
+        )
+
+    @web.middleware
+    async def add_headers(request: web.Request, handler):
+        """Tell the client which node served the request, and allow the dashboard's cross-origin polling"""
+        response = await handler(request)
+        response.headers.setdefault("X-Lockio-Node", str(lock_service.selfNode))
+        response.headers.setdefault("Access-Control-Allow-Origin", "*")
+        return response
+
+    app = web.Application(middlewares=[add_headers, forward_to_leader])
+
+    async def write_stream(request: web.Request, response: ApiResponse)->web.StreamResponse:
+        """Send the chunks of a stream response as they are produced"""
+        # Sent by prepare, before add_headers sees the response
+        stream_response = web.StreamResponse(status=response.status, headers={
+            **response.headers,
+            "Content-Type": response.content_type,
+            "X-Lockio-Node": str(lock_service.selfNode),
+            "Access-Control-Allow-Origin": "*",
+        })
+        await stream_response.prepare(request)
+        value, error = None, None
+        try:
+            while True:
+                done, item = resume(response.stream, value, error)
+                if done:
+                    break
+                value, error = None, None
+                if isinstance(item, str):
+                    await stream_response.write(item.encode())
+                    continue
+                try:
+                    value = await _result(item)
+                except Exception as e:
+                    error = e
+        except ConnectionResetError:
+            logger.info("Stream client disconnected")
+        finally:
+            response.stream.close()
+        return stream_response
+
+    def view(handler: Callable):
+        async def serve_request(request: web.Request):
+            response = await serve_async(handler, lock_service, await api_request(request))
+            if response.stream is not None:
+                return await write_stream(request, response)
+            return aiohttp_response(response)
+        return serve_request
+
+    async def dashboard(request: web.Request):
+        return web.FileResponse(os.path.join(STATIC_DIR, "index.html"))
+
+    app.router.add_get("/", dashboard)
+    for method, path, handler in ROUTES:
+        app.router.add_route(method, aiohttp_path(path), view(handler), name=handler.__name__)
+    app.router.add_static("/static", STATIC_DIR)
+
+    async def close_forwarder(app: web.Application):
+        await async_forwarder.close()
+        forwarder.close()
+
+    app.on_cleanup.append(close_forwarder)
+    return app
+
+
+def run_async_app(lock_service: LockService, port: int)->None:
+    """Serve the API from a single asyncio event loop"""
+    web.run_app(create_async_app(lock_service), host="0.0.0.0", port=port)
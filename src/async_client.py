@@ -0,0 +1,337 @@
+"""asyncio client for the lock.io REST API
+
+    async with AsyncLockClient(["localhost:5000", "localhost:5001"]) as client:
+        async with await client.session("billing-worker", timeout=30) as session:
+            async with session.lock("tenant-1/invoices") as lock:
+                await write_invoices(fence_token=lock.fence_token)
+
+The asyncio counterpart of LockClient, with the same leader caching and
+errors. Requests share one aiohttp connector with keep-alive connections
+per node, so many coroutines can have requests in flight at once. All
+sessions of a client are kept alive by one task, which renews each
+session in a task of its own. Writes carry request
+IDs and are retried like those of LockClient.
+"""
+from typing import Optional, Union
+from urllib.parse import quote
+import asyncio
+import heapq
+import itertools
+import json
+import time
+import aiohttp
+from .client import (
+    DEFAULT_TIMEOUT, KEEPALIVE_FRACTION, KEEPALIVE_RETRY_DELAY, LOCK_EXCLUSIVE, NODE_HEADER, REQUEST_ATTEMPTS,
+    InvalidSession, LeaderCache, LockioError, Overloaded, Unavailable, error_for, is_idempotent, lock_body, lock_path,
+    new_request_id, routing_key,
+)
+from .connection_pool import POOL_SIZE
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLockClient:
+    """asyncio client of a lock.io cluster, used from one event loop"""
+
+    def __init__(self, addresses: Union[str, list[str]], timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = POOL_SIZE):
+        """addresses are the API addresses of the nodes, host:port, as a list or comma separated"""
+        if isinstance(addresses, str):
+            addresses = [address.strip() for address in addresses.split(",") if address.strip()]
+        if not addresses:
+            raise ValueError("At least one node address is needed")
+        self.timeout = timeout
+        self.__leaders = LeaderCache(addresses)
+        self.__pool_size = pool_size
+        self.__http: Optional[aiohttp.ClientSession] = None
+        self.__discovering: Optional[asyncio.Task] = None
+        self.__due: list[tuple[float, int, "AsyncSession"]] = []
+        self.__seq = itertools.count()
+        self.__keepalive_added = asyncio.Event()
+        self.__keepalive_task: Optional[asyncio.Task] = None
+        self.__renewals: set[asyncio.Task] = set()
+
+    def _get_http(self)->aiohttp.ClientSession:
+        if self.__http is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.__pool_size, keepalive_timeout=60)
+            self.__http = aiohttp.ClientSession(connector=connector)
+        return self.__http
+
+    async def _send(self, api_address: str, method: str, path: str, body: Optional[bytes],
+                    timeout: float)->tuple[int, Optional[str], dict]:
+        """Send one request over the pooled connector, return (status, node, body)"""
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        async with self._get_http().request(
+            method, f"http://{api_address}{path}", data=body, headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            data = await response.read()
+        try:
+            payload = json.loads(data) if data else {}
+        except ValueError:
+            payload = {"error": f"{response.status} {response.reason}"}
+        return response.status, response.headers.get(NODE_HEADER), payload
+
+    async def _discover(self)->None:
+        async def ask(api_address: str):
+            try:
+                return api_address, await self._send(api_address, "GET", "/health", None, self.timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.info(f"Node {api_address} is not reachable: {e}")
+                return api_address, None
+        for api_address, answer in await asyncio.gather(*(ask(a) for a in self.__leaders.addresses)):
+            if answer is None:
+                continue
+            status, node, body = answer
+            self.__leaders.learn_node(api_address, node)
+            if status == 200 and body.get("is_leader"):
+                self.__leaders.learn_leader(None, node)
+
+    async def discover(self)->None:
+        """Ask every node, concurrently, for its Raft address and the leader"""
+        if self.__discovering is None or self.__discovering.done():
+            self.__discovering = asyncio.ensure_future(self._discover())
+        await asyncio.shield(self.__discovering)
+
+    async def request(self, method: str, path: str, body: Optional[dict] = None,
+                      resource: Optional[str] = None, extra_timeout: float = 0.0,
+                      timeout: Optional[float] = None)->tuple[int, dict]:
+        """Send a request to the leader for the resource, return (status, body)
+
+        Retries like LockClient.request."""
+        if not self.__leaders.discovered:
+            await self.discover()
+        key = routing_key(resource)
+        data = json.dumps(body).encode() if body is not None else None
+        idempotent = is_idempotent(method, body)
+        if timeout is None:
+            timeout = self.timeout
+        last_error: Optional[Exception] = None
+        for api_address in self.__leaders.candidates(key)[:REQUEST_ATTEMPTS]:
+            try:
+                status, node, payload = await self._send(api_address, method, path, data, timeout + extra_timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.__leaders.forget(api_address)
+                last_error = e
+                if not idempotent and not isinstance(e, aiohttp.ClientConnectorError):
+                    raise Unavailable(f"Request to {api_address} failed, it may have been applied: {e}") from e
+                continue
+            if status == 503 and "retry_after_ms" in payload:
+                raise error_for(status, payload)
+            if status == 503:
+                self.__leaders.forget(api_address)
+                self.__leaders.learn_leader(key, payload.get("leader"))
+                last_error = error_for(status, payload)
+                continue
+            self.__leaders.learn_node(api_address, node)
+            self.__leaders.learn_leader(key, node)
+            return status, payload
+        raise Unavailable(f"No node could serve {method} {path}: {last_error}")
+
+    async def call(self, method: str, path: str, body: Optional[dict] = None, resource: Optional[str] = None,
+                   extra_timeout: float = 0.0, timeout: Optional[float] = None)->dict:
+        """Send a request, return the body of a successful response or raise its LockioError"""
+        status, payload = await self.request(method, path, body, resource, extra_timeout, timeout)
+        if status >= 400:
+            raise error_for(status, payload)
+        return payload
+
+    async def session(self, client_id: str, timeout: int = 60, keepalive: bool = True)->"AsyncSession":
+        """Create a session, kept alive by the client's keepalive task until it is closed"""
+        body = await self.call("POST", "/sessions", {"client_id": client_id, "timeout": timeout,
+                                                     "request_id": new_request_id()})
+        session = AsyncSession(self, body["session_id"], timeout)
+        if keepalive:
+            self._schedule_keepalive(session)
+        return session
+
+    async def health(self)->dict:
+        return await self.call("GET", "/health")
+
+    def _schedule_keepalive(self, session: "AsyncSession", delay: Optional[float] = None)->None:
+        if delay is None:
+            delay = session.keepalive_interval
+        heapq.heappush(self.__due, (time.monotonic() + delay, next(self.__seq), session))
+        self.__keepalive_added.set()
+        if self.__keepalive_task is None:
+            self.__keepalive_task = asyncio.ensure_future(self._keepalive_loop())
+
+    async def _keepalive_loop(self)->None:
+        """Start the renewal of every session of the client at its keepalive_interval, in deadline order"""
+        while True:
+            self.__keepalive_added.clear()
+            if not self.__due:
+                await self.__keepalive_added.wait()
+                continue
+            remaining = self.__due[0][0] - time.monotonic()
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self.__keepalive_added.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            session = heapq.heappop(self.__due)[2]
+            if session.closed or session.expired:
+                continue
+            renewal = asyncio.ensure_future(self._renew(session))
+            self.__renewals.add(renewal)
+            renewal.add_done_callback(self.__renewals.discard)
+
+    async def _renew(self, session: "AsyncSession")->None:
+        """Renew a session and schedule its next renewal"""
+        try:
+            await session.keepalive()
+        except InvalidSession:
+            session.expired = True
+            logger.warning(f"Session {session.session_id} expired")
+            return
+        except Overloaded as e:
+            logger.warning(f"Keepalive of session {session.session_id} rejected: {e}")
+            self._schedule_keepalive(session, min(e.retry_after, session.keepalive_interval))
+            return
+        except (LockioError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Keepalive of session {session.session_id} failed: {e}")
+            self._schedule_keepalive(session, min(KEEPALIVE_RETRY_DELAY, session.keepalive_interval))
+            return
+        self._schedule_keepalive(session)
+
+    async def close(self)->None:
+        """Stop keeping sessions alive and close all connections"""
+        if self.__keepalive_task is not None:
+            self.__keepalive_task.cancel()
+            try:
+                await self.__keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self.__keepalive_task = None
+        renewals, self.__renewals = list(self.__renewals), set()
+        for renewal in renewals:
+            renewal.cancel()
+        await asyncio.gather(*renewals, return_exceptions=True)
+        if self.__http is not None:
+            await self.__http.close()
+            self.__http = None
+
+    async def __aenter__(self)->"AsyncLockClient":
+        return self
+
+    async def __aexit__(self, *exc_info)->None:
+        await self.close()
+
+
+class AsyncSession:
+    """A session of an AsyncLockClient, deleted when the async with block ends"""
+
+    def __init__(self, client: AsyncLockClient, session_id: str, timeout: int):
+        self.client = client
+        self.session_id = session_id
+        self.timeout = timeout
+        self.keepalive_interval = max(timeout * KEEPALIVE_FRACTION, 0.1)
+        self.expired = False
+        self.closed = False
+
+    def lock(self, resource: str, wait_timeout: Optional[float] = None, mode: str = LOCK_EXCLUSIVE,
+             permits: Optional[int] = None, hierarchical: bool = False)->"AsyncLock":
+        """Get a lock on a resource, acquired by acquire() or entering an async with block"""
+        return AsyncLock(self, resource, wait_timeout, mode, permits, hierarchical)
+
+    async def acquire(self, resource: str, wait_timeout: Optional[float] = None, mode: str = LOCK_EXCLUSIVE,
+                      permits: Optional[int] = None, hierarchical: bool = False)->"AsyncLock":
+        """Acquire a lock on a resource, raises LockConflict if it is held"""
+        lock = self.lock(resource, wait_timeout, mode, permits, hierarchical)
+        await lock.acquire()
+        return lock
+
+    async def acquire_many(self, resources: list[str])->dict[str, int]:
+        """Acquire locks on all resources or none, returns the fence tokens"""
+        body = await self.client.call("POST", f"/sessions/{quote(self.session_id)}/locks",
+                                      {"resources": resources, "request_id": new_request_id()},
+                                      resource=resources[0] if resources else None)
+        return body["fence_tokens"]
+
+    async def release_many(self, locks: dict[str, int])->None:
+        """Release locks, given as resource to fence token, all or nothing"""
+        await self.client.call("DELETE", f"/sessions/{quote(self.session_id)}/locks",
+                               {"locks": locks, "request_id": new_request_id()}, resource=next(iter(locks), None))
+
+    async def locks(self)->list[dict]:
+        """Get the locks this session holds"""
+        return (await self.client.call("GET", f"/sessions/{quote(self.session_id)}/locks"))["locks"]
+
+    async def keepalive(self)->None:
+        """Extend the session, raises InvalidSession once it is gone
+
+        Gives up on a node like Session.keepalive."""
+        await self.client.call("POST", f"/sessions/{quote(self.session_id)}/keepalive",
+                               timeout=min(self.client.timeout, self.keepalive_interval / 2))
+
+    async def close(self)->None:
+        """Stop keeping the session alive and delete it, releasing its locks"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.expired:
+            return
+        try:
+            await self.client.call("DELETE", f"/sessions/{quote(self.session_id)}")
+        except InvalidSession:
+            pass
+
+    async def __aenter__(self)->"AsyncSession":
+        return self
+
+    async def __aexit__(self, *exc_info)->None:
+        await self.close()
+
+
+class AsyncLock:
+    """A lock on a resource and its fence token, released when the async with block ends
+
+    Like Lock, an acquire that fails with Unavailable keeps its request ID for the next one."""
+
+    def __init__(self, session: AsyncSession, resource: str, wait_timeout: Optional[float] = None,
+                 mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None, hierarchical: bool = False):
+        self.session = session
+        self.resource = resource
+        self.wait_timeout = wait_timeout
+        self.mode = mode
+        self.permits = permits
+        self.hierarchical = hierarchical
+        self.fence_token: Optional[int] = None
+        self.request_id: Optional[str] = None
+
+    async def acquire(self)->int:
+        """Acquire the lock, returns the fence token, raises LockConflict if it is held"""
+        if self.request_id is None:
+            self.request_id = new_request_id()
+        try:
+            body = await self.session.client.call(
+                "POST", lock_path(self.session.session_id, self.resource),
+                lock_body(self.wait_timeout, self.mode, self.permits, self.hierarchical, self.request_id),
+                resource=self.resource, extra_timeout=self.wait_timeout or 0.0,
+            )
+        except Unavailable:
+            raise
+        except LockioError:
+            self.request_id = None
+            raise
+        self.request_id = None
+        self.fence_token = body["fence_token"]
+        return self.fence_token
+
+    async def release(self)->None:
+        if self.fence_token is None:
+            return
+        fence_token, self.fence_token = self.fence_token, None
+        await self.session.client.call("DELETE", lock_path(self.session.session_id, self.resource),
+                                       {"fence_token": fence_token, "request_id": new_request_id()},
+                                       resource=self.resource)
+
+    async def __aenter__(self)->"AsyncLock":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info)->None:
+        await self.release()
@@ -0,0 +1,88 @@
+from typing import Callable
+from concurrent.futures import Future
+import threading
+import time
+import logging
+from .metrics import BATCH_SIZE, BATCH_WAIT_SECONDS
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class CommitBatcher:
+    """Group commit of operations submitted by concurrent callers
+
+    Operations are collected for up to max_delay seconds after the first
+    one arrives, or until max_ops are pending, then handed to apply_batch
+    as one list with the future of each operation. apply_batch resolves
+    the futures once the batch commits. Batches are handed over in
+    submission order from a single flusher thread, urgent operations
+    ahead of the others."""
+
+    def __init__(self, apply_batch: Callable[[list[tuple[tuple, Future]]], None],
+                 max_ops: int, max_delay: float):
+        self.__apply_batch = apply_batch
+        self.__max_ops = max_ops
+        self.__max_delay = max_delay
+        self.__pending: list[tuple[tuple, Future]] = []
+        self.__urgent: list[tuple[tuple, Future]] = []
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self._run, name="commit-batcher", daemon=True)
+        self.__thread.start()
+
+    def submit(self, operation: tuple, urgent: bool = False)->Future:
+        """Queue an operation for the next batch, returns a future for its result
+
+        Urgent operations join the next batch before any other pending
+        operation, so they are not stuck behind a backlog."""
+        future = Future()
+        with self.__condition:
+            (self.__urgent if urgent else self.__pending).append((operation, future))
+            pending = len(self.__urgent) + len(self.__pending)
+            # Wake the flusher for the first operation of a batch and for a full batch
+            if pending == 1 or pending >= self.__max_ops:
+                self.__condition.notify()
+        return future
+
+    def _next_batch(self)->list[tuple[tuple, Future]]:
+        """Wait for a full batch, or for max_delay after the first pending operation"""
+        with self.__condition:
+            while not self.__pending and not self.__urgent and not self.__closed:
+                self.__condition.wait()
+            started = time.monotonic()
+            deadline = started + self.__max_delay
+            while len(self.__urgent) + len(self.__pending) < self.__max_ops and not self.__closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__condition.wait(remaining)
+            batch = self.__urgent[:self.__max_ops]
+            del self.__urgent[:self.__max_ops]
+            rest = self.__max_ops - len(batch)
+            batch += self.__pending[:rest]
+            del self.__pending[:rest]
+        if batch:
+            BATCH_WAIT_SECONDS.observe(time.monotonic() - started)
+            BATCH_SIZE.observe(len(batch))
+        return batch
+
+    def _run(self)->None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self.__apply_batch(batch)
+            except Exception as e:
+                logger.exception(f"Submitting a batch of {len(batch)} operations failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def close(self)->None:
+        """Flush the pending operations and stop the flusher thread"""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
@@ -0,0 +1,240 @@
+"""Client for the binary protocol of src/binary_protocol.py
+
+    client = BinaryLockClient("localhost:6000,localhost:6001")
+    session_id = client.create_session("billing-worker", timeout=30)
+    futures = [client.acquire_async(session_id, f"jobs/{i}") for i in range(1000)]
+    tokens = [future.result() for future in futures]
+
+One connection carries every request of the client. Each *_async method
+sends its request right away and returns a future, so callers can have
+many requests in flight without a thread or a connection each. Results
+and errors are those of LockClient, see src/client.py.
+
+Writes take an optional request_id. A write that failed with Unavailable
+can be sent again with the same one, and gets the result of the first
+attempt if that was applied after all.
+"""
+from typing import Callable, Optional, Union
+from concurrent.futures import Future
+import itertools
+import socket
+import struct
+import threading
+from .binary_protocol import (
+    OP_ACQUIRE, OP_ACQUIRE_MANY, OP_CREATE_SESSION, OP_DELETE_SESSION, OP_HELLO, OP_KEEPALIVE,
+    OP_RELEASE, OP_RELEASE_MANY, STATUS_OK, STATUS_OVERLOADED, STATUS_REJECTED, STATUS_UNAVAILABLE,
+    ProtocolError, Reader, pack_acquire, pack_frame, pack_locks, pack_request_id, pack_string, split_frames,
+)
+from .client import DEFAULT_TIMEOUT, LOCK_EXCLUSIVE, InvalidSession, LockConflict, LockioError, Overloaded, Unavailable
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+# Request ID and status, after the length
+_RESPONSE = struct.Struct("<IB")
+# Bytes read from the socket at a time
+RECEIVE_SIZE = 1 << 16
+
+
+def _no_fields(reader: Reader)->bool:
+    return True
+
+
+def _rejected(error: type, message: str)->Callable[[], LockioError]:
+    return lambda: error(message)
+
+
+class BinaryLockClient:
+    """Multiplexing client of the binary protocol, safe to share between threads"""
+
+    def __init__(self, addresses: Union[str, list[str]], timeout: float = DEFAULT_TIMEOUT):
+        """addresses are the binary protocol addresses of the nodes, host:port, as a list or comma separated
+
+        The client connects to the first one that accepts, and to the next
+        one when that connection fails."""
+        if isinstance(addresses, str):
+            addresses = [address.strip() for address in addresses.split(",") if address.strip()]
+        if not addresses:
+            raise ValueError("At least one node address is needed")
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self.__ids = itertools.count(1)
+        # Request ID to (future, decode the fields, make the error of a REJECTED response)
+        self.__pending: dict[int, tuple[Future, Callable, Callable]] = {}
+        self.__send_lock = threading.Lock()
+        self.__socket: Optional[socket.socket] = None
+        self.__next_address = 0
+        self.__closed = False
+
+    def _connect(self)->socket.socket:
+        """Connect to the next node that accepts, called with the send lock held"""
+        last_error: Optional[Exception] = None
+        for _ in range(len(self.addresses)):
+            address = self.addresses[self.__next_address % len(self.addresses)]
+            self.__next_address += 1
+            host, port = address.split(":")
+            try:
+                sock = socket.create_connection((host, int(port)), timeout=self.timeout)
+            except OSError as e:
+                last_error = e
+                continue
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Rewind so the next failure retries this node last
+            self.__next_address -= 1
+            threading.Thread(target=self._receive, args=(sock,), name="lockio-binary-client", daemon=True).start()
+            return sock
+        raise Unavailable(f"No node accepted a connection: {last_error}")
+
+    def _receive(self, sock: socket.socket)->None:
+        """Resolve the futures of responses as they arrive, in any order"""
+        buffer = bytearray()
+        try:
+            while True:
+                data = sock.recv(RECEIVE_SIZE)
+                if not data:
+                    break
+                buffer += data
+                for frame in split_frames(buffer):
+                    self._resolve(frame)
+        except (OSError, ProtocolError) as e:
+            if not self.__closed:
+                logger.warning(f"Binary protocol connection failed: {e}")
+        self._disconnect(sock)
+
+    def _resolve(self, frame: bytes)->None:
+        request_id, status = _RESPONSE.unpack_from(frame)
+        pending = self.__pending.pop(request_id, None)
+        if pending is None:
+            return
+        future, decode, rejected = pending
+        reader = Reader(frame, _RESPONSE.size)
+        if status == STATUS_OK:
+            future.set_result(decode(reader))
+        elif status == STATUS_REJECTED:
+            future.set_exception(rejected())
+        elif status == STATUS_OVERLOADED:
+            retry_after = reader.u32() / 1000
+            future.set_exception(Overloaded(reader.string(), retry_after))
+        elif status == STATUS_UNAVAILABLE:
+            future.set_exception(Unavailable(reader.string()))
+        else:
+            future.set_exception(LockioError(reader.string(), status))
+
+    def _disconnect(self, sock: socket.socket)->None:
+        """Fail the requests in flight on a connection that is gone"""
+        with self.__send_lock:
+            if self.__socket is sock:
+                self.__socket = None
+                pending, self.__pending = self.__pending, {}
+            else:
+                pending = {}
+        sock.close()
+        for future, _, _ in pending.values():
+            future.set_exception(Unavailable("Connection lost, the request may have been applied"))
+
+    def _send(self, opcode: int, fields: bytes, decode: Callable, rejected: Callable)->Future:
+        future = Future()
+        request_id = next(self.__ids) & 0xFFFFFFFF
+        frame = pack_frame(request_id, opcode, fields)
+        with self.__send_lock:
+            if self.__closed:
+                raise LockioError("Client is closed")
+            if self.__socket is None:
+                self.__socket = self._connect()
+            self.__pending[request_id] = (future, decode, rejected)
+            try:
+                self.__socket.sendall(frame)
+            except OSError as e:
+                self.__pending.pop(request_id, None)
+                self.__socket.close()
+                self.__socket = None
+                raise Unavailable(f"Sending the request failed: {e}") from e
+        return future
+
+    def hello_async(self)->Future:
+        """Get the Raft address of the connected node, of the leader it knows and whether it leads"""
+        return self._send(OP_HELLO, b"", lambda r: {"node": r.string(), "leader": r.string() or None,
+                                                    "is_leader": bool(r.u8())},
+                          _rejected(LockioError, "Hello rejected"))
+
+    def create_session_async(self, client_id: str, timeout: int = 60, request_id: Optional[str] = None)->Future:
+        return self._send(OP_CREATE_SESSION, pack_string(client_id) + _U32.pack(timeout) + pack_request_id(request_id),
+                          Reader.string, _rejected(LockioError, "Session creation failed"))
+
+    def keepalive_async(self, session_id: str)->Future:
+        return self._send(OP_KEEPALIVE, pack_string(session_id), _no_fields,
+                          _rejected(InvalidSession, "Invalid session"))
+
+    def delete_session_async(self, session_id: str)->Future:
+        return self._send(OP_DELETE_SESSION, pack_string(session_id), _no_fields,
+                          _rejected(InvalidSession, "Invalid session"))
+
+    def acquire_async(self, session_id: str, resource: str, wait_timeout: Optional[float] = None,
+                      mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None,
+                      hierarchical: bool = False, request_id: Optional[str] = None)->Future:
+        """Acquire a lock, returns a future for the fence token that raises LockConflict if it is held"""
+        fields = pack_acquire(session_id, resource, mode, hierarchical, permits, wait_timeout)
+        return self._send(OP_ACQUIRE, fields + pack_request_id(request_id), Reader.u64,
+                          _rejected(LockConflict, "Lock acquisition failed"))
+
+    def release_async(self, session_id: str, resource: str, fence_token: int,
+                      request_id: Optional[str] = None)->Future:
+        fields = pack_string(session_id) + pack_string(resource) + _U64.pack(fence_token)
+        return self._send(OP_RELEASE, fields + pack_request_id(request_id), _no_fields,
+                          _rejected(LockioError, "Invalid session, resource or fence token"))
+
+    def acquire_many_async(self, session_id: str, resources: list[str], request_id: Optional[str] = None)->Future:
+        """Acquire locks on all resources or none, returns a future for the fence tokens"""
+        fields = pack_string(session_id) + _U16.pack(len(resources)) + b"".join(map(pack_string, resources))
+        return self._send(OP_ACQUIRE_MANY, fields + pack_request_id(request_id), Reader.locks,
+                          _rejected(LockConflict, "Lock acquisition failed"))
+
+    def release_many_async(self, session_id: str, locks: dict[str, int], request_id: Optional[str] = None)->Future:
+        return self._send(OP_RELEASE_MANY, pack_string(session_id) + pack_locks(locks) + pack_request_id(request_id),
+                          _no_fields, _rejected(LockioError, "Invalid session, resource or fence token"))
+
+    def hello(self)->dict:
+        return self.hello_async().result(self.timeout)
+
+    def create_session(self, client_id: str, timeout: int = 60, request_id: Optional[str] = None)->str:
+        return self.create_session_async(client_id, timeout, request_id).result(self.timeout)
+
+    def keepalive(self, session_id: str)->None:
+        self.keepalive_async(session_id).result(self.timeout)
+
+    def delete_session(self, session_id: str)->None:
+        self.delete_session_async(session_id).result(self.timeout)
+
+    def acquire(self, session_id: str, resource: str, wait_timeout: Optional[float] = None,
+                mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None, hierarchical: bool = False,
+                request_id: Optional[str] = None)->int:
+        future = self.acquire_async(session_id, resource, wait_timeout, mode, permits, hierarchical, request_id)
+        return future.result(self.timeout + (wait_timeout or 0.0))
+
+    def release(self, session_id: str, resource: str, fence_token: int, request_id: Optional[str] = None)->None:
+        self.release_async(session_id, resource, fence_token, request_id).result(self.timeout)
+
+    def acquire_many(self, session_id: str, resources: list[str], request_id: Optional[str] = None)->dict[str, int]:
+        return self.acquire_many_async(session_id, resources, request_id).result(self.timeout)
+
+    def release_many(self, session_id: str, locks: dict[str, int], request_id: Optional[str] = None)->None:
+        self.release_many_async(session_id, locks, request_id).result(self.timeout)
+
+    def close(self)->None:
+        """Close the connection, requests still in flight fail with Unavailable"""
+        with self.__send_lock:
+            self.__closed = True
+            sock = self.__socket
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def __enter__(self)->"BinaryLockClient":
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.close()
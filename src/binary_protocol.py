@@ -0,0 +1,382 @@
+from typing import Callable, Optional
+from concurrent.futures import Future
+import asyncio
+import struct
+import threading
+from pysyncobj import SyncObjException
+from .admission import Overloaded
+from .records import LOCK_MODES
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# Binary protocol, little endian, served on BINARY_PORT next to the REST API.
+#
+# Every frame starts with the length of the rest of the frame, then the
+# request ID the client picked and an opcode (requests) or a status
+# (responses). Responses carry the ID of their request and may arrive in
+# any order, so one connection has any number of requests in flight.
+#
+#   request   length u32, request_id u32, opcode u8, fields
+#   response  length u32, request_id u32, status u8, fields
+#
+# Strings are a u16 length followed by UTF-8. Fields by opcode, request
+# then response:
+#
+#   HELLO           -                                       node, leader (empty if none), is_leader u8
+#   CREATE_SESSION  client_id, timeout u32                  session_id
+#   KEEPALIVE       session_id                              -
+#   DELETE_SESSION  session_id                              -
+#   ACQUIRE         session_id, resource, mode u8,          fence_token u64
+#                   hierarchical u8, permits u32, wait_timeout f32
+#   RELEASE         session_id, resource, fence_token u64   -
+#   ACQUIRE_MANY    session_id, count u16, resources        count u16, (resource, fence_token u64)
+#   RELEASE_MANY    session_id, count u16, (resource, fence_token u64)   -
+#
+# Modes are their position in LOCK_MODES, no permits and no wait are 0.
+# CREATE_SESSION, ACQUIRE, RELEASE, ACQUIRE_MANY and RELEASE_MANY may end
+# with a request_id string. A retry with the same one gets the result of
+# the first attempt, see LockService._once. Without it, or when it is
+# empty, every attempt is applied.
+# A REJECTED response is what the REST API answers with 409 or 400: the
+# lock is held, the session is gone or the fence token does not match.
+# BAD_REQUEST, UNAVAILABLE and ERROR responses carry a message string,
+# OVERLOADED responses the milliseconds to wait before retrying as a u32
+# and a message string.
+OP_HELLO = 0
+OP_CREATE_SESSION = 1
+OP_KEEPALIVE = 2
+OP_DELETE_SESSION = 3
+OP_ACQUIRE = 4
+OP_RELEASE = 5
+OP_ACQUIRE_MANY = 6
+OP_RELEASE_MANY = 7
+
+STATUS_OK = 0
+STATUS_REJECTED = 1
+STATUS_BAD_REQUEST = 2
+STATUS_UNAVAILABLE = 3
+STATUS_ERROR = 4
+STATUS_OVERLOADED = 5
+
+# Frames above this size are refused and the connection closed
+MAX_FRAME_SIZE = 1 << 20
+# Requests a connection may have in flight before the server stops reading from it
+MAX_IN_FLIGHT = 4096
+
+_LENGTH = struct.Struct("<I")
+# Length, request ID and opcode or status
+HEADER = struct.Struct("<IIB")
+# Request ID and opcode, after the length
+_REQUEST = struct.Struct("<IB")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+_ACQUIRE = struct.Struct("<BBIf")
+
+
+class ProtocolError(Exception):
+    """A frame does not follow the binary protocol"""
+
+
+def pack_frame(request_id: int, code: int, fields: bytes = b"")->bytes:
+    """Frame a request (code is the opcode) or response (code is the status)"""
+    return HEADER.pack(len(fields) + 5, request_id, code) + fields
+
+
+def pack_string(value: str)->bytes:
+    data = value.encode("utf-8")
+    if len(data) > 0xFFFF:
+        raise ValueError(f"String of {len(data)} bytes is too long for the binary protocol")
+    return _U16.pack(len(data)) + data
+
+
+def pack_acquire(session_id: str, resource: str, mode: str, hierarchical: bool, permits: Optional[int],
+                 wait_timeout: Optional[float])->bytes:
+    return (pack_string(session_id) + pack_string(resource)
+            + _ACQUIRE.pack(LOCK_MODES.index(mode), hierarchical, permits or 0, wait_timeout or 0.0))
+
+
+def pack_request_id(request_id: Optional[str])->bytes:
+    """Pack the optional request ID at the end of a write"""
+    return pack_string(request_id) if request_id else b""
+
+
+def pack_locks(locks: dict[str, int])->bytes:
+    """Pack resources and fence tokens, as in RELEASE_MANY and the ACQUIRE_MANY response"""
+    return _U16.pack(len(locks)) + b"".join(pack_string(resource) + _U64.pack(token)
+                                            for resource, token in locks.items())
+
+
+class Reader:
+    """Reads the fields of one frame in order"""
+
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def _unpack(self, layout: struct.Struct)->tuple:
+        if self.offset + layout.size > len(self.data):
+            raise ProtocolError("Frame ends in the middle of a field")
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def u8(self)->int:
+        return self._unpack(_U8)[0]
+
+    def u16(self)->int:
+        return self._unpack(_U16)[0]
+
+    def u32(self)->int:
+        return self._unpack(_U32)[0]
+
+    def u64(self)->int:
+        return self._unpack(_U64)[0]
+
+    def string(self)->str:
+        length = self.u16()
+        end = self.offset + length
+        if end > len(self.data):
+            raise ProtocolError("Frame ends in the middle of a string")
+        try:
+            value = self.data[self.offset:end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise ProtocolError(f"Invalid UTF-8 string: {e}") from e
+        self.offset = end
+        return value
+
+    def acquire(self)->tuple[str, bool, Optional[int], Optional[float]]:
+        """Read the mode, hierarchical, permits and wait_timeout of an ACQUIRE"""
+        mode, hierarchical, permits, wait_timeout = self._unpack(_ACQUIRE)
+        if mode >= len(LOCK_MODES):
+            raise ProtocolError(f"Unknown lock mode {mode}")
+        return LOCK_MODES[mode], bool(hierarchical), permits or None, wait_timeout or None
+
+    def request_id(self)->Optional[str]:
+        """Read the optional request ID at the end of a write, None when the frame ends before it"""
+        if self.offset == len(self.data):
+            return None
+        return self.string() or None
+
+    def locks(self)->dict[str, int]:
+        return {self.string(): self.u64() for _ in range(self.u16())}
+
+    def resources(self)->list[str]:
+        return [self.string() for _ in range(self.u16())]
+
+
+def split_frames(buffer: bytearray)->list[bytes]:
+    """Remove the complete frames from the start of buffer, without their length field"""
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= 4:
+        length = _LENGTH.unpack_from(buffer, offset)[0]
+        if length < 5 or length > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Invalid frame length {length}")
+        end = offset + 4 + length
+        if end > len(buffer):
+            break
+        frames.append(bytes(buffer[offset + 4:end]))
+        offset = end
+    del buffer[:offset]
+    return frames
+
+
+class _Connection(asyncio.Protocol):
+    """One client connection, any number of requests in flight
+
+    Requests are decoded as they arrive and submitted to the lock service
+    right away. Each response is written from the event loop when its
+    future resolves, in completion order."""
+
+    def __init__(self, lock_service, loop: asyncio.AbstractEventLoop):
+        self.__lock_service = lock_service
+        self.__loop = loop
+        self.__buffer = bytearray()
+        self.__in_flight = 0
+        self.__paused = False
+        self.__transport: Optional[asyncio.Transport] = None
+        self.__handlers: dict[int, Callable[[Reader], Future]] = {
+            OP_HELLO: self._hello,
+            OP_CREATE_SESSION: self._create_session,
+            OP_KEEPALIVE: self._keepalive,
+            OP_DELETE_SESSION: self._delete_session,
+            OP_ACQUIRE: self._acquire,
+            OP_RELEASE: self._release,
+            OP_ACQUIRE_MANY: self._acquire_many,
+            OP_RELEASE_MANY: self._release_many,
+        }
+
+    def connection_made(self, transport: asyncio.Transport)->None:
+        self.__transport = transport
+
+    def connection_lost(self, exc: Optional[Exception])->None:
+        self.__transport = None
+
+    def data_received(self, data: bytes)->None:
+        self.__buffer += data
+        try:
+            frames = split_frames(self.__buffer)
+        except ProtocolError as e:
+            logger.warning(f"Closing binary protocol connection: {e}")
+            self.__transport.close()
+            return
+        for frame in frames:
+            self._dispatch(frame)
+
+    def _dispatch(self, frame: bytes)->None:
+        request_id, opcode = _REQUEST.unpack_from(frame)
+        handler = self.__handlers.get(opcode)
+        if handler is None:
+            self._write(request_id, STATUS_BAD_REQUEST, pack_string(f"Unknown opcode {opcode}"))
+            return
+        try:
+            future = handler(Reader(frame, 5))
+        except (ProtocolError, ValueError) as e:
+            self._write(request_id, STATUS_BAD_REQUEST, pack_string(str(e)))
+            return
+        self.__in_flight += 1
+        if self.__in_flight >= MAX_IN_FLIGHT and not self.__paused:
+            self.__paused = True
+            self.__transport.pause_reading()
+        future.add_done_callback(lambda f: self.__loop.call_soon_threadsafe(self._respond, request_id, f))
+
+    def _respond(self, request_id: int, future: Future)->None:
+        self.__in_flight -= 1
+        if self.__paused and self.__in_flight < MAX_IN_FLIGHT // 2 and self.__transport is not None:
+            self.__paused = False
+            self.__transport.resume_reading()
+        error = future.exception()
+        if isinstance(error, Overloaded):
+            self._write(request_id, STATUS_OVERLOADED,
+                        _U32.pack(round(error.retry_after * 1000)) + pack_string(str(error)))
+        elif isinstance(error, SyncObjException):
+            self._write(request_id, STATUS_UNAVAILABLE, pack_string(f"Raft request failed: {error}"))
+        elif error is not None:
+            logger.error(f"Binary protocol request failed: {error!r}")
+            self._write(request_id, STATUS_ERROR, pack_string(str(error)))
+        else:
+            status, fields = future.result()
+            self._write(request_id, status, fields)
+
+    def _write(self, request_id: int, status: int, fields: bytes = b"")->None:
+        if self.__transport is not None:
+            self.__transport.write(pack_frame(request_id, status, fields))
+
+    @staticmethod
+    def _then(future: Future, encode: Callable)->Future:
+        """Get a future for (status, fields), REJECTED when the service result is falsy"""
+        response = Future()
+
+        def on_done(result: Future):
+            error = result.exception()
+            if error is not None:
+                response.set_exception(error)
+            elif not result.result():
+                response.set_result((STATUS_REJECTED, b""))
+            else:
+                response.set_result((STATUS_OK, encode(result.result())))
+        future.add_done_callback(on_done)
+        return response
+
+    def _hello(self, reader: Reader)->Future:
+        service = self.__lock_service
+        response = Future()
+        response.set_result((STATUS_OK, pack_string(str(service.selfNode)) + pack_string(service.get_leader() or "")
+                             + _U8.pack(service.is_leader())))
+        return response
+
+    def _create_session(self, reader: Reader)->Future:
+        client_id, timeout, request_id = reader.string(), reader.u32(), reader.request_id()
+        return self._then(self.__lock_service.create_session_async(client_id, timeout, request_id=request_id),
+                          pack_string)
+
+    def _keepalive(self, reader: Reader)->Future:
+        return self._then(self.__lock_service.keepalive_async(reader.string()), lambda _: b"")
+
+    def _delete_session(self, reader: Reader)->Future:
+        return self._then(self.__lock_service.delete_session_async(reader.string()), lambda _: b"")
+
+    def _acquire(self, reader: Reader)->Future:
+        session_id, resource = reader.string(), reader.string()
+        mode, hierarchical, permits, wait_timeout = reader.acquire()
+        request_id = reader.request_id()
+        service = self.__lock_service
+        service.check_wait_timeout(wait_timeout)
+        if not wait_timeout or hierarchical:
+            return self._then(service.acquire_lock_async(session_id, resource, hierarchical, mode, permits,
+                                                         request_id), _U64.pack)
+        return self._then(self._acquire_waiting(session_id, resource, mode, permits, wait_timeout, request_id),
+                          _U64.pack)
+
+    def _acquire_waiting(self, session_id: str, resource: str, mode: str, permits: Optional[int],
+                         wait_timeout: float, request_id: Optional[str])->Future:
+        """Queue for a lock, give up after wait_timeout like LockService.acquire_lock"""
+        service = self.__lock_service
+        grant = service.acquire_lock_waiting_async(session_id, resource, mode, permits, request_id)
+        result = Future()
+
+        def on_grant(granted: Future):
+            self.__loop.call_soon_threadsafe(timer.cancel)
+            if result.done():
+                return
+            if granted.exception() is not None:
+                result.set_exception(granted.exception())
+            else:
+                result.set_result(granted.result())
+
+        def on_timeout():
+            if grant.done():
+                return
+            cancelled = service.cancel_wait_async(session_id, resource)
+            cancelled.add_done_callback(lambda f: result.done() or result.set_result(
+                f.result() if f.exception() is None else None))
+
+        # Requests are decoded on the event loop thread
+        timer = self.__loop.call_later(wait_timeout, on_timeout)
+        grant.add_done_callback(on_grant)
+        return result
+
+    def _release(self, reader: Reader)->Future:
+        session_id, resource, fence_token = reader.string(), reader.string(), reader.u64()
+        return self._then(self.__lock_service.release_lock_async(session_id, resource, fence_token,
+                                                                 reader.request_id()), lambda _: b"")
+
+    def _acquire_many(self, reader: Reader)->Future:
+        session_id, resources = reader.string(), reader.resources()
+        if not resources:
+            raise ValueError("No resources to lock")
+        return self._then(self.__lock_service.acquire_locks_async(session_id, resources, reader.request_id()),
+                          pack_locks)
+
+    def _release_many(self, reader: Reader)->Future:
+        session_id, locks = reader.string(), reader.locks()
+        if not locks:
+            raise ValueError("No locks to release")
+        return self._then(self.__lock_service.release_locks_async(session_id, locks, reader.request_id()),
+                          lambda _: b"")
+
+
+class BinaryProtocolServer:
+    """Serves the binary protocol from an event loop on a thread of its own"""
+
+    def __init__(self, lock_service, port: int, host: str = "0.0.0.0"):
+        self.__lock_service = lock_service
+        self.__loop = asyncio.new_event_loop()
+        self.__server = self.__loop.run_until_complete(self.__loop.create_server(
+            lambda: _Connection(self.__lock_service, self.__loop), host, port))
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name="binary-protocol", daemon=True)
+        self.__thread.start()
+        logger.info(f"Binary protocol listening on {host}:{port}")
+
+    def close(self)->None:
+        def stop():
+            self.__server.close()
+            self.__loop.stop()
+        self.__loop.call_soon_threadsafe(stop)
+        self.__thread.join()
@@ -0,0 +1,517 @@
+"""Python client for the lock.io REST API
+
+    client = LockClient(["localhost:5000", "localhost:5001", "localhost:5002"])
+    with client.session("billing-worker", timeout=30) as session:
+        with session.lock("tenant-1/invoices") as lock:
+            write_invoices(fence_token=lock.fence_token)
+
+Requests go over pooled keep-alive connections, one pool per node. The
+client learns which node leads from /health and from the X-Lockio-Node
+header of every response, and sends each request straight to the leader
+of the resource, so followers rarely have to forward. Every session of
+the process is kept alive by one shared background thread.
+
+Session creation, acquires and releases carry a request ID. The cluster
+answers a retry of one with the result of the first attempt, so these
+writes are retried on another node when a connection fails or times out,
+as after a leader change, without leaking a session or a lock.
+"""
+from typing import Optional, Union
+from urllib.parse import quote
+import heapq
+import http.client
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+from .connection_pool import ConnectionPool, POOL_SIZE
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# Lock modes, as the server names them
+LOCK_EXCLUSIVE = "exclusive"
+LOCK_SHARED = "shared"
+LOCK_SEMAPHORE = "semaphore"
+
+NODE_HEADER = "X-Lockio-Node"
+# Socket timeout of a request, on top of any lock wait time
+DEFAULT_TIMEOUT = 10.0
+# Nodes a request is tried on before giving up
+REQUEST_ATTEMPTS = 3
+# Sessions are renewed this often relative to their timeout, like the
+# keepalive_interval the server suggests
+KEEPALIVE_FRACTION = 1 / 3
+# Delay before a failed keepalive is retried
+KEEPALIVE_RETRY_DELAY = 1.0
+# Keepalives sent at once, so a node that hangs does not hold up the others
+KEEPALIVE_WORKERS = 8
+
+
+class LockioError(Exception):
+    """A request was refused by the lock service"""
+
+    def __init__(self, message: str, status: Optional[int] = None, body: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.body = body or {}
+
+
+class InvalidSession(LockioError):
+    """The session does not exist, it was deleted or expired"""
+
+
+class LockConflict(LockioError):
+    """The lock is held by another session"""
+
+
+class Unavailable(LockioError):
+    """No node could serve the request"""
+
+
+class Overloaded(Unavailable):
+    """The node turned the request away under load, retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float, status: Optional[int] = None,
+                 body: Optional[dict] = None):
+        super().__init__(message, status, body)
+        self.retry_after = retry_after
+
+
+def error_for(status: int, body: dict)->LockioError:
+    """Get the exception for an error response of the API"""
+    message = body.get("error") or f"Request failed with status {status}"
+    if status == 409:
+        return LockConflict(message, status, body)
+    if status == 400 and body.get("error") == "Invalid session":
+        return InvalidSession(message, status, body)
+    if status == 503 and "retry_after_ms" in body:
+        return Overloaded(message, body["retry_after_ms"] / 1000, status, body)
+    if status == 503:
+        return Unavailable(message, status, body)
+    return LockioError(message, status, body)
+
+
+def routing_key(resource: Optional[str])->Optional[str]:
+    """Get the key leaders are cached under, the first path segment of a resource
+
+    Matches how the server shards resources over Raft groups, see
+    src/sharding.py. Session requests use None."""
+    if resource is None:
+        return None
+    return resource.split("/", 1)[0]
+
+
+class LeaderCache:
+    """Which API address to send requests for a routing key to
+
+    Nodes report their Raft address in the X-Lockio-Node header, and a
+    follower that forwarded a request returns the leader's. Mapping Raft
+    addresses to API addresses lets the client follow those redirects."""
+
+    def __init__(self, addresses: list[str]):
+        self.addresses = list(addresses)
+        self.__api_addresses: dict[str, str] = {}
+        self.__leaders: dict[Optional[str], str] = {}
+        self.__next = itertools.count()
+
+    @property
+    def discovered(self)->bool:
+        return bool(self.__api_addresses)
+
+    def learn_node(self, api_address: str, node: Optional[str])->None:
+        """Record the Raft address of the node at an API address"""
+        if node:
+            self.__api_addresses[node] = api_address
+
+    def learn_leader(self, key: Optional[str], node: Optional[str])->None:
+        """Send requests for key to the node with this Raft address from now on"""
+        api_address = self.__api_addresses.get(node) if node else None
+        if api_address is not None:
+            self.__leaders[key] = api_address
+
+    def forget(self, api_address: str)->None:
+        """Stop preferring an API address that failed"""
+        for key, leader in list(self.__leaders.items()):
+            if leader == api_address:
+                self.__leaders.pop(key, None)
+
+    def candidates(self, key: Optional[str])->list[str]:
+        """Get the API addresses to try in order: the cached leader first, then the others in turn"""
+        first = []
+        for cached in (self.__leaders.get(key), self.__leaders.get(None)):
+            if cached is not None and cached not in first:
+                first.append(cached)
+        start = next(self.__next) % len(self.addresses)
+        rest = self.addresses[start:] + self.addresses[:start]
+        return first + [address for address in rest if address not in first]
+
+
+def lock_path(session_id: str, resource: str)->str:
+    return f"/sessions/{quote(session_id)}/locks/{quote(resource)}"
+
+
+def new_request_id()->str:
+    """Get a request ID for a write, which makes retrying it safe"""
+    return uuid.uuid4().hex
+
+
+def is_idempotent(method: str, body: Optional[dict])->bool:
+    """Whether a request can be sent again after a failure that may have come after it was applied"""
+    return method == "GET" or (body is not None and "request_id" in body)
+
+
+def lock_body(wait_timeout: Optional[float], mode: str, permits: Optional[int], hierarchical: bool,
+              request_id: Optional[str] = None)->dict:
+    body = {"mode": mode, "hierarchical": hierarchical}
+    if request_id is not None:
+        body["request_id"] = request_id
+    if wait_timeout:
+        body["wait_timeout"] = wait_timeout
+    if permits is not None:
+        body["permits"] = permits
+    return body
+
+
+class LockClient:
+    """Client of a lock.io cluster, safe to share between threads"""
+
+    def __init__(self, addresses: Union[str, list[str]], timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = POOL_SIZE):
+        """addresses are the API addresses of the nodes, host:port, as a list or comma separated"""
+        if isinstance(addresses, str):
+            addresses = [address.strip() for address in addresses.split(",") if address.strip()]
+        if not addresses:
+            raise ValueError("At least one node address is needed")
+        self.timeout = timeout
+        self.__leaders = LeaderCache(addresses)
+        self.__pool_size = pool_size
+        self.__pools: dict[str, ConnectionPool] = {}
+        self.__discover_lock = threading.Lock()
+
+    def _get_pool(self, api_address: str)->ConnectionPool:
+        pool = self.__pools.get(api_address)
+        if pool is None:
+            pool = self.__pools.setdefault(api_address, ConnectionPool(api_address, self.__pool_size))
+        return pool
+
+    def _send(self, api_address: str, method: str, path: str, body: Optional[bytes],
+              timeout: float)->tuple[int, Optional[str], dict]:
+        """Send one request over a pooled connection, return (status, node, body)
+
+        A pooled connection the server closed while idle is replaced once."""
+        pool = self._get_pool(api_address)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        while True:
+            connection, reused = pool.get(timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                pool.put(connection)
+            try:
+                payload = json.loads(data) if data else {}
+            except ValueError:
+                # Not an API response, like the error page of a crashed request
+                payload = {"error": f"{response.status} {response.reason}"}
+            return response.status, response.getheader(NODE_HEADER), payload
+
+    def discover(self)->None:
+        """Ask every node for its Raft address and the leader"""
+        for api_address in self.__leaders.addresses:
+            try:
+                status, node, body = self._send(api_address, "GET", "/health", None, self.timeout)
+            except (http.client.HTTPException, OSError) as e:
+                logger.info(f"Node {api_address} is not reachable: {e}")
+                continue
+            self.__leaders.learn_node(api_address, node)
+            if status == 200 and body.get("is_leader"):
+                self.__leaders.learn_leader(None, node)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None,
+                resource: Optional[str] = None, extra_timeout: float = 0.0,
+                timeout: Optional[float] = None)->tuple[int, dict]:
+        """Send a request to the leader for the resource, return (status, body)
+
+        timeout replaces the timeout of the client for this request.
+        Tries the next node when a node cannot be reached or has no
+        leader. A write without a request_id in its body is only retried
+        when it cannot have been applied: the connection was refused, or
+        the node answered 503."""
+        if not self.__leaders.discovered:
+            with self.__discover_lock:
+                if not self.__leaders.discovered:
+                    self.discover()
+        key = routing_key(resource)
+        data = json.dumps(body).encode() if body is not None else None
+        idempotent = is_idempotent(method, body)
+        if timeout is None:
+            timeout = self.timeout
+        last_error: Optional[Exception] = None
+        for api_address in self.__leaders.candidates(key)[:REQUEST_ATTEMPTS]:
+            try:
+                status, node, payload = self._send(api_address, method, path, data, timeout + extra_timeout)
+            except (http.client.HTTPException, OSError) as e:
+                self.__leaders.forget(api_address)
+                last_error = e
+                if not idempotent and not isinstance(e, ConnectionRefusedError):
+                    raise Unavailable(f"Request to {api_address} failed, it may have been applied: {e}") from e
+                continue
+            if status == 503 and "retry_after_ms" in payload:
+                # The leader is overloaded, other nodes would forward to it
+                raise error_for(status, payload)
+            if status == 503:
+                # No leader on that node, or a read it cannot serve; it may name the leader
+                self.__leaders.forget(api_address)
+                self.__leaders.learn_leader(key, payload.get("leader"))
+                last_error = error_for(status, payload)
+                continue
+            self.__leaders.learn_node(api_address, node)
+            self.__leaders.learn_leader(key, node)
+            return status, payload
+        raise Unavailable(f"No node could serve {method} {path}: {last_error}")
+
+    def call(self, method: str, path: str, body: Optional[dict] = None, resource: Optional[str] = None,
+             extra_timeout: float = 0.0, timeout: Optional[float] = None)->dict:
+        """Send a request, return the body of a successful response or raise its LockioError"""
+        status, payload = self.request(method, path, body, resource, extra_timeout, timeout)
+        if status >= 400:
+            raise error_for(status, payload)
+        return payload
+
+    def session(self, client_id: str, timeout: int = 60, keepalive: bool = True)->"Session":
+        """Create a session, kept alive in the background until it is closed"""
+        body = self.call("POST", "/sessions", {"client_id": client_id, "timeout": timeout,
+                                               "request_id": new_request_id()})
+        session = Session(self, body["session_id"], timeout)
+        if keepalive:
+            KEEPALIVE_LOOP.add(session)
+        return session
+
+    def health(self)->dict:
+        return self.call("GET", "/health")
+
+    def close(self)->None:
+        """Close all pooled connections"""
+        for pool in list(self.__pools.values()):
+            pool.close()
+
+    def __enter__(self)->"LockClient":
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.close()
+
+
+class Session:
+    """A session of a LockClient, deleted when the with block ends
+
+    expired is set once the keepalive loop finds that the server no
+    longer knows the session, after which its locks are gone too."""
+
+    def __init__(self, client: LockClient, session_id: str, timeout: int):
+        self.client = client
+        self.session_id = session_id
+        self.timeout = timeout
+        self.keepalive_interval = max(timeout * KEEPALIVE_FRACTION, 0.1)
+        self.expired = False
+        self.closed = False
+
+    def lock(self, resource: str, wait_timeout: Optional[float] = None, mode: str = LOCK_EXCLUSIVE,
+             permits: Optional[int] = None, hierarchical: bool = False)->"Lock":
+        """Get a lock on a resource, acquired by acquire() or entering a with block"""
+        return Lock(self, resource, wait_timeout, mode, permits, hierarchical)
+
+    def acquire(self, resource: str, wait_timeout: Optional[float] = None, mode: str = LOCK_EXCLUSIVE,
+                permits: Optional[int] = None, hierarchical: bool = False)->"Lock":
+        """Acquire a lock on a resource, raises LockConflict if it is held"""
+        lock = self.lock(resource, wait_timeout, mode, permits, hierarchical)
+        lock.acquire()
+        return lock
+
+    def acquire_many(self, resources: list[str])->dict[str, int]:
+        """Acquire locks on all resources or none, returns the fence tokens"""
+        body = self.client.call("POST", f"/sessions/{quote(self.session_id)}/locks",
+                                {"resources": resources, "request_id": new_request_id()},
+                                resource=resources[0] if resources else None)
+        return body["fence_tokens"]
+
+    def release_many(self, locks: dict[str, int])->None:
+        """Release locks, given as resource to fence token, all or nothing"""
+        self.client.call("DELETE", f"/sessions/{quote(self.session_id)}/locks",
+                         {"locks": locks, "request_id": new_request_id()}, resource=next(iter(locks), None))
+
+    def locks(self)->list[dict]:
+        """Get the locks this session holds"""
+        return self.client.call("GET", f"/sessions/{quote(self.session_id)}/locks")["locks"]
+
+    def keepalive(self)->None:
+        """Extend the session, raises InvalidSession once it is gone
+
+        A node that does not answer within half the keepalive interval
+        fails the attempt, leaving time to retry before the session expires."""
+        self.client.call("POST", f"/sessions/{quote(self.session_id)}/keepalive",
+                         timeout=min(self.client.timeout, self.keepalive_interval / 2))
+
+    def close(self)->None:
+        """Stop keeping the session alive and delete it, releasing its locks"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.expired:
+            return
+        try:
+            self.client.call("DELETE", f"/sessions/{quote(self.session_id)}")
+        except InvalidSession:
+            pass
+
+    def __enter__(self)->"Session":
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.close()
+
+
+class Lock:
+    """A lock on a resource and its fence token, released when the with block ends
+
+    Pass fence_token to the protected resource with every write, so it
+    can refuse writes of a holder that lost the lock.
+
+    An acquire that fails with Unavailable keeps its request ID, so
+    calling acquire() again gets the fence token if the first attempt
+    was granted after all."""
+
+    def __init__(self, session: Session, resource: str, wait_timeout: Optional[float] = None,
+                 mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None, hierarchical: bool = False):
+        self.session = session
+        self.resource = resource
+        self.wait_timeout = wait_timeout
+        self.mode = mode
+        self.permits = permits
+        self.hierarchical = hierarchical
+        self.fence_token: Optional[int] = None
+        self.request_id: Optional[str] = None
+
+    def acquire(self)->int:
+        """Acquire the lock, returns the fence token, raises LockConflict if it is held"""
+        if self.request_id is None:
+            self.request_id = new_request_id()
+        try:
+            body = self.session.client.call(
+                "POST", lock_path(self.session.session_id, self.resource),
+                lock_body(self.wait_timeout, self.mode, self.permits, self.hierarchical, self.request_id),
+                resource=self.resource, extra_timeout=self.wait_timeout or 0.0,
+            )
+        except Unavailable:
+            raise
+        except LockioError:
+            self.request_id = None
+            raise
+        self.request_id = None
+        self.fence_token = body["fence_token"]
+        return self.fence_token
+
+    def release(self)->None:
+        if self.fence_token is None:
+            return
+        fence_token, self.fence_token = self.fence_token, None
+        self.session.client.call("DELETE", lock_path(self.session.session_id, self.resource),
+                                 {"fence_token": fence_token, "request_id": new_request_id()},
+                                 resource=self.resource)
+
+    def __enter__(self)->"Lock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.release()
+
+
+class KeepaliveLoop:
+    """Keeps every session of the process alive from a few background threads
+
+    One thread takes sessions due for renewal in deadline order and
+    hands them to a small pool of workers, so a process with many
+    sessions still runs a few threads, and a node that hangs only holds
+    up the renewals sent to it. A failed renewal is retried until the
+    server reports the session gone."""
+
+    def __init__(self, workers: int = KEEPALIVE_WORKERS):
+        self.__due: list[tuple[float, int, Session]] = []
+        self.__seq = itertools.count()
+        self.__condition = threading.Condition()
+        self.__thread: Optional[threading.Thread] = None
+        self.__workers = workers
+        self.__ready: queue.SimpleQueue = queue.SimpleQueue()
+
+    def add(self, session: Session, delay: Optional[float] = None)->None:
+        """Renew the session after delay, keepalive_interval by default"""
+        if delay is None:
+            delay = session.keepalive_interval
+        with self.__condition:
+            heapq.heappush(self.__due, (time.monotonic() + delay, next(self.__seq), session))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self._run, name="lockio-keepalive", daemon=True)
+                self.__thread.start()
+                for i in range(self.__workers):
+                    threading.Thread(target=self._work, name=f"lockio-keepalive-{i}", daemon=True).start()
+            self.__condition.notify()
+
+    def _next_due(self)->Session:
+        with self.__condition:
+            while True:
+                if self.__due:
+                    remaining = self.__due[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        return heapq.heappop(self.__due)[2]
+                    self.__condition.wait(remaining)
+                else:
+                    self.__condition.wait()
+
+    def _run(self)->None:
+        while True:
+            session = self._next_due()
+            if session.closed or session.expired:
+                continue
+            self.__ready.put(session)
+
+    def _work(self)->None:
+        while True:
+            self._renew(self.__ready.get())
+
+    def _renew(self, session: Session)->None:
+        """Renew a session on a worker and schedule its next renewal"""
+        try:
+            session.keepalive()
+        except InvalidSession:
+            session.expired = True
+            logger.warning(f"Session {session.session_id} expired")
+            return
+        except Overloaded as e:
+            logger.warning(f"Keepalive of session {session.session_id} rejected: {e}")
+            self.add(session, min(e.retry_after, session.keepalive_interval))
+            return
+        except LockioError as e:
+            logger.warning(f"Keepalive of session {session.session_id} failed: {e}")
+            self.add(session, min(KEEPALIVE_RETRY_DELAY, session.keepalive_interval))
+            return
+        except Exception:
+            logger.exception(f"Keepalive of session {session.session_id} failed")
+            self.add(session, min(KEEPALIVE_RETRY_DELAY, session.keepalive_interval))
+            return
+        self.add(session)
+
+
+KEEPALIVE_LOOP = KeepaliveLoop()
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 import logging
 logging.basicConfig(level=logging.INFO)
 
@@ -42,9 +43,136 @@ def get_node_config()->tuple[str, list[str]]:
     return self_address, partner_addresses
 
 
+def get_storage_config()->dict:
+    """Get the journal and snapshot settings from environment variables
+
+    DATA_DIR: directory for the Raft journal and snapshots, in memory only when unset
+    SNAPSHOT_MIN_ENTRIES: log entries that trigger a snapshot
+    SNAPSHOT_MIN_TIME: seconds after which a snapshot is taken anyway"""
+
+    storage_config = {"data_dir": os.getenv("DATA_DIR") or None}
+    snapshot_min_entries = os.getenv("SNAPSHOT_MIN_ENTRIES")
+    if snapshot_min_entries:
+        storage_config["snapshot_min_entries"] = int(snapshot_min_entries)
+        if storage_config["snapshot_min_entries"] < 2:
+            raise ValueError(f"SNAPSHOT_MIN_ENTRIES must be at least 2, got {snapshot_min_entries}")
+    snapshot_min_time = os.getenv("SNAPSHOT_MIN_TIME")
+    if snapshot_min_time:
+        storage_config["snapshot_min_time"] = float(snapshot_min_time)
+        if storage_config["snapshot_min_time"] <= 0:
+            raise ValueError(f"SNAPSHOT_MIN_TIME must be positive, got {snapshot_min_time}")
+    return storage_config
+
+
+def get_batching_config()->dict:
+    """Get the group commit settings from environment variables
+
+    BATCH_MAX_OPS: operations replicated together in one log entry, 1 turns group commit off
+    BATCH_MAX_DELAY_US: microseconds an operation waits for others to join its batch"""
+
+    batching_config = {}
+    batch_max_ops = os.getenv("BATCH_MAX_OPS")
+    if batch_max_ops:
+        batching_config["batch_max_ops"] = int(batch_max_ops)
+        if batching_config["batch_max_ops"] < 1:
+            raise ValueError(f"BATCH_MAX_OPS must be at least 1, got {batch_max_ops}")
+    batch_max_delay_us = os.getenv("BATCH_MAX_DELAY_US")
+    if batch_max_delay_us:
+        batching_config["batch_max_delay"] = float(batch_max_delay_us) / 1e6
+        if batching_config["batch_max_delay"] < 0:
+            raise ValueError(f"BATCH_MAX_DELAY_US must not be negative, got {batch_max_delay_us}")
+    return batching_config
+
+
+def get_admission_config()->dict:
+    """Get the admission control settings from environment variables
+
+    MAX_IN_FLIGHT_WRITES: client writes that may wait for their commit at once
+    MAX_COMMIT_LATENCY_MS: commit latency above which acquires and new sessions are rejected"""
+
+    admission_config = {}
+    max_in_flight_writes = os.getenv("MAX_IN_FLIGHT_WRITES")
+    if max_in_flight_writes:
+        admission_config["max_in_flight_writes"] = int(max_in_flight_writes)
+        if admission_config["max_in_flight_writes"] < 1:
+            raise ValueError(f"MAX_IN_FLIGHT_WRITES must be at least 1, got {max_in_flight_writes}")
+    max_commit_latency_ms = os.getenv("MAX_COMMIT_LATENCY_MS")
+    if max_commit_latency_ms:
+        admission_config["max_commit_latency"] = float(max_commit_latency_ms) / 1000
+        if admission_config["max_commit_latency"] <= 0:
+            raise ValueError(f"MAX_COMMIT_LATENCY_MS must be positive, got {max_commit_latency_ms}")
+    return admission_config
+
+
+def get_sharding_config()->dict:
+    """Get the Raft group settings from environment variables
+
+    RAFT_GROUPS: number of Raft groups every node hosts, resources are sharded over them
+    RAFT_GROUP_PORT_STRIDE: Raft port distance between the groups of a node"""
+
+    sharding_config = {"groups": int(os.getenv("RAFT_GROUPS", '1'))}
+    if sharding_config["groups"] < 1:
+        raise ValueError(f"RAFT_GROUPS must be at least 1, got {sharding_config['groups']}")
+    port_stride = os.getenv("RAFT_GROUP_PORT_STRIDE")
+    if port_stride:
+        sharding_config["port_stride"] = int(port_stride)
+        if sharding_config["port_stride"] < 1:
+            raise ValueError(f"RAFT_GROUP_PORT_STRIDE must be positive, got {port_stride}")
+    return sharding_config
+
+
+def get_server_mode()->str:
+    """Get the HTTP server mode from environment variables
+
+    async: aiohttp event loop that awaits Raft commits without a thread per request
+    flask: threaded Flask server, one thread per request"""
+
+    server_mode = os.getenv("SERVER_MODE", "async")
+    if server_mode not in ("flask", "async"):
+        raise ValueError(f"SERVER_MODE must be 'flask' or 'async', got {server_mode}")
+    return server_mode
+
+
 def get_api_port()->int:
     """Get the Flask API port from environment variables"""
 
     api_port = int(os.getenv("API_PORT", '5000'))
     return api_port
     
+
+def get_binary_port()->Optional[int]:
+    """Get the binary protocol port from environment variables, None when BINARY_PORT is unset"""
+
+    binary_port = os.getenv("BINARY_PORT")
+    if not binary_port:
+        return None
+    return int(binary_port)
+
+
+def get_api_addresses(raft_addresses: list[str])->dict[str, str]:
+    """Get the API address of every Raft node from environment variables
+
+    API_ADDRESSES maps Raft addresses to API addresses as
+    'raft_host:raft_port=api_host:api_port,...'. Nodes that are not listed
+    serve the API on their Raft host and API_PORT."""
+
+    api_port = get_api_port()
+    api_addresses = {}
+    for raft_address in raft_addresses:
+        host = raft_address.split(':')[0]
+        api_addresses[raft_address] = f"{host}:{api_port}"
+
+    api_addresses_str = os.getenv("API_ADDRESSES")
+    if api_addresses_str:
+        for pair in api_addresses_str.split(','):
+            pair = pair.strip()
+            if not pair:
+                continue
+            if "=" not in pair:
+                raise ValueError(f"API_ADDRESSES entries must be 'raft_address=api_address', got {pair}")
+            raft_address, api_address = (part.strip() for part in pair.split('=', 1))
+            validate_address(raft_address, f"API_ADDRESSES Raft address '{raft_address}'")
+            validate_address(api_address, f"API_ADDRESSES API address '{api_address}'")
+            api_addresses[raft_address] = api_address
+
+    return api_addresses
@@ -0,0 +1,61 @@
+"""Pool of keep-alive HTTP connections, shared by the REST client and the leader forwarder"""
+import http.client
+import queue
+import select
+
+# Idle keep-alive connections kept per API address
+POOL_SIZE = 16
+
+
+def _is_dropped(connection: http.client.HTTPConnection)->bool:
+    """Check if the server closed an idle connection
+
+    An idle connection has nothing to read until the server closes it."""
+    if connection.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class ConnectionPool:
+    """Pool of persistent HTTP/1.1 connections to one API address"""
+
+    def __init__(self, address: str, size: int = POOL_SIZE):
+        self.address = address
+        self.__idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    def get(self, timeout: float)->tuple[http.client.HTTPConnection, bool]:
+        """Get a connection and whether it was reused from the pool
+
+        Idle connections the server closed are dropped on the way."""
+        while True:
+            try:
+                connection = self.__idle.get_nowait()
+            except queue.Empty:
+                host, port = self.address.split(':')
+                return http.client.HTTPConnection(host, int(port), timeout=timeout), False
+            if _is_dropped(connection):
+                connection.close()
+                continue
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+
+    def put(self, connection: http.client.HTTPConnection)->None:
+        """Return a healthy connection to the pool"""
+        try:
+            self.__idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self)->None:
+        """Close all idle connections"""
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                return
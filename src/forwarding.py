@@ -0,0 +1,115 @@
+from typing import Optional
+import http.client
+import json
+from .connection_pool import ConnectionPool
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# Marks a request that was already forwarded once, so it is never forwarded again
+FORWARDED_HEADER = "X-Lockio-Forwarded"
+# Socket timeout for a forwarded request, on top of any lock wait time
+FORWARD_TIMEOUT = 30.0
+# Attempts before giving up, each one re-resolves the leader. Requests
+# that may have reached the leader are only retried if they are retryable.
+FORWARD_ATTEMPTS = 3
+
+_HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "transfer-encoding", "content-length", "host",
+    "proxy-authenticate", "proxy-authorization", "te", "trailers", "upgrade",
+}
+
+
+def forward_error(status: int, error: str, leader: Optional[str])->tuple[int, dict]:
+    """Get the status and body of a request the leader did not answer"""
+    return status, {
+        "error": error,
+        "leader": leader,
+    }
+
+
+class LeaderForwarder:
+    """Proxies API requests from a follower to the current Raft leader"""
+
+    def __init__(self, lock_service, api_addresses: dict[str, str]):
+        self.__lock_service = lock_service
+        self.__api_addresses = api_addresses
+        self.__pools: dict[str, ConnectionPool] = {}
+
+    def _get_pool(self, api_address: str)->ConnectionPool:
+        pool = self.__pools.get(api_address)
+        if pool is None:
+            pool = self.__pools.setdefault(api_address, ConnectionPool(api_address))
+        return pool
+
+    def leader_api_address(self, resource: Optional[str] = None, session_id: Optional[str] = None)->Optional[str]:
+        """Get the API address of the current leader, None if this node is leader or none is known
+
+        With a resource or session, the leader of the Raft group that owns it, see route."""
+        group = self.__lock_service.route(resource, session_id)
+        if group.is_leader():
+            return None
+        leader = group.get_leader()
+        if leader is None:
+            return None
+        return self.__api_addresses.get(leader)
+
+    def forward(self, method: str, path: str, body: bytes, headers: dict,
+                extra_timeout: float = 0.0, resource: Optional[str] = None,
+                retryable: bool = False, session_id: Optional[str] = None)->tuple[int, list[tuple[str, str]], bytes]:
+        """Send a request to the leader and return (status, headers, body)
+
+        An attempt that failed before the request was written is retried
+        on the current leader. One that failed later may have been applied,
+        so it is only retried when retryable, for reads and for writes with
+        a request ID, which are applied once however often they arrive.
+        Otherwise the answer is a 503, or a 504 after a timeout, and the
+        request is never served locally on top."""
+        headers = {k: v for k, v in headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS}
+        headers[FORWARDED_HEADER] = "1"
+        timeout = FORWARD_TIMEOUT + extra_timeout
+
+        api_address = None
+        for attempt in range(FORWARD_ATTEMPTS):
+            api_address = self.leader_api_address(resource, session_id)
+            if api_address is None:
+                return self._error(*forward_error(503, "No leader to forward the request to", None))
+            pool = self._get_pool(api_address)
+            connection, _ = pool.get(timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+            except (http.client.HTTPException, OSError) as e:
+                # Nothing reached the leader
+                connection.close()
+                logger.warning(f"Sending to leader {api_address} failed: {e}")
+                continue
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                logger.warning(f"Leader {api_address} did not answer: {e}")
+                if retryable:
+                    continue
+                if isinstance(e, TimeoutError):
+                    return self._error(*forward_error(504, "The leader did not answer in time, "
+                                                      "the request may have been applied", api_address))
+                return self._error(*forward_error(503, "The leader did not answer, "
+                                                  "the request may have been applied", api_address))
+            if response.will_close:
+                connection.close()
+            else:
+                pool.put(connection)
+            response_headers = [(k, v) for k, v in response.getheaders() if k.lower() not in _HOP_BY_HOP_HEADERS]
+            return response.status, response_headers, data
+        return self._error(*forward_error(503, "Forwarding to the leader failed", api_address))
+
+    @staticmethod
+    def _error(status: int, body: dict)->tuple[int, list[tuple[str, str]], bytes]:
+        return status, [("Content-Type", "application/json")], json.dumps(body).encode()
+
+    def close(self)->None:
+        """Close all pooled connections"""
+        for pool in list(self.__pools.values()):
+            pool.close()
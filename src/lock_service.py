@@ -1,51 +1,429 @@
-from typing import Optional
+from typing import Callable, Optional
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import functools
+import heapq
+import itertools
+import math
+import os
+import sys
 import threading
 import uuid
 import time
-from pysyncobj import SyncObj, SyncObjConf, replicated
+from pysyncobj import SyncObj, SyncObjConf, SyncObjException, FAIL_REASON, replicated
+from pysyncobj.syncobj import _RAFT_STATE
+from .admission import MAX_COMMIT_LATENCY, MAX_IN_FLIGHT_WRITES, PRIORITY_HIGH, PRIORITY_LOW, AdmissionController, Overloaded
+from .batching import CommitBatcher
+from .metrics import (
+    ACQUIRES, APPLY_SECONDS, COMMIT_SECONDS, LEADER_CHANGES, REPLAYED_REQUESTS, SESSION_EXPIRATIONS, PrefixLabels,
+)
+from .records import LOCK_EXCLUSIVE, LOCK_SEMAPHORE, LOCK_SHARED, LOCK_MODES, Lock, LockEntry, Session, SharedLock  # noqa: F401
+from .resource_index import ResourceIndex
+from .snapshot import read_snapshot, write_snapshot
+from .transport import ContactTrackingTransport
+from .watch import (
+    DEFAULT_WATCH_LIMIT, LEADER_CHANGED, LOCK_ACQUIRED, LOCK_RELEASED, SESSION_CREATED, SESSION_DELETED,
+    SESSION_EXPIRED, EventLog,
+)
 import logging
 logging.basicConfig(level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
-_instance_locks = {}
-_locks_lock = threading.RLock()
+# How often the leader writes batched lease extensions through Raft
+LEASE_FLUSH_INTERVAL = 1.0
+# A leader-local keepalive is only replicated once less than this fraction
+# of the session timeout is left on the replicated lease
+LEASE_RENEW_THRESHOLD = 0.5
+# Maximum number of sessions processed by one reaper log entry
+REAPER_BATCH_SIZE = 500
+# The expiry index is rebuilt once it holds more than twice as many entries
+# as there are sessions, plus this many
+EXPIRY_COMPACT_MIN = 1024
+# Returned by a waiting _acquire_lock_internal when the session was queued
+# behind the current holder. Fence tokens start at 1.
+WAITING = 0
+# Result of a request ID the session has not used, see LockService._once
+_UNSEEN = object()
 
-def _get_instance_lock(instance_id:int)->threading.RLock:
-    with _locks_lock:
-        if instance_id not in _instance_locks:
-            _instance_locks[instance_id] = threading.RLock()
-        return _instance_locks[instance_id]
+# Read consistency modes
+READ_LINEARIZABLE = "linearizable"
+READ_STALE = "stale"
+DEFAULT_MAX_STALENESS_MS = 1000.0
+# Messages of the ReadIndex rounds that confirm leadership for linearizable
+# reads, see read_barrier_async. They travel over the Raft connections.
+READ_INDEX = "lockio_read_index"
+READ_INDEX_ACK = "lockio_read_index_ack"
+# Reads of a round a majority has not confirmed after this many seconds fail
+READ_ROUND_TIMEOUT = 2.0
+# Default election timeout range in seconds
+ELECTION_TIMEOUT = (0.4, 1.4)
+# The leader acknowledges keepalives from memory only while a majority
+# answered it this recently, well below the election timeout of any node
+LEASE_ACK_WINDOW = ELECTION_TIMEOUT[0] / 2
+
+# A snapshot is taken once the Raft log holds more entries than this,
+# or after SNAPSHOT_MIN_TIME seconds, and the log before it is dropped
+SNAPSHOT_MIN_ENTRIES = 5000
+SNAPSHOT_MIN_TIME = 300.0
+
+# Replicated state attributes, see __init__
+_REPLICATED_STATE = (
+    "_LockService__sessions",
+    "_LockService__locks",
+    "_LockService__fence_counter",
+    "_LockService__expiry_heap",
+    "_LockService__waiters",
+    "_LockService__lease_grace_start",
+    "_LockService__resource_index",
+    "_LockService__create_requests",
+)
+
+# Page size limits of list_locks
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+# Longest request ID a client may attach to a write, see Session.requests
+MAX_REQUEST_ID_LENGTH = 128
+
+# Group commit: operations of concurrent callers are replicated as one log
+# entry of up to BATCH_MAX_OPS operations, collected for up to BATCH_MAX_DELAY
+# seconds. A batch size of 1 replicates every operation on its own.
+BATCH_MAX_OPS = 128
+BATCH_MAX_DELAY = 0.0003
+# Replicated methods that can run inside a batch, a batch refers to them by index
+_BATCHED_METHODS = (
+    "_create_session_internal",
+    "_keepalive_internal",
+    "_delete_session_internal",
+    "_acquire_lock_internal",
+    "_cancel_wait_internal",
+    "_release_lock_internal",
+    "_acquire_locks_internal",
+    "_release_locks_internal",
+    "_expire_sessions_internal",
+)
+# Admission priority of the writes clients submit, see AdmissionController.
+# Writes of the node itself, like reaping expired sessions, are always
+# admitted, and so are cancelled waits, which must not stay queued behind
+# the acquire they cancel.
+_WRITE_PRIORITIES = {
+    "_keepalive_internal": PRIORITY_HIGH,
+    "_delete_session_internal": PRIORITY_HIGH,
+    "_release_lock_internal": PRIORITY_HIGH,
+    "_release_locks_internal": PRIORITY_HIGH,
+    "_create_session_internal": PRIORITY_LOW,
+    "_acquire_lock_internal": PRIORITY_LOW,
+    "_acquire_locks_internal": PRIORITY_LOW,
+}
+
+def _resolved(result)->Future:
+    """Get a future that already holds the result"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+def _resolve(future: Future, result, error: int)->None:
+    """Resolve a future with the outcome of a replicated call"""
+    if error == FAIL_REASON.SUCCESS:
+        future.set_result(result)
+    else:
+        future.set_exception(SyncObjException(error))
+
+def _method_label(name: str)->str:
+    """Get the metrics label of a replicated method, _acquire_lock_internal is acquire_lock"""
+    return name.strip("_").removesuffix("_internal")
+
+def _timed_apply(func):
+    """Record how long applying a replicated method takes, goes below @replicated
+
+    A method that raises gets a None result instead. pysyncobj applies a
+    log entry again and again until it does not raise, so an error would
+    stop the node from applying anything after it, and inside a batch
+    would take every other operation of the batch down with it. The
+    methods validate their arguments, this is the last line of defence."""
+    apply_seconds = APPLY_SECONDS.labels(_method_label(func.__name__))
+
+    @functools.wraps(func)
+    def apply(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            logger.exception(f"Applying {func.__name__} failed, its result is None")
+            return None
+        finally:
+            apply_seconds.observe(time.perf_counter() - started)
+    return apply
+
+# Resource prefix labels of the acquire outcome counter
+_acquire_prefix = PrefixLabels()
+
+def _count_acquire(resource: str, future: Future)->None:
+    """Count the outcome of an acquire once it is applied"""
+    def on_result(result: Future):
+        if isinstance(result.exception(), Overloaded):
+            outcome = "rejected"
+        elif result.exception() is not None:
+            outcome = "error"
+        elif result.result() is None:
+            outcome = "conflict"
+        elif result.result() == WAITING:
+            outcome = "queued"
+        else:
+            outcome = "granted"
+        ACQUIRES.labels(_acquire_prefix(resource), outcome).inc()
+    future.add_done_callback(on_result)
 
 class LockService(SyncObj):
+    # Raft transport, subclasses may extend ContactTrackingTransport
+    transport_class = ContactTrackingTransport
 
-    def __init__(self, self_address: str, partner_addresses: list[str]):
+    def __init__(self, self_address: str, partner_addresses: list[str],
+                 lease_flush_interval: float = LEASE_FLUSH_INTERVAL,
+                 reaper_batch_size: int = REAPER_BATCH_SIZE,
+                 data_dir: Optional[str] = None,
+                 snapshot_min_entries: int = SNAPSHOT_MIN_ENTRIES,
+                 snapshot_min_time: float = SNAPSHOT_MIN_TIME,
+                 election_timeout: tuple[float, float] = ELECTION_TIMEOUT,
+                 batch_max_ops: int = BATCH_MAX_OPS,
+                 batch_max_delay: float = BATCH_MAX_DELAY,
+                 max_in_flight_writes: int = MAX_IN_FLIGHT_WRITES,
+                 max_commit_latency: float = MAX_COMMIT_LATENCY,
+                 lease_listener: Optional[Callable[[dict[str, float]], None]] = None):
         """
-        Initialize distributed lock service"""
+        Initialize distributed lock service
+
+        With a data_dir every log entry is journaled to disk and snapshots
+        are written there in the compact format of snapshot.py. A restarted
+        node loads its last snapshot and replays only the journal after it.
+        Snapshots are written by a forked child, see _write_snapshot.
+
+        A node with a shorter election_timeout than its peers usually wins
+        elections, which spreads the leaders of several groups over nodes.
+
+        Operations submitted by concurrent callers are group committed in
+        batches of up to batch_max_ops, see _submit. At most
+        max_in_flight_writes of them wait for their commit at once, and new
+        work is rejected while commits take longer than max_commit_latency,
+        see AdmissionController.
 
+        lease_listener is called, mostly from the tick thread, with every batch of
+        leader-local keepalives this group replicates, see ShardedLockService."""
+
+        storage = {}
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            file_prefix = os.path.join(data_dir, self_address.replace(':', '_'))
+            storage = {
+                "journalFile": f"{file_prefix}.journal",
+                "fullDumpFile": f"{file_prefix}.snapshot",
+                "serializer": self._write_snapshot,
+                "deserializer": self._read_snapshot,
+            }
         conf = SyncObjConf(
             autoTick=True,
-            dynamicMembershipChange=True
+            dynamicMembershipChange=True,
+            onStateChanged=self._on_state_changed,
+            logCompactionMinEntries=snapshot_min_entries,
+            logCompactionMinTime=snapshot_min_time,
+            raftMinTimeout=election_timeout[0],
+            raftMaxTimeout=election_timeout[1],
+            # With group commit every batch is sent to followers right away,
+            # otherwise pysyncobj collects commands for up to a tick
+            appendEntriesUseBatch=batch_max_ops <= 1,
+            **storage,
         )
 
-        self.__instance_id = id(self)
-        
-        super().__init__(self_address, partner_addresses, conf)
-        # Lock service state container for replication
-        self.__sessions: dict[str, dict] = {}
-        self.__locks: dict[str, dict] = {}
+        # Leader-local lease state. Assigned before SyncObj init so it is
+        # excluded from replicated snapshots.
+        self.__lease_renewals: dict[str, float] = {}
+        self.__lease_flush_interval = lease_flush_interval
+        self.__lease_listener = lease_listener
+        self.__last_lease_flush = 0.0
+        self.__reaper_batch_size = reaper_batch_size
+        self.__reap_in_flight = False
+        # Blocking acquires waiting on this node, keyed by (session_id, resource)
+        self.__grant_futures: dict[tuple[str, str], Future] = {}
+        # Raft contact tracking for bounded-staleness reads
+        self.__peer_acks: dict = {}
+        self.__leader_ready_term = -1
+        self.__fresh_as_of = 0.0
+        self.__pending_freshness: Optional[tuple[float, int]] = None
+        # Linearizable reads waiting for the applied index, as a heap of (index, seq, future)
+        self.__apply_waiters: list[tuple[int, int, Future]] = []
+        self.__apply_waiters_lock = threading.Lock()
+        self.__apply_waiter_seq = itertools.count()
+        # Linearizable reads waiting for the next ReadIndex round as (term, read index, future),
+        # and the rounds in flight by sequence number as (term, started, acked nodes, reads)
+        self.__read_queue: list[tuple[int, int, Future]] = []
+        self.__read_queue_lock = threading.Lock()
+        self.__read_rounds: dict[int, tuple[int, float, set, list[tuple[int, Future]]]] = {}
+        self.__read_round_seq = itertools.count(1)
+        self.__method_index = {name: index for index, name in enumerate(_BATCHED_METHODS)}
+        self.__commit_seconds = {name: COMMIT_SECONDS.labels(_method_label(name)) for name in _BATCHED_METHODS}
+        self.__admission = AdmissionController(max_in_flight_writes, max_commit_latency)
+        self.__batcher = None
+        if batch_max_ops > 1:
+            self.__batcher = CommitBatcher(self._submit_batch, batch_max_ops, batch_max_delay)
+
+        # Lock service state container for replication. It has to exist
+        # before SyncObj init, which starts the tick thread that loads the
+        # snapshot and replays the journal into it.
+        self.__sessions: dict[str, Session] = {}
+        self.__locks: dict[str, LockEntry] = {}
         self.__fence_counter: int = 0
+        # Min-heap of (deadline, session_id). Entries whose deadline no longer
+        # matches the session's expires_at are stale and skipped when popped.
+        self.__expiry_heap: list[tuple[float, str]] = []
+        # FIFO queue of waiting session IDs per resource and the (mode, permits)
+        # they wait for, as an insertion-ordered dict so a cancelled wait is
+        # removed in O(1)
+        self.__waiters: dict[str, dict[str, tuple[str, Optional[int]]]] = {}
+        # Leases are never considered older than this, see _grant_lease_grace_internal
+        self.__lease_grace_start: float = 0.0
+        # Path trie over the keys of __locks for prefix queries and hierarchical locks
+        self.__resource_index = ResourceIndex()
+        # Session IDs by the request ID that created them, see Session.create_request
+        self.__create_requests: dict[str, str] = {}
+        # Events of applied entries for watchers, kept per node and out of
+        # snapshots. Loading a snapshot replaces the sessions dict, which
+        # tells the event log to start over, see _emit.
+        self.__event_log = EventLog()
+        self.__event_log_sessions = self.__sessions
 
-        
+        super().__init__(self_address, partner_addresses, conf,
+                         transportClass=self.transport_class)
+        # SyncObj leaves attributes set before its init out of the snapshots
+        # it pickles when there is no data_dir, put the replicated ones back
+        self._SyncObj__properies.difference_update(_REPLICATED_STATE)
+        if data_dir and conf.useFork and hasattr(os, "fork"):
+            # pysyncobj only forks to write its own pickles, see _write_snapshot
+            self._SyncObj__serializer._Serializer__useFork = True
+
+        self.addOnTickCallback(self._on_tick)
         
         logger.info(f"Lock service initialized with {self_address}")
         logger.info(f"Partners {partner_addresses}")
 
+    def _write_snapshot(self, file_name: str, raft_meta: tuple)->None:
+        """Custom serializer for SyncObj log compaction
+
+        Writing 1M sessions takes seconds, far longer than an election
+        timeout, so it must not run on the tick thread. pysyncobj turns its
+        fork mode off for custom serializers, and __init__ turns it back
+        on: pysyncobj then calls this in a forked child, which writes from
+        its copy on write view of the state, and moves file_name into place
+        once this returns. The tick thread only pays for the fork."""
+        write_snapshot(file_name, raft_meta, {
+            "sessions": self.__sessions,
+            "locks": self.__locks,
+            "fence_counter": self.__fence_counter,
+            "lease_grace_start": self.__lease_grace_start,
+            "waiters": self.__waiters,
+        })
+
+    def _read_snapshot(self, file_name: str)->tuple:
+        """Custom deserializer for SyncObj, loads the state of a snapshot
+
+        Called on restart and when the leader installs a snapshot on this node."""
+        raft_meta, state = read_snapshot(file_name)
+        self.__sessions = state['sessions']
+        self.__locks = state['locks']
+        self.__fence_counter = state['fence_counter']
+        self.__lease_grace_start = state['lease_grace_start']
+        self.__waiters = state['waiters']
+        self._rebuild_expiry_index()
+        self.__resource_index = ResourceIndex()
+        for resource in self.__locks:
+            self.__resource_index.add(resource)
+        self.__create_requests = {
+            session.create_request: session_id
+            for session_id, session in self.__sessions.items() if session.create_request is not None
+        }
+        logger.info(f"Loaded snapshot {file_name} with {len(self.__sessions)} sessions and {len(self.__locks)} locks")
+        return raft_meta
+
+    def _submit(self, method, *args)->Future:
+        """Submit a replicated call without waiting for its commit
+
+        Any number of calls can be in flight at once. The state machine
+        applies them in log order, so no lock is needed around them.
+        With group commit the call joins the next batch instead of taking
+        a log entry of its own, see _run_batch_internal.
+
+        Client writes go through admission control first. A rejected write
+        gets a future that holds an Overloaded error, and high priority
+        writes go ahead of the others in the next batch."""
+        priority = _WRITE_PRIORITIES.get(method.__name__)
+        if priority is not None:
+            try:
+                self.__admission.admit(priority)
+            except Overloaded as e:
+                future = Future()
+                future.set_exception(e)
+                return future
+        started = time.perf_counter()
+        if self.__batcher is not None:
+            future = self.__batcher.submit((self.__method_index[method.__name__], args),
+                                           urgent=priority == PRIORITY_HIGH)
+        else:
+            future = self._submit_now(method, *args)
+        commit_seconds = self.__commit_seconds[method.__name__]
+        admission = self.__admission if priority is not None else None
+
+        def on_done(_):
+            elapsed = time.perf_counter() - started
+            commit_seconds.observe(elapsed)
+            if admission is not None:
+                admission.done(elapsed)
+        future.add_done_callback(on_done)
+        return future
+
     @property
-    def _lock(self)->threading.RLock:
-        return _get_instance_lock(self.__instance_id)
-    
+    def writes_in_flight(self)->int:
+        """Client writes admitted and waiting for their commit"""
+        return self.__admission.in_flight
+
+    def _submit_now(self, method, *args)->Future:
+        """Submit a replicated call as its own log entry"""
+        future = Future()
+        method(*args, callback=lambda result, error: _resolve(future, result, error))
+        return future
             
+    def _submit_batch(self, batch: list[tuple[tuple, Future]])->None:
+        """Replicate a batch of operations, called from the batcher thread"""
+        if len(batch) == 1:
+            # Not worth the batch wrapper
+            (method_index, args), future = batch[0]
+            getattr(self, _BATCHED_METHODS[method_index])(
+                *args, callback=lambda result, error: _resolve(future, result, error),
+            )
+            return
+
+        def on_result(results, error):
+            if error != FAIL_REASON.SUCCESS:
+                results = [None] * len(batch)
+            for (_, future), result in zip(batch, results):
+                _resolve(future, result, error)
+
+        self._run_batch_internal([operation for operation, _ in batch], callback=on_result)
+
+    @replicated
+    def _run_batch_internal(self, operations: list[tuple[int, tuple]])->list:
+        """Apply a batch of replicated calls in order - internal replicated method
+
+        Named to sort after the other replicated methods, so the method
+        IDs of journals written before group commit stay the same."""
+        return [
+            getattr(self, _BATCHED_METHODS[method_index])(*args, _doApply=True)
+            for method_index, args in operations
+        ]
+
+    def destroy(self):
+        """Flush pending operations and stop the Raft node"""
+        if self.__batcher is not None:
+            self.__batcher.close()
+        super().destroy()
+
     def get_leader(self)->Optional[str]:
         """Wrapper for raft internal method"""
         leader = self._getLeader()
@@ -60,33 +438,238 @@ class LockService(SyncObj):
     def is_ready(self)->bool:
         """Wrapper for raft internal method"""
         return self.isReady()
-        
+
+    def group_for(self, resource: str)->"LockService":
+        """Get the Raft group that owns a resource, always this one, see ShardedLockService"""
+        return self
+
+    def route(self, resource: Optional[str] = None, session_id: Optional[str] = None)->"LockService":
+        """Get the Raft group that serves a request, always this one, see ShardedLockService"""
+        return self
+
+    def _on_state_changed(self, old_state: int, new_state: int):
+        """Raft state change hook, called from the tick thread"""
+        if new_state == _RAFT_STATE.LEADER:
+            # Keepalives acknowledged by the previous leader may never have
+            # been replicated, so extend every lease before expiring anything.
+            # Its commit also marks the first entry of this term as committed.
+            term = self.raftCurrentTerm
+            self._grant_lease_grace_internal(
+                time.time(), str(self.selfNode), term,
+                callback=lambda result, error: self._on_leader_ready(term, error),
+            )
+        elif old_state == _RAFT_STATE.LEADER:
+            self.__lease_renewals.clear()
+            self.__reap_in_flight = False
+            self._fail_read_rounds(set(self.__read_rounds))
+
+    def _on_leader_ready(self, term: int, error: int):
+        """Commit callback of the first entry of a leader term"""
+        if error == FAIL_REASON.SUCCESS:
+            self.__leader_ready_term = term
+
+    def _on_raft_message(self, node, message: dict)->bool:
+        """Raft message hook, called from the tick thread by ContactTrackingTransport
+
+        Returns True for the messages of the lock service itself, which
+        are not passed on to Raft."""
+        message_type = message.get('type')
+        if message_type == 'next_node_idx':
+            self.__peer_acks[node] = time.monotonic()
+        elif message_type == 'append_entries':
+            self.__pending_freshness = (time.monotonic(), message['commit_index'])
+        elif message_type == READ_INDEX:
+            # The leader counts the answer only if this node is still in its term
+            self._SyncObj__transport.send(node, {
+                'type': READ_INDEX_ACK, 'seq': message['seq'], 'term': self.raftCurrentTerm,
+            })
+            return True
+        elif message_type == READ_INDEX_ACK:
+            self._on_read_index_ack(node, message['seq'], message['term'])
+            return True
+        return False
+
+    def _on_tick(self):
+        """Periodic work, called from the tick thread"""
+        pending = self.__pending_freshness
+        if pending is not None and self.raftLastApplied >= pending[1]:
+            self.__fresh_as_of = pending[0]
+            self.__pending_freshness = None
+        self._resolve_apply_waiters()
+        self._start_read_round()
+        self._expire_read_rounds(time.monotonic())
+        self._check_event_log()
+        self.__event_log.publish(self.raftLastApplied)
+        self._drop_stale_expiries()
+
+        if not self.is_leader():
+            return
+        now = time.time()
+        if now - self.__last_lease_flush >= self.__lease_flush_interval:
+            self.__last_lease_flush = now
+            self._flush_lease_renewals(now)
+        if not self.__reap_in_flight and self._has_due_expiries(now):
+            self.__reap_in_flight = True
+            self._expire_sessions_internal(
+                now, self.__reaper_batch_size, self._due_lease_renewals(now),
+                callback=self._on_reaped,
+            )
+
+    def _on_reaped(self, expired: Optional[int], error: int):
+        """Reaper commit callback, called from the tick thread"""
+        self.__reap_in_flight = False
+        if expired:
+            SESSION_EXPIRATIONS.inc(expired)
+            logger.info(f"Reaper expired {expired} sessions")
+
+    def _check_event_log(self)->None:
+        """Start the event log over if a snapshot was loaded since the last check
+
+        The state then jumped past entries this node never applied, so
+        their events are missing."""
+        if self.__event_log_sessions is not self.__sessions:
+            self.__event_log_sessions = self.__sessions
+            self.__event_log.reset(self.raftLastApplied)
+
+    def _emit(self, event_type: str, **fields)->None:
+        """Record an event of the log entry being applied, for watchers"""
+        self._check_event_log()
+        # raftLastApplied moves to the entry once it is applied
+        self.__event_log.append(self.raftLastApplied + 1, {"type": event_type, **fields})
+
     @replicated
-    def _create_session_internal(self, client_id: str, session_id: str, timeout: int)->str:
-        """Create a client session - internal replicated method"""
+    @_timed_apply
+    def _create_session_internal(self, client_id: str, session_id: str, timeout: int, now: float,
+                                 request_id: Optional[str] = None)->Optional[str]:
+        """Create a client session - internal replicated method
+
+        A session that exists is left as it is, so a retried creation does
+        not reset it. A request ID that created a session before gets that
+        session, see _created_session. An invalid timeout creates no
+        session and returns None."""
         logger.info("Inside _create_session_internal")
-        self.__sessions[session_id] = {
-            "session_id": session_id,
-            "client_id": client_id,
-            "timeout": timeout,
-            "created_at": time.time(),
-            "last_keepalive": time.time(),
-            "locks_held": [],
-        }
+        if request_id is not None and request_id in self.__create_requests:
+            return self._created_session(request_id, client_id, timeout)
+        if session_id in self.__sessions:
+            return session_id
+        try:
+            self.check_client_id(client_id)
+            self.check_timeout(timeout)
+        except ValueError as e:
+            logger.warning(f"Create session failed: {e}")
+            return None
+        # Clients open many sessions under the same ID, share one string
+        session = Session(session_id, sys.intern(client_id), timeout, now, now, create_request=request_id)
+        self.__sessions[session_id] = session
+        if request_id is not None:
+            self.__create_requests[request_id] = session_id
+        self._schedule_expiry(session)
+        self._emit(SESSION_CREATED, session_id=session_id, client_id=client_id)
         logger.info(f"Created session {session_id}")
         return session_id        
     
-    def create_session(self, client_id: str, timeout:int = 60)->str:
+    def create_session_async(self, client_id: str, timeout:int = 60,
+                             session_id: Optional[str] = None, request_id: Optional[str] = None)->Future:
+        """Create a client session, returns a future for the session ID
+
+        A new session ID is generated unless one is given. The request ID
+        of a creation is a UUID, and every retry with it gets the session
+        the first attempt created, from applied state without a log entry
+        when it is there. A retry with another client ID or timeout gets
+        None, see _created_session."""
+        self.check_client_id(client_id)
+        self.check_timeout(timeout)
+        self.check_session_request_id(request_id)
+        if request_id is not None and request_id in self.__create_requests:
+            REPLAYED_REQUESTS.labels("create_session").inc()
+            return _resolved(self._created_session(request_id, client_id, timeout))
+        if session_id is None:
+            session_id = str(uuid.uuid4())
+        logger.info(f"Session ID is {session_id}")
+        return self._submit(self._create_session_internal, client_id, session_id, timeout, time.time(), request_id)
+
+    def _created_session(self, request_id: str, client_id: str, timeout: int)->Optional[str]:
+        """Get the session a request ID created, None if it was created with other parameters"""
+        session = self.__sessions[self.__create_requests[request_id]]
+        if session.client_id != client_id or session.timeout != timeout:
+            logger.warning(f"Create session failed: request ID {request_id} was used with other parameters")
+            return None
+        return session.session_id
+
+    def create_session(self, client_id: str, timeout:int = 60, request_id: Optional[str] = None)->str:
         """Create a client session"""
         logger.info("Entering lock service create_session")
-        with self._lock:
-            session_id = str(uuid.uuid4())
-            logger.info(f"Session ID is {session_id}")
-            return self._create_session_internal(client_id, session_id, timeout, sync=True)
+        return self.create_session_async(client_id, timeout, request_id=request_id).result()
+
+    def _lease_deadline(self, session:Session)->float:
+        """Get the time a session expires at according to the replicated lease"""
+        return max(session.last_keepalive, self.__lease_grace_start) + session.timeout
 
-    def _is_expired(self, session:dict)-> bool:
+    def _is_expired(self, session:Session, now: Optional[float] = None)-> bool:
         """Check if a session is expired"""
-        return (time.time() - session['last_keepalive']) > session['timeout']
+        if now is None:
+            now = time.time()
+        return now > self._lease_deadline(session)
+
+    def _schedule_expiry(self, session:Session)->None:
+        """Index the session under its current lease deadline
+
+        The entry of the previous deadline stays behind as a stale entry.
+        Once stale entries outnumber the sessions the index is rebuilt,
+        which costs no log entry: the reaper skips stale entries without
+        counting them, so every node reaps the same sessions whatever
+        stale entries it has."""
+        deadline = self._lease_deadline(session)
+        session.expires_at = deadline
+        heapq.heappush(self.__expiry_heap, (deadline, session.session_id))
+        if len(self.__expiry_heap) > 2 * len(self.__sessions) + EXPIRY_COMPACT_MIN:
+            self._rebuild_expiry_index()
+
+    def _rebuild_expiry_index(self)->None:
+        """Index every session once under its deadline, dropping stale entries"""
+        heap = [(session.expires_at, session_id) for session_id, session in self.__sessions.items()]
+        heapq.heapify(heap)
+        # Replaced at once for readers on other threads
+        self.__expiry_heap = heap
+
+    def _is_stale_expiry(self, deadline: float, session_id: str)->bool:
+        """Check if an expiry index entry belongs to a removed session or an earlier deadline"""
+        session = self.__sessions.get(session_id)
+        return session is None or session.expires_at != deadline
+
+    def _drop_stale_expiries(self)->None:
+        """Pop stale entries off the top of the expiry index, called from the tick thread between applies
+
+        Leaves a live entry on top, so the leader starts a reaper log
+        entry only for a due session, and the due part of the index that
+        get_stats walks holds only sessions waiting for the reaper."""
+        heap = self.__expiry_heap
+        while heap and self._is_stale_expiry(*heap[0]):
+            heapq.heappop(heap)
+
+    def _has_due_expiries(self, now: float)->bool:
+        """Check if the expiry index has entries past their deadline"""
+        return bool(self.__expiry_heap) and self.__expiry_heap[0][0] < now
+
+    def _iter_due_expiries(self, now: float):
+        """Yield (deadline, session_id) index entries past their deadline
+
+        Walks only the part of the heap below now, so the cost is
+        proportional to the number of due entries."""
+        heap = self.__expiry_heap
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            try:
+                deadline, session_id = heap[i]
+            except IndexError:
+                # Past the end, or the heap shrank under a concurrent reader
+                continue
+            if deadline >= now:
+                continue
+            yield deadline, session_id
+            stack.append(2 * i + 1)
+            stack.append(2 * i + 2)
         
     def get_session_info(self, session_id:str)->Optional[dict]:
         """Get session details by ID"""
@@ -95,96 +678,704 @@ class LockService(SyncObj):
             logger.warning(f"Get session info failed: {session_id} not found")
             return None
 
-        return session.copy()
+        return session.to_dict()
+
+    def _is_ready_leader(self)->bool:
+        """Check if this node is leader and has committed an entry in its term, so its commit index is current"""
+        return self.is_leader() and self.__leader_ready_term == self.raftCurrentTerm
+
+    def _leader_contact(self)->Optional[float]:
+        """Get the monotonic time by which a majority of the group last answered this leader
+
+        None on nodes that are not a ready leader. Only an estimate of how
+        current the leader's state is, linearizable reads do not use it."""
+        if not self._is_ready_leader():
+            return None
+        other_nodes = self.otherNodes
+        # Answers needed from other nodes for a majority with this one
+        needed = (len(other_nodes) + 1) // 2
+        if needed == 0:
+            return time.monotonic()
+        return sorted((self.__peer_acks.get(node, 0.0) for node in other_nodes), reverse=True)[needed - 1]
+
+    def _wake_tick(self)->None:
+        """Make the tick thread run now instead of at the end of its poll"""
+        notifier = getattr(self, "_SyncObj__pipeNotifier", None)
+        if notifier is not None:
+            notifier.notify()
+
+    def _start_read_round(self)->None:
+        """Send a ReadIndex round for the linearizable reads queued since the last one, on the tick thread"""
+        with self.__read_queue_lock:
+            queued, self.__read_queue = self.__read_queue, []
+        if not queued:
+            return
+        term = self.raftCurrentTerm
+        reads = []
+        for read_term, read_index, readable in queued:
+            if read_term == term and self.is_leader():
+                reads.append((read_index, readable))
+            else:
+                # Another term may have committed entries past the read index
+                readable.set_result(False)
+        if not reads:
+            return
+        seq = next(self.__read_round_seq)
+        self.__read_rounds[seq] = (term, time.monotonic(), set(), reads)
+        transport = self._SyncObj__transport
+        for node in self.otherNodes:
+            transport.send(node, {'type': READ_INDEX, 'seq': seq, 'term': term})
+        self._check_read_round(seq)
+
+    def _on_read_index_ack(self, node, seq: int, term: int)->None:
+        """Count the answer of a node to a ReadIndex round if it is still in the round's term"""
+        round_ = self.__read_rounds.get(seq)
+        if round_ is None or round_[0] != term or term != self.raftCurrentTerm:
+            return
+        round_[2].add(node)
+        self._check_read_round(seq)
+
+    def _check_read_round(self, seq: int)->None:
+        """Serve the reads of a round once a majority confirmed it, with those of every earlier round"""
+        _, _, acked, _ = self.__read_rounds[seq]
+        if len(acked) + 1 <= (len(self.otherNodes) + 1) / 2:
+            return
+        for done in [earlier for earlier in self.__read_rounds if earlier <= seq]:
+            for read_index, readable in self.__read_rounds.pop(done)[3]:
+                self._wait_applied(read_index).add_done_callback(
+                    lambda _, readable=readable: readable.set_result(True),
+                )
+
+    def _fail_read_rounds(self, seqs)->None:
+        """Fail the reads of ReadIndex rounds"""
+        for seq in seqs:
+            for _, readable in self.__read_rounds.pop(seq)[3]:
+                readable.set_result(False)
+
+    def _expire_read_rounds(self, now: float)->None:
+        """Fail the reads of rounds a majority did not confirm in time"""
+        cutoff = now - READ_ROUND_TIMEOUT
+        self._fail_read_rounds([seq for seq, round_ in self.__read_rounds.items() if round_[1] < cutoff])
+
+    def _wait_applied(self, index: int)->Future:
+        """Get a future that resolves once the log is applied up to index"""
+        if self.raftLastApplied >= index:
+            return _resolved(True)
+        future = Future()
+        with self.__apply_waiters_lock:
+            heapq.heappush(self.__apply_waiters, (index, next(self.__apply_waiter_seq), future))
+        return future
+
+    def _resolve_apply_waiters(self)->None:
+        """Resolve reads waiting for entries that are now applied"""
+        applied = self.raftLastApplied
+        with self.__apply_waiters_lock:
+            while self.__apply_waiters and self.__apply_waiters[0][0] <= applied:
+                heapq.heappop(self.__apply_waiters)[2].set_result(True)
+
+    def get_staleness_ms(self)->float:
+        """Get how far local state may lag behind the leader, in milliseconds
+
+        On the leader, the time since a majority last answered it."""
+        contact = self._leader_contact()
+        if contact is not None:
+            return (time.monotonic() - contact) * 1000
+        return (time.monotonic() - self.__fresh_as_of) * 1000
+
+    def read_barrier_async(self, consistency: str, max_staleness_ms: Optional[float] = None)->Future:
+        """Check local state is fit for a read, returns a future for a bool
+
+        linearizable: only on the leader, with ReadIndex. The read takes
+        the commit index, and the tick thread asks every other node for its
+        term in the next round. A majority still in this leader's term after
+        the read started means no other leader can have committed anything
+        before it, so the future resolves to True once the log is applied up
+        to that index. No log entry is added. A round a majority does not
+        confirm within READ_ROUND_TIMEOUT, or a change of term, gives False.
+        stale: on any node whose state is at most max_staleness_ms behind
+        the leader's commit index."""
+        if consistency == READ_LINEARIZABLE:
+            if not self._is_ready_leader():
+                return _resolved(False)
+            readable = Future()
+            with self.__read_queue_lock:
+                self.__read_queue.append((self.raftCurrentTerm, self.raftCommitIndex, readable))
+            self._wake_tick()
+            return readable
+        if consistency == READ_STALE:
+            if max_staleness_ms is None:
+                max_staleness_ms = DEFAULT_MAX_STALENESS_MS
+            return _resolved(self.get_staleness_ms() <= max_staleness_ms)
+        raise ValueError(f"Unknown read consistency {consistency}")
+
+    def read_barrier(self, consistency: str, max_staleness_ms: Optional[float] = None,
+                     timeout: Optional[float] = None)->bool:
+        """Check local state is fit for a read, see read_barrier_async"""
+        try:
+            return self.read_barrier_async(consistency, max_staleness_ms).result(timeout)
+        except FutureTimeoutError:
+            return False
 
-    def _get_session(self, session_id:str)->Optional[dict]:
+    def _get_session(self, session_id:str)->Optional[Session]:
         """Get session by ID"""
         return self.__sessions.get(session_id)
 
+    def _replay(self, session_id:str, request_id:Optional[str]):
+        """Get the result of a request ID the session used before, _UNSEEN if it did not"""
+        if request_id is None:
+            return _UNSEEN
+        session = self.__sessions.get(session_id)
+        if session is None or not session.requests:
+            return _UNSEEN
+        return session.requests.get(request_id, _UNSEEN)
+
+    def _remember(self, session_id:str, request_id:Optional[str], result)->None:
+        """Keep the result of a request in the request table of its session"""
+        if request_id is None:
+            return
+        session = self.__sessions.get(session_id)
+        if session is not None:
+            session.remember(request_id, result)
+
+    def _once(self, session_id:str, request_id:Optional[str], apply, *args):
+        """Apply a write of a session once per request ID, called from replicated methods
+
+        A retry gets the result of the first attempt and changes nothing
+        else. The request table is replicated state, so a retry that
+        reaches a new leader after a failover is answered the same way."""
+        result = self._replay(session_id, request_id)
+        if result is _UNSEEN:
+            result = apply(*args)
+        self._remember(session_id, request_id, result)
+        return result
+
+    def _replayed(self, method: str, session_id:str, request_id:Optional[str])->Optional[Future]:
+        """Get a future for the result of a retried request, None if the request has to be replicated
+
+        The request table only holds committed results, so a node answers
+        retries from its own state without a log entry."""
+        result = self._replay(session_id, request_id)
+        if result is _UNSEEN or result == WAITING:
+            return None
+        REPLAYED_REQUESTS.labels(method).inc()
+        return _resolved(result)
+
     @replicated
-    def _keepalive_internal(self, session_id: str)->bool:
+    @_timed_apply
+    def _keepalive_internal(self, session_id: str, now: float)->bool:
         """Update keepalive for a client session"""
         session = self._get_session(session_id)
         if not session:
             logger.warning(f"Keepalive failed: {session_id} not found")
             return False
-        if self._is_expired(session):
+        if self._is_expired(session, now):
             logger.warning(f"Keepalive failed: {session_id} expired")
             return False
-        session['last_keepalive'] = time.time()
+        session.last_keepalive = now
+        self._schedule_expiry(session)
         
         return True
-  
+
+    def _apply_lease_renewals(self, renewals: dict[str, float])->int:
+        """Move replicated leases forward to the given keepalive times"""
+        extended = 0
+        for session_id, renewed_at in renewals.items():
+            session = self._get_session(session_id)
+            if not session or renewed_at <= session.last_keepalive:
+                continue
+            session.last_keepalive = renewed_at
+            self._schedule_expiry(session)
+            extended += 1
+        return extended
+
+    @replicated
+    @_timed_apply
+    def _extend_leases_internal(self, renewals: dict[str, float])->int:
+        """Apply a batch of leader-local keepalives - internal replicated method"""
+        return self._apply_lease_renewals(renewals)
+
+    @replicated
+    @_timed_apply
+    def _grant_lease_grace_internal(self, now: float, leader: Optional[str] = None,
+                                    term: Optional[int] = None)->None:
+        """Extend every lease to at least now + timeout - internal replicated method
+
+        Every new leader commits this first, so it also announces the leader."""
+        self.__lease_grace_start = max(self.__lease_grace_start, now)
+        self._emit(LEADER_CHANGED, leader=leader, term=term)
+        LEADER_CHANGES.inc()
+        logger.info(f"Lease grace period granted from {now}")
+
+    def _flush_lease_renewals(self, now: float)->None:
+        """Replicate leader-local keepalives for leases that crossed the renew threshold"""
+        renewals = {}
+        for session_id, renewed_at in list(self.__lease_renewals.items()):
+            session = self._get_session(session_id)
+            if session is not None:
+                # From the replicated keepalive rather than the lease grace
+                # of this group, which the lease_listener's groups do not share
+                remaining = session.last_keepalive + session.timeout - now
+                if remaining >= session.timeout * LEASE_RENEW_THRESHOLD:
+                    continue
+                renewals[session_id] = renewed_at
+            if self.__lease_renewals.get(session_id) == renewed_at:
+                del self.__lease_renewals[session_id]
+        if renewals:
+            self._extend_leases_internal(renewals)
+            self._share_lease_renewals(renewals)
+
+    def _due_lease_renewals(self, now: float)->dict[str, float]:
+        """Take leader-local keepalives of sessions that are due for expiry"""
+        renewals = {}
+        for count, (_, session_id) in enumerate(self._iter_due_expiries(now)):
+            if count >= self.__reaper_batch_size:
+                break
+            renewed_at = self.__lease_renewals.pop(session_id, None)
+            if renewed_at is not None:
+                renewals[session_id] = renewed_at
+        self._share_lease_renewals(renewals)
+        return renewals
+
+    def _share_lease_renewals(self, renewals: dict[str, float])->None:
+        """Pass replicated leader-local keepalives on to the lease_listener"""
+        if renewals and self.__lease_listener is not None:
+            self.__lease_listener(renewals)
+
+    def extend_leases(self, renewals: dict[str, float])->None:
+        """Move leases forward to keepalive times another group acknowledged, see ShardedLockService
+
+        Submitted without waiting for the commit, so it is safe on a tick thread."""
+        self._extend_leases_internal(renewals)
     
+    def keepalive_async(self, session_id: str)->Future:
+        """Update keepalive for a client session, returns a future for success
+
+        The leader acknowledges keepalives from memory and replicates them
+        in batches, see _flush_lease_renewals. A leader cut off from the
+        group still thinks it leads until its fallback timeout, while a
+        new leader lets the session expire, so memory is only trusted
+        while a majority answered within LEASE_ACK_WINDOW. Otherwise a
+        ReadIndex round has to confirm leadership first, see
+        read_barrier_async. Other nodes, and a leader that cannot
+        confirm, fall back to a replicated keepalive."""
+        now = time.time()
+        if not self.is_leader():
+            return self._submit(self._keepalive_internal, session_id, now)
+        contact = self._leader_contact()
+        if contact is not None and time.monotonic() - contact < LEASE_ACK_WINDOW:
+            return _resolved(self._renew_lease(session_id, now))
+
+        renewed = Future()
+
+        def on_confirmed(confirmed: Future):
+            if confirmed.exception() is None and confirmed.result():
+                renewed.set_result(self._renew_lease(session_id, now))
+                return
+            self._submit(self._keepalive_internal, session_id, now).add_done_callback(on_replicated)
+
+        def on_replicated(replicated: Future):
+            if replicated.exception() is not None:
+                renewed.set_exception(replicated.exception())
+            else:
+                renewed.set_result(replicated.result())
+        self.read_barrier_async(READ_LINEARIZABLE).add_done_callback(on_confirmed)
+        return renewed
+
+    def _renew_lease(self, session_id: str, now: float)->bool:
+        """Acknowledge a keepalive from memory on a confirmed leader, see keepalive_async"""
+        session = self._get_session(session_id)
+        if not session:
+            logger.warning(f"Keepalive failed: {session_id} not found")
+            return False
+        renewed_at = self.__lease_renewals.get(session_id, 0.0)
+        if self._is_expired(session, now) and now - renewed_at > session.timeout:
+            logger.warning(f"Keepalive failed: {session_id} expired")
+            return False
+        self.__lease_renewals[session_id] = now
+        return True
+
     def keepalive(self, session_id: str)->bool:
         """Update keepalive for a client session"""
-        with self._lock:
-            return self._keepalive_internal(session_id, sync=True)
+        return self.keepalive_async(session_id).result()
+
+    def _remove_session(self, session_id: str, now: float, reason: str = SESSION_DELETED)->None:
+        """Remove a session, drop its waits and release all its locks
+
+        reason is the event recorded for watchers, SESSION_DELETED or SESSION_EXPIRED."""
+        session = self.__sessions.pop(session_id)
+        if session.create_request is not None:
+            self.__create_requests.pop(session.create_request, None)
+        self._emit(reason, session_id=session_id, client_id=session.client_id)
+        for resource in session.waiting_on:
+            self._remove_waiter(session_id, resource)
+            self._notify_grant(session_id, resource, None)
+        for resource in session.locks_held:
+            if resource in self.__locks:
+                self._remove_holder(session_id, resource, reason)
+                logger.info(f"Resource {resource} released due to session deletion")
+                self._grant_next_waiter(resource, now)
 
     @replicated
-    def _delete_session_internal(self, session_id: str)->bool:
+    @_timed_apply
+    def _delete_session_internal(self, session_id: str, now: float)->bool:
         """Delete a client session - internal replicated method"""
         session = self._get_session(session_id)
         if not session:
             logger.warning(f"Delete session failed: {session_id} not found")
             return False
 
-        for resource in session['locks_held']:
-            if resource in self.__locks:
-                del self.__locks[resource]
-                logger.info(f"Resource {resource} deleted due to session deletion")
-
-        del self.__sessions[session_id]
+        self._remove_session(session_id, now)
         logger.info(f"Session {session_id} deleted")
         
         return True
 
 
+    def delete_session_async(self, session_id: str)->Future:
+        """Delete a client session, returns a future for success"""
+        return self._submit(self._delete_session_internal, session_id, time.time())
+
     def delete_session(self, session_id: str)->bool:
         """Delete a client session"""
-        with self._lock:
-            
-            return self._delete_session_internal(session_id, sync=True)
+        return self.delete_session_async(session_id).result()
         
+    def _grant_lock(self, session:Session, resource:str, now: float, hierarchical: bool = False,
+                    mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None)->int:
+        """Lock the resource for the session under a new fence token
+
+        In shared and semaphore mode the session joins the current holders."""
+        self.__fence_counter+=1
+        fence_token = self.__fence_counter
+        session_id = session.session_id
+        lock = Lock(resource, session_id, fence_token, now, hierarchical)
+        if mode == LOCK_EXCLUSIVE:
+            self.__locks[resource] = lock
+            self.__resource_index.add(resource)
+        else:
+            entry = self.__locks.get(resource)
+            if entry is None:
+                entry = self.__locks[resource] = SharedLock(resource, mode, permits)
+                self.__resource_index.add(resource)
+            entry.holders[session_id] = lock
+        session.locks_held[resource] = None
+        self._emit(LOCK_ACQUIRED, resource=resource, session_id=session_id, fence_token=fence_token, mode=mode)
+
+        logger.info(f"Resource {resource} locked by session {session_id} with fence token {fence_token}")
+        return fence_token
+
+    def _remove_waiter(self, session_id:str, resource:str)->None:
+        """Remove a session from the wait queue of a resource"""
+        queue = self.__waiters.get(resource)
+        if queue is None:
+            return
+        queue.pop(session_id, None)
+        if not queue:
+            del self.__waiters[resource]
+
+    def _admits(self, resource:str, session_id:str, mode: str, permits: Optional[int])->bool:
+        """Check if the current holders of a resource let the session in"""
+        entry = self.__locks.get(resource)
+        if entry is None:
+            return True
+        return isinstance(entry, SharedLock) and entry.admits(session_id, mode, permits)
+
+    def _grant_next_waiter(self, resource:str, now: float)->None:
+        """Hand a released resource to the valid sessions at the head of its wait queue
+
+        Grants in FIFO order for as long as the holders admit the next
+        waiter, so a run of shared waiters is granted together."""
+        queue = self.__waiters.get(resource)
+        while queue:
+            session_id, (mode, permits) = next(iter(queue.items()))
+            session = self._get_session(session_id)
+            if session and not self._is_expired(session, now) and \
+                    not self._admits(resource, session_id, mode, permits):
+                break
+            del queue[session_id]
+            if not session:
+                continue
+            del session.waiting_on[resource]
+            if self._is_expired(session, now):
+                self._notify_grant(session_id, resource, None)
+                continue
+            fence_token = self._grant_lock(session, resource, now, mode=mode, permits=permits)
+            self._notify_grant(session_id, resource, fence_token)
+        if queue is not None and not queue:
+            del self.__waiters[resource]
+
+    def _notify_grant(self, session_id:str, resource:str, fence_token:Optional[int])->None:
+        """Wake up a blocking acquire on this node, if there is one"""
+        grant = self.__grant_futures.pop((session_id, resource), None)
+        if grant is not None and not grant.done():
+            grant.set_result(fence_token)
+
+    def _hierarchy_conflict(self, resource:str, hierarchical: bool)->Optional[str]:
+        """Get a locked resource that overlaps the resource other than itself
+
+        A hierarchical lock covers the whole subtree of its resource, so it
+        conflicts with any lock below it and with hierarchical locks above it.
+        A plain lock only conflicts with hierarchical locks above it."""
+        for ancestor in self.__resource_index.locked_ancestors(resource):
+            if self.__locks[ancestor].hierarchical:
+                return ancestor
+        if hierarchical and self.__resource_index.descendants(resource):
+            return next(self.__resource_index.iter_prefix(resource + "/"))
+        return None
+
     @replicated
-    def _acquire_lock_internal(self, session_id:str, resource:str)->Optional[int]:
-        """Acquire a lock on the resource - internal replicated method"""
+    @_timed_apply
+    def _acquire_lock_internal(self, session_id:str, resource:str, now: float, wait: bool = False,
+                               hierarchical: bool = False, mode: str = LOCK_EXCLUSIVE,
+                               permits: Optional[int] = None, request_id: Optional[str] = None)->Optional[int]:
+        """Acquire a lock on the resource - internal replicated method
+
+        In shared mode any number of sessions hold the resource together,
+        in semaphore mode up to permits sessions. A session only joins the
+        holders when nobody is queued, so waiting writers are not starved.
+
+        With wait set, a session that is not let in is queued behind the
+        holders and WAITING is returned instead of None. Hierarchical locks
+        and conflicts with other parts of the tree are never queued.
+
+        A retry of a request ID gets the result of the first attempt, see
+        _once. A retry of an attempt that queued the session gets the
+        fence token once the lock was handed over, and queues it again
+        otherwise."""
+        result = self._replay(session_id, request_id)
+        if result == WAITING:
+            existing_lock = self.__locks.get(resource)
+            holder = existing_lock.holder(session_id) if existing_lock else None
+            result = _UNSEEN if holder is None else holder.fence_token
+        if result is _UNSEEN:
+            result = self._try_acquire_lock(session_id, resource, now, wait, hierarchical, mode, permits)
+        self._remember(session_id, request_id, result)
+        return result
+
+    def _try_acquire_lock(self, session_id:str, resource:str, now: float, wait: bool,
+                          hierarchical: bool, mode: str, permits: Optional[int])->Optional[int]:
+        """Grant or queue a lock, see _acquire_lock_internal"""
         logging.info("Inside _acquire_lock_internal")
         session = self._get_session(session_id)
         if not session:
             logger.warning(f"Lock acquisition failed: {session_id} not found")
             return None
-        if self._is_expired(session):
+        if self._is_expired(session, now):
             logger.warning(f"Lock acquisition failed: {session_id} expired")
             return None
         logging.info("Inside _acquire_lock_internal, valid session")
+        conflict = self._hierarchy_conflict(resource, hierarchical)
+        if conflict is not None:
+            logger.warning(f"Lock acquisition failed: resource {resource} overlaps locked resource {conflict}")
+            return None
         existing_lock = self.__locks.get(resource)
-        if existing_lock:
+        if existing_lock is not None:
+            # A wait queue only exists while the resource is locked
+            if resource not in self.__waiters and self._admits(resource, session_id, mode, permits):
+                return self._grant_lock(session, resource, now, mode=mode, permits=permits)
+            if wait and not hierarchical and existing_lock.holder(session_id) is None:
+                if resource not in session.waiting_on:
+                    self.__waiters.setdefault(resource, {})[session_id] = (mode, permits)
+                    session.waiting_on[resource] = None
+                logger.info(f"Session {session_id} waiting on resource {resource}")
+                return WAITING
             logger.warning(f"Lock acquisition failed: resource {resource} already locked")
             return None
         logging.info("Inside _acquire_lock_internal no locks")
 
-        self.__fence_counter+=1
-        fence_token = self.__fence_counter
-        
-        logging.info(f"Inside _acquire_lock_internal, fence token is {fence_token}")
-        self.__locks[resource] = {
-            "resource": resource,
-            "session_id": session_id,
-            "fence_token": fence_token,
-            "acquired_at": time.time(),
-        }
-        session['locks_held'].append(resource)
+        return self._grant_lock(session, resource, now, hierarchical, mode, permits)
 
-        logger.info(f"Resource {resource} locked by session {session_id} with fence token {fence_token}")
-        return fence_token
+    @replicated
+    @_timed_apply
+    def _cancel_wait_internal(self, session_id:str, resource:str)->Optional[int]:
+        """Leave the wait queue of a resource - internal replicated method
+
+        Returns the fence token if the lock was granted before the cancel
+        was applied."""
+        existing_lock = self.__locks.get(resource)
+        holder = existing_lock.holder(session_id) if existing_lock else None
+        if holder is not None:
+            return holder.fence_token
+        session = self._get_session(session_id)
+        if session and resource in session.waiting_on:
+            del session.waiting_on[resource]
+            self._remove_waiter(session_id, resource)
+        return None
+
+    @staticmethod
+    def check_client_id(client_id: str)->None:
+        """Raise ValueError for a client ID that is not a non-empty string"""
+        if not isinstance(client_id, str) or not client_id:
+            raise ValueError(f"Client ID must be a non-empty string, got {client_id!r}")
+
+    @staticmethod
+    def check_timeout(timeout: float)->None:
+        """Raise ValueError for a session timeout that is not a positive number of seconds"""
+        if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or \
+                not math.isfinite(timeout) or timeout <= 0:
+            raise ValueError(f"Session timeout must be a positive number of seconds, got {timeout!r}")
+
+    @staticmethod
+    def check_request_id(request_id: Optional[str])->None:
+        """Raise ValueError for a request ID that is not a short non-empty string"""
+        if request_id is None:
+            return
+        if not isinstance(request_id, str) or not 0 < len(request_id) <= MAX_REQUEST_ID_LENGTH:
+            raise ValueError(f"A request ID must be a string of 1 to {MAX_REQUEST_ID_LENGTH} characters")
 
+    @staticmethod
+    def check_session_request_id(request_id: Optional[str])->None:
+        """Raise ValueError for the request ID of a session creation that is not a UUID
 
-    def acquire_lock(self, session_id: str, resource:str)->Optional[int]:
-        """Acquire a lock on the resource"""
+        It is looked up across all sessions, so it has to be unique on its own."""
+        LockService.check_request_id(request_id)
+        if request_id is None:
+            return
+        try:
+            uuid.UUID(request_id)
+        except ValueError:
+            raise ValueError("The request ID of a session creation must be a UUID")
+
+    @staticmethod
+    def check_wait_timeout(wait_timeout: Optional[float])->None:
+        """Raise ValueError for a lock wait timeout that is not a finite number of seconds of at least 0"""
+        if wait_timeout is None:
+            return
+        if not isinstance(wait_timeout, (int, float)) or isinstance(wait_timeout, bool) or \
+                not math.isfinite(wait_timeout) or wait_timeout < 0:
+            raise ValueError(f"Wait timeout must be a number of seconds of at least 0, got {wait_timeout!r}")
+
+    @staticmethod
+    def check_resources(resources: list[str])->None:
+        """Raise ValueError for batch resources that are not a non-empty list of resource names"""
+        if not isinstance(resources, list) or not resources or \
+                not all(isinstance(resource, str) and resource for resource in resources):
+            raise ValueError("Resources must be a non-empty list of resource names")
+
+    @staticmethod
+    def check_fence_tokens(locks: dict[str, int])->None:
+        """Raise ValueError for batch locks that are not a non-empty map of resource names to fence tokens"""
+        if not isinstance(locks, dict) or not locks or not all(
+            isinstance(resource, str) and resource and isinstance(fence_token, int) and not isinstance(fence_token, bool)
+            for resource, fence_token in locks.items()
+        ):
+            raise ValueError("Locks must be a non-empty map of resource names to integer fence tokens")
+
+    @staticmethod
+    def check_lock_mode(mode: str, permits: Optional[int], hierarchical: bool = False)->None:
+        """Raise ValueError for an invalid combination of lock mode options"""
+        if not isinstance(hierarchical, bool):
+            raise ValueError(f"hierarchical must be true or false, got {hierarchical!r}")
+        if mode not in LOCK_MODES:
+            raise ValueError(f"Lock mode must be one of {', '.join(LOCK_MODES)}, got {mode}")
+        if mode == LOCK_SEMAPHORE:
+            if not isinstance(permits, int) or isinstance(permits, bool) or permits < 1:
+                raise ValueError(f"A semaphore needs a positive integer number of permits, got {permits}")
+        elif permits is not None:
+            raise ValueError(f"Only semaphores take permits, got {permits} for a {mode} lock")
+        if hierarchical and mode != LOCK_EXCLUSIVE:
+            raise ValueError(f"Only exclusive locks can be hierarchical, got a {mode} lock")
+
+    def acquire_lock_async(self, session_id: str, resource:str, hierarchical: bool = False,
+                           mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None,
+                           request_id: Optional[str] = None)->Future:
+        """Acquire a lock on the resource, returns a future for the fence token
+
+        A request ID makes retries safe: a retry gets the fence token, or
+        the conflict, of the first attempt, see _once."""
+        self.check_lock_mode(mode, permits, hierarchical)
+        self.check_request_id(request_id)
+        replayed = self._replayed("acquire_lock", session_id, request_id)
+        if replayed is not None:
+            return replayed
+        future = self._submit(self._acquire_lock_internal, session_id, resource, time.time(), False,
+                              hierarchical, mode, permits, request_id)
+        _count_acquire(resource, future)
+        return future
+
+    def acquire_lock(self, session_id: str, resource:str, wait_timeout: Optional[float] = None,
+                     hierarchical: bool = False, mode: str = LOCK_EXCLUSIVE,
+                     permits: Optional[int] = None, request_id: Optional[str] = None)->Optional[int]:
+        """Acquire a lock on the resource
+
+        mode is LOCK_EXCLUSIVE, LOCK_SHARED for a reader that shares the
+        resource with other readers, or LOCK_SEMAPHORE for one of up to
+        permits holders. Every holder gets its own fence token.
+
+        With a wait_timeout, a held resource queues the session and blocks
+        until the lock is handed over on release or expiry of the holder,
+        or until the timeout passes. A hierarchical lock also covers every
+        resource below it and does not wait.
+
+        A retry with the request ID of an earlier attempt gets its result."""
         logging.info("Inside acquire_lock")
-        with self._lock:
-            return self._acquire_lock_internal(session_id, resource, sync=True)
+        self.check_wait_timeout(wait_timeout)
+        if not wait_timeout or hierarchical:
+            return self.acquire_lock_async(session_id, resource, hierarchical, mode, permits, request_id).result()
+
+        grant = self.acquire_lock_waiting_async(session_id, resource, mode, permits, request_id)
+        try:
+            return grant.result(timeout=wait_timeout)
+        except FutureTimeoutError:
+            logger.info(f"Wait for resource {resource} by session {session_id} timed out")
+        except BaseException:
+            self.abandon_wait(session_id, resource, grant)
+            raise
+        return self.cancel_wait_async(session_id, resource).result()
+
+    def acquire_lock_waiting_async(self, session_id: str, resource:str, mode: str = LOCK_EXCLUSIVE,
+                                   permits: Optional[int] = None, request_id: Optional[str] = None)->Future:
+        """Acquire a lock or queue for it, returns a future for the fence token
+
+        The future resolves when the lock is granted, right away or on
+        hand-over, or to None if the session cannot get it. Callers that
+        stop waiting must call cancel_wait_async."""
+        self.check_lock_mode(mode, permits)
+        self.check_request_id(request_id)
+        replayed = self._replayed("acquire_lock", session_id, request_id)
+        if replayed is not None:
+            return replayed
+        key = (session_id, resource)
+        grant = Future()
+        # Registered before submitting so a grant applied right after the
+        # enqueue cannot be missed
+        self.__grant_futures[key] = grant
+
+        def on_result(result: Future):
+            error = result.exception()
+            if error is None and result.result() == WAITING:
+                return
+            if self.__grant_futures.get(key) is grant:
+                del self.__grant_futures[key]
+            if grant.done():
+                return
+            if error is None:
+                grant.set_result(result.result())
+            else:
+                grant.set_exception(error)
+
+        result = self._submit(self._acquire_lock_internal, session_id, resource, time.time(), True, False,
+                              mode, permits, request_id)
+        _count_acquire(resource, result)
+        result.add_done_callback(on_result)
+        return grant
+
+    def cancel_wait_async(self, session_id: str, resource:str)->Future:
+        """Stop waiting for a lock, returns a future for the fence token if it was granted meanwhile"""
+        self.__grant_futures.pop((session_id, resource), None)
+        return self._submit(self._cancel_wait_internal, session_id, resource)
+
+    def abandon_wait(self, session_id: str, resource:str, grant: Future)->None:
+        """Stop waiting for a lock after the caller failed, without waiting for the commit
+
+        The waiter leaves the queue, or releases the lock if it was
+        granted meanwhile, so the lock never goes to a caller that gave
+        up. An acquire that failed itself never queued the session."""
+        if grant.done() and grant.exception() is not None:
+            return
+
+        def on_cancelled(cancelled: Future):
+            if cancelled.exception() is None and cancelled.result():
+                self.release_lock_async(session_id, resource, cancelled.result())
+        self.cancel_wait_async(session_id, resource).add_done_callback(on_cancelled)
 
     def get_lock_info(self, resource:str)->Optional[dict]:
         """Get lock information on a resource"""
@@ -192,69 +1383,272 @@ class LockService(SyncObj):
         lock = self.__locks.get(resource)
         if not lock:
             return None
-        return lock.copy()
+        info = lock.to_dict()
+        info['waiters'] = len(self.__waiters.get(resource, ()))
+        return info
 
-    @replicated
-    def _release_lock_internal(self, session_id:str, resource:str, fence_token:int)->bool:
-        """Release the lock on a resource - internal replicated method"""
+    def watch_cursor(self)->str:
+        """Get the watch cursor of the last applied entry, to watch from now on"""
+        return str(self.__event_log.head)
+
+    def read_events(self, cursor: Optional[str] = None, prefix: str = "",
+                    limit: int = DEFAULT_WATCH_LIMIT)->tuple[list[dict], str]:
+        """Get the events of the entries applied after cursor, and the cursor to continue from
+
+        Lock acquires and releases, session creation, deletion and expiry
+        and leader changes, in log order. Without a cursor nothing is
+        returned and the cursor is the current one. Raises CursorExpired
+        when events after cursor are gone from this node's buffer, and
+        ValueError for a malformed cursor."""
+        if cursor is None:
+            return [], self.watch_cursor()
+        events, next_cursor = self.__event_log.read(self._parse_cursor(cursor), prefix, max(1, limit))
+        return events, str(next_cursor)
+
+    @staticmethod
+    def _parse_cursor(cursor: str)->int:
+        if not cursor.isdigit():
+            raise ValueError(f"Watch cursor must be a log index, got {cursor}")
+        return int(cursor)
+
+    def wait_events_async(self, cursor: str)->Future:
+        """Get a future that resolves once there are events after cursor
+
+        Callers that give up waiting should cancel it."""
+        return self.__event_log.wait_async(self._parse_cursor(cursor))
+
+    def count_locks(self, prefix:str = "")->int:
+        """Count the locks on resources whose name starts with prefix"""
+        return self.__resource_index.count(prefix)
+
+    def list_locks(self, prefix:str = "", limit:int = DEFAULT_LIST_LIMIT,
+                   cursor:Optional[str] = None)->tuple[list[dict], Optional[str]]:
+        """Get a page of the locks under a prefix in path order, and the cursor of the next page
+
+        The cursor is the last resource of the page, None on the last page."""
+        limit = max(1, min(limit, MAX_LIST_LIMIT))
+        locks = []
+        for resource in self.__resource_index.iter_prefix(prefix, cursor):
+            lock = self.__locks.get(resource)
+            if lock is None:
+                # Released while the page was read
+                continue
+            if len(locks) == limit:
+                # There is at least one more lock
+                return locks, locks[-1]['resource']
+            locks.append(lock.to_dict())
+        return locks, None
+
+    def _check_release(self, session_id:str, resource:str, fence_token:int)->bool:
+        """Check that the session holds the lock under the fence token"""
         existing_lock = self.__locks.get(resource)
-        if existing_lock:
-            if existing_lock['session_id'] != session_id:
-                logger.warning(f"Lock release failed: resource {resource} locked by another session")
-                return False
+        if not existing_lock:
+            logger.warning(f"Lock release failed: resource {resource} not locked")
+            return False
+        holder = existing_lock.holder(session_id)
+        if holder is None:
+            logger.warning(f"Lock release failed: resource {resource} locked by another session")
+            return False
+        if holder.fence_token != fence_token:
+            logger.warning(f"Lock release failed: fence token mismatch")
+            return False
+        return True
 
-            if existing_lock['fence_token'] != fence_token:
-                logger.warning(f"Lock release failed: fence token mismatch")
-                return False
+    def _remove_holder(self, session_id:str, resource:str, reason: str = "released")->None:
+        """Remove the hold of a session from the lock table
 
-            del self.__locks[resource]
-            session = self._get_session(session_id)
-            if resource in session['locks_held']:
-                session['locks_held'].remove(resource)
-            logger.info(f"Lock released on resource {resource}")
-            return True
-        return False
+        reason tells watchers why the lock was released."""
+        entry = self.__locks[resource]
+        self._emit(LOCK_RELEASED, resource=resource, session_id=session_id,
+                   fence_token=entry.holder(session_id).fence_token, reason=reason)
+        if isinstance(entry, SharedLock):
+            del entry.holders[session_id]
+            if entry.holders:
+                return
+        del self.__locks[resource]
+        self.__resource_index.remove(resource)
+
+    def _drop_lock(self, session_id:str, resource:str, now: float)->None:
+        """Release a checked lock and hand it to the next waiter"""
+        self._remove_holder(session_id, resource)
+        session = self._get_session(session_id)
+        session.locks_held.pop(resource, None)
+        logger.info(f"Lock released on resource {resource}")
+        self._grant_next_waiter(resource, now)
+
+    @replicated
+    @_timed_apply
+    def _release_lock_internal(self, session_id:str, resource:str, fence_token:int, now: float,
+                               request_id: Optional[str] = None)->bool:
+        """Release the lock on a resource - internal replicated method"""
+        return self._once(session_id, request_id, self._release_lock, session_id, resource, fence_token, now)
+
+    def _release_lock(self, session_id:str, resource:str, fence_token:int, now: float)->bool:
+        """Release a lock, see _release_lock_internal"""
+        if not self._check_release(session_id, resource, fence_token):
+            return False
+        self._drop_lock(session_id, resource, now)
+        return True
             
-    def release_lock(self, session_id:str, resource: str, fence_token:int)->bool:
+    def release_lock_async(self, session_id:str, resource: str, fence_token:int,
+                           request_id: Optional[str] = None)->Future:
+        """Release the lock on a resource, returns a future for success"""
+        self.check_request_id(request_id)
+        replayed = self._replayed("release_lock", session_id, request_id)
+        if replayed is not None:
+            return replayed
+        return self._submit(self._release_lock_internal, session_id, resource, fence_token, time.time(), request_id)
+
+    def release_lock(self, session_id:str, resource: str, fence_token:int, request_id: Optional[str] = None)->bool:
         """Release the lock on a resource"""
-        with self._lock:
-            return self._release_lock_internal(session_id, resource, fence_token, sync=True)
+        return self.release_lock_async(session_id, resource, fence_token, request_id).result()
 
     @replicated
-    def _release_expired_sessions(self)->int:
-        """Release expired sessions and its locks - internal replicated method"""
-        expired_ids = []
-        cleaned = 0
-        for session_id, session in self.__sessions.items():
-            if self._is_expired(session):
-                expired_ids.append(session_id)
+    @_timed_apply
+    def _acquire_locks_internal(self, session_id:str, resources:list[str], now: float,
+                                request_id: Optional[str] = None)->Optional[dict[str, int]]:
+        """Acquire locks on all resources or none - internal replicated method"""
+        return self._once(session_id, request_id, self._acquire_locks, session_id, resources, now)
+
+    def _acquire_locks(self, session_id:str, resources:list[str], now: float)->Optional[dict[str, int]]:
+        """Acquire a batch of locks, see _acquire_locks_internal"""
+        try:
+            self.check_resources(resources)
+        except ValueError as e:
+            logger.warning(f"Batch lock acquisition failed: {e}")
+            return None
+        session = self._get_session(session_id)
+        if not session:
+            logger.warning(f"Batch lock acquisition failed: {session_id} not found")
+            return None
+        if self._is_expired(session, now):
+            logger.warning(f"Batch lock acquisition failed: {session_id} expired")
+            return None
+        resources = list(dict.fromkeys(resources))
+        for resource in resources:
+            if resource in self.__locks:
+                logger.warning(f"Batch lock acquisition failed: resource {resource} already locked")
+                return None
+            conflict = self._hierarchy_conflict(resource, False)
+            if conflict is not None:
+                logger.warning(f"Batch lock acquisition failed: resource {resource} overlaps locked resource {conflict}")
+                return None
+        return {resource: self._grant_lock(session, resource, now) for resource in resources}
+
+    def acquire_locks_async(self, session_id:str, resources:list[str], request_id: Optional[str] = None)->Future:
+        """Acquire locks on all resources or none, returns a future for the fence tokens"""
+        self.check_resources(resources)
+        self.check_request_id(request_id)
+        replayed = self._replayed("acquire_locks", session_id, request_id)
+        if replayed is not None:
+            return replayed
+        return self._submit(self._acquire_locks_internal, session_id, resources, time.time(), request_id)
+
+    def acquire_locks(self, session_id:str, resources:list[str],
+                      request_id: Optional[str] = None)->Optional[dict[str, int]]:
+        """Acquire locks on all resources or none, in a single log entry"""
+        return self.acquire_locks_async(session_id, resources, request_id).result()
 
-        for session_id in expired_ids:
+    @replicated
+    @_timed_apply
+    def _release_locks_internal(self, session_id:str, locks:dict[str, int], now: float,
+                                request_id: Optional[str] = None)->bool:
+        """Release all locks or none - internal replicated method"""
+        return self._once(session_id, request_id, self._release_locks, session_id, locks, now)
+
+    def _release_locks(self, session_id:str, locks:dict[str, int], now: float)->bool:
+        """Release a batch of locks, see _release_locks_internal"""
+        try:
+            self.check_fence_tokens(locks)
+        except ValueError as e:
+            logger.warning(f"Batch lock release failed: {e}")
+            return False
+        for resource, fence_token in locks.items():
+            if not self._check_release(session_id, resource, fence_token):
+                return False
+        for resource in locks:
+            self._drop_lock(session_id, resource, now)
+        return True
+
+    def release_locks_async(self, session_id:str, locks:dict[str, int], request_id: Optional[str] = None)->Future:
+        """Release all locks or none, returns a future for success"""
+        self.check_fence_tokens(locks)
+        self.check_request_id(request_id)
+        replayed = self._replayed("release_locks", session_id, request_id)
+        if replayed is not None:
+            return replayed
+        return self._submit(self._release_locks_internal, session_id, locks, time.time(), request_id)
+
+    def release_locks(self, session_id:str, locks:dict[str, int], request_id: Optional[str] = None)->bool:
+        """Release all locks or none, given as resource to fence token, in a single log entry"""
+        return self.release_locks_async(session_id, locks, request_id).result()
+
+    @replicated
+    @_timed_apply
+    def _expire_sessions_internal(self, now: float, limit: int, renewals: dict[str, float])->int:
+        """Release expired sessions and its locks - internal replicated method
+
+        Processes at most limit due sessions off the expiry index, after
+        applying the leader-local keepalives of sessions that were about to
+        expire. Stale entries are popped without counting, see _schedule_expiry."""
+        self._apply_lease_renewals(renewals)
+        cleaned = 0
+        processed = 0
+        while processed < limit and self._has_due_expiries(now):
+            deadline, session_id = heapq.heappop(self.__expiry_heap)
+            if self._is_stale_expiry(deadline, session_id):
+                continue
+            processed += 1
             session = self._get_session(session_id)
-            for resource in session['locks_held']:
-                if resource in self.__locks:
-                    del self.__locks[resource]
-        
-            del self.__sessions[session_id]
+            if not self._is_expired(session, now):
+                # Pushed back by a lease grace period
+                self._schedule_expiry(session)
+                continue
+            self._remove_session(session_id, now, SESSION_EXPIRED)
+            logger.info(f"Session {session_id} expired")
             cleaned+=1
         return cleaned
 
 
     def release_expired_sessions(self)->int:
         """Release expired sessions and its locks"""
-        with self._lock:
-            return self._release_expired_sessions(sync=True)
+        cleaned = 0
+        now = time.time()
+        while self._has_due_expiries(now):
+            renewals = self._due_lease_renewals(now) if self.is_leader() else {}
+            cleaned += self._submit(self._expire_sessions_internal, now, self.__reaper_batch_size, renewals).result()
+        SESSION_EXPIRATIONS.inc(cleaned)
+        return cleaned
+
+    def _count_expired_sessions(self, now: float)->int:
+        """Count expired sessions from the due part of the expiry index
+
+        The reaper keeps the due part small and the tick thread keeps
+        stale entries out of it, see _drop_stale_expiries, so this does
+        not depend on the total number of sessions or keepalives."""
+        expired = 0
+        for deadline, session_id in self._iter_due_expiries(now):
+            session = self.__sessions.get(session_id)
+            if session and session.expires_at == deadline and self._is_expired(session, now):
+                expired += 1
+        return expired
 
     def get_stats(self)->dict:
         """Get service stats"""
+        now = time.time()
+        total_sessions = len(self.__sessions)
+        expired_sessions = self._count_expired_sessions(now)
         return {
-            "total_session": len(self.__sessions),
+            "total_session": total_sessions,
             "total_locks": len(self.__locks),
             "fence_counter": self.__fence_counter,
-            "active_sessions": sum(1 for session in self.__sessions.values() if not self._is_expired(session)),
-            "expired_sessions": sum(1 for session in self.__sessions.values() if self._is_expired(session))
+            "active_sessions": total_sessions - expired_sessions,
+            "expired_sessions": expired_sessions,
         }
 
-    def get_all_session_locks(self, session_id:str)->Optional[dict]:
+    def get_all_session_locks(self, session_id:str)->Optional[list[str]]:
         """Get all locks held by this session"""
-        return self.__sessions[session_id]['locks_held']
+        session = self.__sessions.get(session_id)
+        if not session:
+            return None
+        return list(session.locks_held)
@@ -0,0 +1,239 @@
+from typing import Iterable, Optional
+import bisect
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the batch size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# Resource prefixes get a label of their own up to this many, the rest share OTHER_PREFIX
+MAX_PREFIX_LABELS = 100
+OTHER_PREFIX = "_other"
+
+
+def _format_value(value: float)->str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value)->str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple)->str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    """A metric family, one child per combination of label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if not label_names:
+            self._default = self._child(())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _child(self, values: tuple):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def labels(self, *values):
+        """Get the child for the label values, created on first use"""
+        child = self._children.get(values)
+        if child is not None:
+            return child
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} has labels {self.label_names}, got {values}")
+        return self._child(tuple(str(value) for value in values))
+
+    def render(self)->list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0)->None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self)->float:
+        return self._value
+
+    def render(self, name: str, label_names: tuple[str, ...], values: tuple)->list[str]:
+        return [f"{name}{_format_labels(label_names, values)} {_format_value(self._value)}"]
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def _new_child(self)->_CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0)->None:
+        self._default.inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self._bounds = bounds
+        # One count per bucket and one past the last bound, not cumulative
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float)->None:
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @property
+    def count(self)->int:
+        return sum(self._counts)
+
+    def render(self, name: str, label_names: tuple[str, ...], values: tuple)->list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self._bounds, float("inf")), counts):
+            cumulative += count
+            labels = _format_labels((*label_names, "le"), (*values, _format_value(bound)))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(label_names, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Observations counted in buckets by upper bound"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self)->_HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float)->None:
+        self._default.observe(value)
+
+
+class Registry:
+    """The metrics of a process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric)->_Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ())->Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS)->Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self)->list[str]:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return lines
+
+
+def render_gauge(name: str, documentation: str, samples: Iterable[tuple[dict, float]])->list[str]:
+    """Render a gauge read at scrape time from (labels, value) samples"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+class PrefixLabels:
+    """Map resources to a bounded set of prefix label values
+
+    A resource is labelled by its first path segment, so tenant-1/db and
+    tenant-1/queue share a label. Past max_labels distinct prefixes new
+    ones are labelled OTHER_PREFIX, keeping the number of series bounded."""
+
+    def __init__(self, max_labels: int = MAX_PREFIX_LABELS):
+        self.__max_labels = max_labels
+        self.__labels: set[str] = set()
+
+    def __call__(self, resource: str)->str:
+        prefix = resource.split("/", 1)[0]
+        if prefix in self.__labels:
+            return prefix
+        if len(self.__labels) >= self.__max_labels:
+            return OTHER_PREFIX
+        self.__labels.add(prefix)
+        return prefix
+
+
+REGISTRY = Registry()
+
+COMMIT_SECONDS = REGISTRY.histogram(
+    "lockio_commit_seconds", "Time from submitting a replicated call to its commit and apply", ("method",))
+APPLY_SECONDS = REGISTRY.histogram(
+    "lockio_apply_seconds", "Time the state machine spends applying a replicated call", ("method",))
+BATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "lockio_batch_wait_seconds", "Time a group commit batch collects operations before it is replicated")
+BATCH_SIZE = REGISTRY.histogram(
+    "lockio_batch_size", "Operations per group commit batch", buckets=BATCH_SIZE_BUCKETS)
+ACQUIRES = REGISTRY.counter(
+    "lockio_acquires_total", "Lock acquires submitted on this node by outcome and resource prefix",
+    ("prefix", "outcome"))
+SESSION_EXPIRATIONS = REGISTRY.counter(
+    "lockio_session_expirations_total", "Sessions expired by the reaper or a cleanup on this node")
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "lockio_admission_rejections_total", "Writes rejected by admission control by priority", ("priority",))
+REPLAYED_REQUESTS = REGISTRY.counter(
+    "lockio_replayed_requests_total", "Retried writes answered from the request table without a log entry",
+    ("method",))
+LEADER_CHANGES = REGISTRY.counter(
+    "lockio_leader_changes_total", "Leader changes applied by this node, in any of its Raft groups")
+
+
+def render_metrics(gauges: Optional[list[str]] = None)->str:
+    """Render the registered metrics and gauges in the Prometheus text format"""
+    return "\n".join([*REGISTRY.render(), *(gauges or [])]) + "\n"
@@ -0,0 +1,69 @@
+from collections import Counter
+import sys
+import threading
+import time
+
+# Default and limits of a profiling run
+DEFAULT_PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 120.0
+DEFAULT_PROFILE_INTERVAL = 0.005
+MIN_PROFILE_INTERVAL = 0.001
+
+
+class ProfilerBusy(Exception):
+    """Another profiling run is in progress"""
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of all threads
+
+    Nothing runs until profile is called, so it costs nothing when unused
+    and can be turned on under production load. Every interval the stack
+    of each thread is recorded, and the samples are returned in the folded
+    format of flame graph tools: one line per distinct stack, frames
+    separated by semicolons, followed by the number of samples."""
+
+    def __init__(self):
+        self.__running = threading.Lock()
+
+    def profile(self, seconds: float = DEFAULT_PROFILE_SECONDS,
+                interval: float = DEFAULT_PROFILE_INTERVAL)->str:
+        """Sample all threads for seconds, blocks and returns the folded stacks
+
+        Raises ProfilerBusy while another run is in progress."""
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"Profile duration must be between 0 and {MAX_PROFILE_SECONDS}s, got {seconds}")
+        if interval < MIN_PROFILE_INTERVAL:
+            raise ValueError(f"Profile interval must be at least {MIN_PROFILE_INTERVAL}s, got {interval}")
+        if not self.__running.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already being taken")
+        try:
+            stacks = self._sample(seconds, interval)
+        finally:
+            self.__running.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    @staticmethod
+    def _sample(seconds: float, interval: float)->Counter:
+        stacks = Counter()
+        own_thread = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                frames.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+
+
+PROFILER = SamplingProfiler()
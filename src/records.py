@@ -0,0 +1,133 @@
+from dataclasses import dataclass, field
+from typing import ClassVar, Optional, Union
+
+# Lock modes
+LOCK_EXCLUSIVE = "exclusive"
+# Any number of holders in shared mode, excludes exclusive holders
+LOCK_SHARED = "shared"
+# Up to a number of permits of holders in semaphore mode
+LOCK_SEMAPHORE = "semaphore"
+LOCK_MODES = (LOCK_EXCLUSIVE, LOCK_SHARED, LOCK_SEMAPHORE)
+
+# Results of the latest writes with a request ID kept per session, to answer
+# their retries. Part of the replicated state, so the same on every node.
+MAX_SESSION_REQUESTS = 64
+
+
+@dataclass(slots=True)
+class Session:
+    """Replicated state of a client session
+
+    locks_held and waiting_on are dicts used as insertion-ordered sets:
+    O(1) membership and removal, and an iteration order that is the same
+    on every replica, unlike a set of strings under hash randomization.
+
+    requests maps the request IDs of the session's latest writes to their
+    results, least recently used first. It is created by the first write
+    with a request ID, most sessions never need one. create_request is the
+    request ID the session was created with, if any."""
+    session_id: str
+    client_id: str
+    timeout: float
+    created_at: float
+    last_keepalive: float
+    expires_at: Optional[float] = None
+    locks_held: dict[str, None] = field(default_factory=dict)
+    waiting_on: dict[str, None] = field(default_factory=dict)
+    requests: Optional[dict[str, object]] = None
+    create_request: Optional[str] = None
+
+    def remember(self, request_id: str, result)->None:
+        """Keep the result of a request for its retries, dropping the least recently used past MAX_SESSION_REQUESTS"""
+        if self.requests is None:
+            self.requests = {}
+        self.requests.pop(request_id, None)
+        self.requests[request_id] = result
+        if len(self.requests) > MAX_SESSION_REQUESTS:
+            del self.requests[next(iter(self.requests))]
+
+    def to_dict(self)->dict:
+        """Get the session as the dict served by the API"""
+        return {
+            "session_id": self.session_id,
+            "client_id": self.client_id,
+            "timeout": self.timeout,
+            "created_at": self.created_at,
+            "last_keepalive": self.last_keepalive,
+            "expires_at": self.expires_at,
+            "locks_held": list(self.locks_held),
+            "waiting_on": list(self.waiting_on),
+        }
+
+
+@dataclass(slots=True)
+class Lock:
+    """Replicated state of a held exclusive lock, or of one holder of a SharedLock"""
+    mode: ClassVar[str] = LOCK_EXCLUSIVE
+    permits: ClassVar[Optional[int]] = None
+
+    resource: str
+    session_id: str
+    fence_token: int
+    acquired_at: float
+    # Covers every resource below this one in the path namespace
+    hierarchical: bool = False
+
+    def holder(self, session_id: str)->Optional["Lock"]:
+        """Get the hold of the session on this lock"""
+        return self if self.session_id == session_id else None
+
+    def to_dict(self)->dict:
+        """Get the lock as the dict served by the API"""
+        return {
+            "resource": self.resource,
+            "mode": self.mode,
+            "session_id": self.session_id,
+            "fence_token": self.fence_token,
+            "acquired_at": self.acquired_at,
+            "hierarchical": self.hierarchical,
+        }
+
+
+@dataclass(slots=True)
+class SharedLock:
+    """Replicated state of a resource held in shared or semaphore mode
+
+    Every holder has its own Lock record with its own fence token."""
+    hierarchical: ClassVar[bool] = False
+
+    resource: str
+    mode: str
+    # Maximum number of holders in semaphore mode, None in shared mode
+    permits: Optional[int] = None
+    holders: dict[str, Lock] = field(default_factory=dict)
+
+    def holder(self, session_id: str)->Optional[Lock]:
+        """Get the hold of the session on this lock"""
+        return self.holders.get(session_id)
+
+    def admits(self, session_id: str, mode: str, permits: Optional[int])->bool:
+        """Check if the session can join the current holders in the given mode"""
+        if mode != self.mode or permits != self.permits or session_id in self.holders:
+            return False
+        return self.permits is None or len(self.holders) < self.permits
+
+    def to_dict(self)->dict:
+        """Get the lock as the dict served by the API"""
+        return {
+            "resource": self.resource,
+            "mode": self.mode,
+            "permits": self.permits,
+            "holders": [
+                {
+                    "session_id": holder.session_id,
+                    "fence_token": holder.fence_token,
+                    "acquired_at": holder.acquired_at,
+                }
+                for holder in self.holders.values()
+            ],
+        }
+
+
+# A replicated lock table entry
+LockEntry = Union[Lock, SharedLock]
@@ -0,0 +1,173 @@
+from typing import Iterator, Optional
+import bisect
+
+# Resource names are paths like tenant/db/table/row
+SEPARATOR = "/"
+
+
+class _Node:
+    """Trie node for one path segment"""
+    __slots__ = ("children", "keys", "locked", "count")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # The keys of children in sorted order, for ordered walks and cursors
+        self.keys: list[str] = []
+        # Whether the resource ending at this node is locked
+        self.locked = False
+        # Number of locked resources in this subtree, this node included
+        self.count = 0
+
+
+class ResourceIndex:
+    """Trie of locked resource names, split on SEPARATOR
+
+    Counting the locks under a prefix costs the depth of the prefix, and
+    listing them costs the number of matches rather than the total number
+    of locks. It is part of the replicated state and is only written by
+    the state machine; readers on other threads see it between applies."""
+
+    def __init__(self):
+        self.__root = _Node()
+
+    def __len__(self)->int:
+        return self.__root.count
+
+    def add(self, resource: str)->None:
+        """Index a locked resource"""
+        path = [self.__root]
+        for segment in resource.split(SEPARATOR):
+            parent = path[-1]
+            node = parent.children.get(segment)
+            if node is None:
+                node = parent.children[segment] = _Node()
+                bisect.insort(parent.keys, segment)
+            path.append(node)
+        if path[-1].locked:
+            return
+        path[-1].locked = True
+        for node in path:
+            node.count += 1
+
+    def remove(self, resource: str)->None:
+        """Remove a resource that is no longer locked, pruning empty branches"""
+        path = [(None, self.__root)]
+        for segment in resource.split(SEPARATOR):
+            node = path[-1][1].children.get(segment)
+            if node is None:
+                return
+            path.append((segment, node))
+        if not path[-1][1].locked:
+            return
+        path[-1][1].locked = False
+        for _, node in path:
+            node.count -= 1
+        for i in range(len(path) - 1, 0, -1):
+            segment, node = path[i]
+            if node.count:
+                break
+            parent = path[i - 1][1]
+            del parent.children[segment]
+            del parent.keys[bisect.bisect_left(parent.keys, segment)]
+
+    def _find(self, segments: list[str])->Optional[_Node]:
+        node = self.__root
+        for segment in segments:
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def locked_ancestors(self, resource: str)->Iterator[str]:
+        """Yield the locked resources that are proper ancestors of resource"""
+        node = self.__root
+        segments = resource.split(SEPARATOR)
+        for depth, segment in enumerate(segments[:-1]):
+            node = node.children.get(segment)
+            if node is None:
+                return
+            if node.locked:
+                yield SEPARATOR.join(segments[:depth + 1])
+
+    def descendants(self, resource: str)->int:
+        """Count the locked resources below resource, not counting itself"""
+        node = self._find(resource.split(SEPARATOR))
+        if node is None:
+            return 0
+        return node.count - node.locked
+
+    @staticmethod
+    def _iter_children(node: _Node, start: str = "", partial: str = "")->Iterator[tuple[str, _Node]]:
+        """Yield (key, child) in key order from start on, for the keys starting with partial
+
+        Every next key is found by bisecting past the last one, so the
+        tick thread may add or remove keys meanwhile without shifting the
+        walk, and keys before start are never looked at."""
+        keys = node.keys
+        i = bisect.bisect_left(keys, start)
+        while True:
+            try:
+                key = keys[i]
+            except IndexError:
+                return
+            if not key.startswith(partial):
+                return
+            child = node.children.get(key)
+            if child is not None:
+                yield key, child
+            i = bisect.bisect_right(keys, key)
+
+    def _prefix_parent(self, prefix: str)->tuple[list[str], str, Optional[_Node]]:
+        """Split a prefix into its full segments, the partial last one and the node of the full ones
+
+        The last segment of a prefix may be partial, 'a/b' matches 'a/b',
+        'a/b/c' and 'a/bc', while 'a/b/' only matches below 'a/b'."""
+        segments = prefix.split(SEPARATOR)
+        partial = segments.pop()
+        return segments, partial, self._find(segments)
+
+    def count(self, prefix: str = "")->int:
+        """Count the locked resources whose name starts with prefix"""
+        _, partial, parent = self._prefix_parent(prefix)
+        if parent is None:
+            return 0
+        if not partial:
+            return parent.count - parent.locked
+        return sum(child.count for _, child in self._iter_children(parent, partial, partial))
+
+    def iter_prefix(self, prefix: str = "", after: Optional[str] = None)->Iterator[str]:
+        """Yield the locked resources starting with prefix in path order
+
+        Path order sorts segment by segment. With after, only resources
+        that come after that resource name are yielded, which makes it a
+        pagination cursor. Resuming from a cursor bisects to it at every
+        level rather than walking the resources before it."""
+        segments, partial, parent = self._prefix_parent(prefix)
+        if parent is None:
+            return
+        cursor = None if after is None else after.split(SEPARATOR)
+        depth = len(segments)
+        if cursor is not None and cursor[:depth] != segments:
+            # The cursor is outside of the prefix, everything is before or after it
+            if cursor[:depth] > segments:
+                return
+            cursor = None
+        start = partial
+        if cursor is not None and len(cursor) > depth:
+            start = max(partial, cursor[depth])
+        for key, child in self._iter_children(parent, start, partial):
+            child_cursor = None
+            if cursor is not None and len(cursor) > depth and key == cursor[depth]:
+                child_cursor = cursor[depth + 1:]
+            yield from self._walk(child, segments + [key], child_cursor)
+
+    def _walk(self, node: _Node, path: list[str], cursor: Optional[list[str]])->Iterator[str]:
+        """Yield the locked resources of a subtree in path order, after cursor if given
+
+        cursor holds the remaining segments of the cursor below this node,
+        an empty cursor is this node itself."""
+        if node.locked and cursor is None:
+            yield SEPARATOR.join(path)
+        for key, child in self._iter_children(node, cursor[0] if cursor else ""):
+            child_cursor = cursor[1:] if cursor and key == cursor[0] else None
+            yield from self._walk(child, path + [key], child_cursor)
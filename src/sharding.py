@@ -0,0 +1,537 @@
+from typing import Callable, Optional
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+import bisect
+import functools
+import hashlib
+import heapq
+import threading
+import uuid
+from .lock_service import (
+    LockService, DEFAULT_LIST_LIMIT, ELECTION_TIMEOUT, LOCK_EXCLUSIVE, MAX_LIST_LIMIT,
+)
+from .resource_index import SEPARATOR
+from .watch import DEFAULT_WATCH_LIMIT
+import logging
+logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+# Raft port distance between the groups of a node, group g of a node on
+# port p listens on p + g * GROUP_PORT_STRIDE
+GROUP_PORT_STRIDE = 10
+# Points per group on the hash ring, more points spread resources more evenly
+VIRTUAL_NODES = 64
+# Election timeouts that make the preferred node of a group win its
+# elections: it always times out before the others while it is up
+PREFERRED_ELECTION_TIMEOUT = (ELECTION_TIMEOUT[0], 0.7)
+FALLBACK_ELECTION_TIMEOUT = (0.8, ELECTION_TIMEOUT[1])
+
+
+def group_address(address: str, group: int, port_stride: int = GROUP_PORT_STRIDE)->str:
+    """Get the Raft address of a group on the node with the given address"""
+    host, port = address.rsplit(':', 1)
+    group_port = int(port) + group * port_stride
+    if group_port > 65535:
+        raise ValueError(f"Raft group {group} of {address} would listen on port {group_port}")
+    return f"{host}:{group_port}"
+
+
+def routing_key(resource: str)->str:
+    """Get the part of a resource name that picks its group
+
+    It is the first path segment, so a hierarchical lock and everything
+    below it always live in the same group."""
+    return resource.split(SEPARATOR, 1)[0]
+
+
+def _hash(key: str)->int:
+    # Stable across processes, unlike hash() under hash randomization
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def _path_key(lock: dict)->list[str]:
+    """Sort key of a listed lock in path order, see ResourceIndex.iter_prefix"""
+    return lock['resource'].split(SEPARATOR)
+
+
+def _gather(futures: list[Future], return_exceptions: bool = False)->Future:
+    """Get a future for the list of results of all futures
+
+    Fails with the first exception, or lists exceptions among the
+    results with return_exceptions set."""
+    gathered = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        results = []
+        for future in futures:
+            error = future.exception()
+            if error is not None and not return_exceptions:
+                gathered.set_exception(error)
+                return
+            results.append(future.result() if error is None else error)
+        gathered.set_result(results)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
+
+
+def _first(futures: list[Future])->Future:
+    """Get a future that resolves once any of the futures does
+
+    Cancelling it cancels the futures."""
+    first = Future()
+
+    def on_done(_):
+        try:
+            first.set_result(True)
+        except InvalidStateError:
+            # Another one was first, or the wait was cancelled
+            pass
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    first.add_done_callback(lambda _: [future.cancel() for future in futures])
+    return first
+
+
+def _then(future: Future, transform: Callable)->Future:
+    """Get a future for the transformed result of a future"""
+    transformed = Future()
+
+    def on_done(_):
+        try:
+            transformed.set_result(transform(future.result()))
+        except Exception as e:
+            transformed.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return transformed
+
+
+def _chain(future: Future, next_step: Callable[..., Future])->Future:
+    """Get a future for the result of the future next_step returns for the result of a future"""
+    chained = Future()
+
+    def on_next_done(following: Future):
+        error = following.exception()
+        if error is not None:
+            chained.set_exception(error)
+        else:
+            chained.set_result(following.result())
+
+    def on_done(_):
+        try:
+            following = next_step(future.result())
+        except Exception as e:
+            chained.set_exception(e)
+            return
+        following.add_done_callback(on_next_done)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+class HashRing:
+    """Consistent hash ring mapping routing keys to group numbers
+
+    Every group owns the hash ranges that end at its virtual nodes. Going
+    from N to N+1 groups moves about 1/(N+1) of the keys to the new group
+    and leaves the rest where they were."""
+
+    def __init__(self, groups: int, virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f"group-{group}#{point}"), group)
+            for group in range(groups)
+            for point in range(virtual_nodes)
+        )
+        self.__hashes = [point_hash for point_hash, _ in points]
+        self.__groups = [group for _, group in points]
+
+    def group_of(self, key: str)->int:
+        """Get the group owning a routing key"""
+        i = bisect.bisect(self.__hashes, _hash(key))
+        return self.__groups[i % len(self.__groups)]
+
+
+class ShardedLockService:
+    """Lock service over several independent Raft groups hosted by the same nodes
+
+    Every group is a LockService with its own Raft port, log, leader and
+    fence counter, and owns the resources that hash to it on a HashRing.
+    Lock calls go to the owning group only, so groups commit in parallel
+    and the leaders of different groups run on different nodes.
+
+    Sessions span groups: a session is created in every group under the
+    same ID, and deleted from all of them. Its ID hashes to the group that
+    owns it, see session_group. Keepalives go to the leader of that group
+    only, which acknowledges them from memory like any LockService, and the
+    batches it replicates also extend the lease in the other groups. Fence
+    tokens are unique per group, which is all a resource ever compares.
+    Batch acquires and releases are all or nothing within a group; an
+    acquire over several groups releases what it got if any group fails."""
+
+    def __init__(self, self_address: str, partner_addresses: list[str], groups: int,
+                 port_stride: int = GROUP_PORT_STRIDE, **kwargs):
+        """
+        Start one LockService per group, kwargs are passed on to each
+
+        Group g prefers the g-th node in address order as leader, so the
+        leaders are spread evenly over the nodes while they are all up."""
+        nodes = sorted([self_address, *partner_addresses])
+        self.__port_stride = port_stride
+        self.__ring = HashRing(groups)
+        self.groups: list[LockService] = []
+        for group in range(groups):
+            preferred = nodes[group % len(nodes)] == self_address
+            self.groups.append(LockService(
+                group_address(self_address, group, port_stride),
+                [group_address(address, group, port_stride) for address in partner_addresses],
+                election_timeout=PREFERRED_ELECTION_TIMEOUT if preferred else FALLBACK_ELECTION_TIMEOUT,
+                lease_listener=functools.partial(self._share_lease_renewals, group),
+                **kwargs,
+            ))
+        logger.info(f"Sharded lock service initialized with {groups} Raft groups")
+
+    @property
+    def selfNode(self):
+        return self.groups[0].selfNode
+
+    @property
+    def otherNodes(self):
+        return self.groups[0].otherNodes
+
+    def _node_address(self, address: str, group: int)->str:
+        """Get the node address of a Raft address of a group"""
+        host, port = address.rsplit(':', 1)
+        return f"{host}:{int(port) - group * self.__port_stride}"
+
+    def group_api_addresses(self, api_addresses: dict[str, str])->dict[str, str]:
+        """Map the Raft addresses of every group to the API addresses of their nodes"""
+        return {
+            group_address(address, group, self.__port_stride): api_address
+            for address, api_address in api_addresses.items()
+            for group in range(len(self.groups))
+        }
+
+    def group_for(self, resource: str)->LockService:
+        """Get the Raft group that owns a resource"""
+        return self.groups[self.__ring.group_of(routing_key(resource))]
+
+    def session_group(self, session_id: str)->LockService:
+        """Get the Raft group that owns a session and takes its keepalives"""
+        return self.groups[self.__ring.group_of(session_id)]
+
+    def route(self, resource: Optional[str] = None, session_id: Optional[str] = None):
+        """Get the Raft group that serves a request
+
+        The group of the resource if there is one, else the group of the
+        session. Requests with neither span every group, this service."""
+        if resource is not None:
+            return self.group_for(resource)
+        if session_id is not None:
+            return self.session_group(session_id)
+        return self
+
+    def _share_lease_renewals(self, group: int, renewals: dict[str, float])->None:
+        """Extend the leases a group replicated in every other group, its lease_listener"""
+        for other, service in enumerate(self.groups):
+            if other != group:
+                service.extend_leases(renewals)
+
+    def _groups_for_prefix(self, prefix: str)->list[LockService]:
+        """Get the groups that may own resources starting with prefix"""
+        if SEPARATOR in prefix:
+            return [self.group_for(prefix)]
+        return self.groups
+
+    def get_leaders(self)->list[Optional[str]]:
+        """Get the node leading each group"""
+        leaders = []
+        for group, service in enumerate(self.groups):
+            leader = service.get_leader()
+            leaders.append(self._node_address(leader, group) if leader else None)
+        return leaders
+
+    def get_leader(self)->Optional[str]:
+        """Get the node leading every group, None unless a single node leads them all"""
+        leaders = set(self.get_leaders())
+        if len(leaders) == 1:
+            return leaders.pop()
+        return None
+
+    def is_leader(self)->bool:
+        """Check if this node leads every group"""
+        return all(service.is_leader() for service in self.groups)
+
+    def is_ready(self)->bool:
+        return all(service.is_ready() for service in self.groups)
+
+    def get_staleness_ms(self)->float:
+        return max(service.get_staleness_ms() for service in self.groups)
+
+    def read_barrier_async(self, consistency: str, max_staleness_ms: Optional[float] = None)->Future:
+        """Check the state of every group is fit for a read, see LockService.read_barrier_async
+
+        A linearizable read needs this node to lead every group. Reads of a
+        single resource or session only need its group, see route."""
+        return _then(_gather([
+            service.read_barrier_async(consistency, max_staleness_ms) for service in self.groups
+        ]), all)
+
+    def read_barrier(self, consistency: str, max_staleness_ms: Optional[float] = None,
+                     timeout: Optional[float] = None)->bool:
+        try:
+            return self.read_barrier_async(consistency, max_staleness_ms).result(timeout)
+        except FutureTimeoutError:
+            return False
+
+    def create_session_async(self, client_id: str, timeout:int = 60, request_id: Optional[str] = None)->Future:
+        """Create a client session in every group, returns a future for the session ID
+
+        With a request ID, the group the request ID hashes to creates the
+        session first and decides its ID, so a retry gets the same one, see
+        LockService.create_session_async. It then creates the session in
+        the groups an interrupted attempt missed, and in no others.
+        Without a request ID nothing can retry a failed creation, so the
+        groups that created the session delete it again when any group
+        fails, like acquire_locks_async."""
+        self.check_client_id(client_id)
+        self.check_timeout(timeout)
+        self.check_session_request_id(request_id)
+
+        def create_everywhere(session_id: Optional[str])->Future:
+            if session_id is None:
+                rejected = Future()
+                rejected.set_result(None)
+                return rejected
+
+            def combine(results: list)->str:
+                errors = [error for error in results if isinstance(error, BaseException)]
+                if not errors:
+                    return session_id
+                if request_id is None:
+                    for service, created in zip(self.groups, results):
+                        if created == session_id:
+                            service.delete_session_async(session_id)
+                raise errors[0]
+
+            return _then(_gather([
+                service.create_session_async(client_id, timeout, session_id, request_id) for service in self.groups
+            ], return_exceptions=True), combine)
+
+        if request_id is None:
+            return create_everywhere(str(uuid.uuid4()))
+        first = self.groups[self.__ring.group_of(request_id)]
+        return _chain(first.create_session_async(client_id, timeout, request_id=request_id), create_everywhere)
+
+    def create_session(self, client_id: str, timeout:int = 60, request_id: Optional[str] = None)->str:
+        return self.create_session_async(client_id, timeout, request_id).result()
+
+    def get_session_info(self, session_id:str)->Optional[dict]:
+        """Get session details with the locks of every group"""
+        infos = [service.get_session_info(session_id) for service in self.groups]
+        if None in infos:
+            return None
+        info = dict(infos[0])
+        info['expires_at'] = min(group_info['expires_at'] for group_info in infos)
+        info['locks_held'] = [resource for group_info in infos for resource in group_info['locks_held']]
+        info['waiting_on'] = [resource for group_info in infos for resource in group_info['waiting_on']]
+        return info
+
+    def keepalive_async(self, session_id: str)->Future:
+        """Extend the session lease, returns a future for success
+
+        The leader of the session's group acknowledges it from memory, and
+        the other groups get it with the batch that group replicates. A node
+        that does not lead the session's group, which only happens when no
+        forwarder sent the keepalive on, falls back to replicated keepalives
+        in every group."""
+        group = self.session_group(session_id)
+        if group.is_leader():
+            return group.keepalive_async(session_id)
+        return _then(_gather([service.keepalive_async(session_id) for service in self.groups]), all)
+
+    def keepalive(self, session_id: str)->bool:
+        return self.keepalive_async(session_id).result()
+
+    def delete_session_async(self, session_id: str)->Future:
+        """Delete the session from every group, returns a future for success"""
+        return _then(_gather([service.delete_session_async(session_id) for service in self.groups]), any)
+
+    def delete_session(self, session_id: str)->bool:
+        return self.delete_session_async(session_id).result()
+
+    check_lock_mode = staticmethod(LockService.check_lock_mode)
+    check_request_id = staticmethod(LockService.check_request_id)
+    check_session_request_id = staticmethod(LockService.check_session_request_id)
+    check_client_id = staticmethod(LockService.check_client_id)
+    check_timeout = staticmethod(LockService.check_timeout)
+    check_wait_timeout = staticmethod(LockService.check_wait_timeout)
+    check_resources = staticmethod(LockService.check_resources)
+    check_fence_tokens = staticmethod(LockService.check_fence_tokens)
+
+    def acquire_lock_async(self, session_id: str, resource:str, hierarchical: bool = False,
+                           mode: str = LOCK_EXCLUSIVE, permits: Optional[int] = None,
+                           request_id: Optional[str] = None)->Future:
+        return self.group_for(resource).acquire_lock_async(session_id, resource, hierarchical, mode, permits,
+                                                           request_id)
+
+    def acquire_lock(self, session_id: str, resource:str, wait_timeout: Optional[float] = None,
+                     hierarchical: bool = False, mode: str = LOCK_EXCLUSIVE,
+                     permits: Optional[int] = None, request_id: Optional[str] = None)->Optional[int]:
+        return self.group_for(resource).acquire_lock(session_id, resource, wait_timeout, hierarchical, mode, permits,
+                                                     request_id)
+
+    def acquire_lock_waiting_async(self, session_id: str, resource:str, mode: str = LOCK_EXCLUSIVE,
+                                   permits: Optional[int] = None, request_id: Optional[str] = None)->Future:
+        return self.group_for(resource).acquire_lock_waiting_async(session_id, resource, mode, permits, request_id)
+
+    def cancel_wait_async(self, session_id: str, resource:str)->Future:
+        return self.group_for(resource).cancel_wait_async(session_id, resource)
+
+    def abandon_wait(self, session_id: str, resource:str, grant: Future)->None:
+        self.group_for(resource).abandon_wait(session_id, resource, grant)
+
+    def release_lock_async(self, session_id:str, resource: str, fence_token:int,
+                           request_id: Optional[str] = None)->Future:
+        return self.group_for(resource).release_lock_async(session_id, resource, fence_token, request_id)
+
+    def release_lock(self, session_id:str, resource: str, fence_token:int, request_id: Optional[str] = None)->bool:
+        return self.group_for(resource).release_lock(session_id, resource, fence_token, request_id)
+
+    def _split_by_group(self, resources)->dict[LockService, list[str]]:
+        by_group: dict[LockService, list[str]] = {}
+        for resource in resources:
+            by_group.setdefault(self.group_for(resource), []).append(resource)
+        return by_group
+
+    def acquire_locks_async(self, session_id:str, resources:list[str], request_id: Optional[str] = None)->Future:
+        """Acquire locks on all resources or none, returns a future for the fence tokens
+
+        Resources of a single group are acquired in one log entry. Over
+        several groups, the locks that were granted are released again
+        when any group fails. Every group keeps the result of its part
+        under the request ID, so a retry combines the same results."""
+        self.check_resources(resources)
+        by_group = self._split_by_group(resources)
+        services = list(by_group) or self.groups[:1]
+        if len(services) == 1:
+            return services[0].acquire_locks_async(session_id, resources, request_id)
+
+        def combine(results: list)->Optional[dict[str, int]]:
+            if all(isinstance(tokens, dict) for tokens in results):
+                return {resource: token for tokens in results for resource, token in tokens.items()}
+            for service, tokens in zip(services, results):
+                if isinstance(tokens, dict):
+                    service.release_locks_async(session_id, tokens)
+            for error in results:
+                if isinstance(error, BaseException):
+                    raise error
+            return None
+
+        return _then(_gather([
+            service.acquire_locks_async(session_id, by_group[service], request_id) for service in services
+        ], return_exceptions=True), combine)
+
+    def acquire_locks(self, session_id:str, resources:list[str],
+                      request_id: Optional[str] = None)->Optional[dict[str, int]]:
+        return self.acquire_locks_async(session_id, resources, request_id).result()
+
+    def release_locks_async(self, session_id:str, locks:dict[str, int], request_id: Optional[str] = None)->Future:
+        """Release locks given as resource to fence token, all or nothing within each group"""
+        self.check_fence_tokens(locks)
+        by_group = self._split_by_group(locks)
+        return _then(_gather([
+            service.release_locks_async(session_id, {resource: locks[resource] for resource in group_resources},
+                                        request_id)
+            for service, group_resources in by_group.items()
+        ]), all)
+
+    def release_locks(self, session_id:str, locks:dict[str, int], request_id: Optional[str] = None)->bool:
+        return self.release_locks_async(session_id, locks, request_id).result()
+
+    def get_lock_info(self, resource:str)->Optional[dict]:
+        return self.group_for(resource).get_lock_info(resource)
+
+    def count_locks(self, prefix:str = "")->int:
+        return sum(service.count_locks(prefix) for service in self._groups_for_prefix(prefix))
+
+    def list_locks(self, prefix:str = "", limit:int = DEFAULT_LIST_LIMIT,
+                   cursor:Optional[str] = None)->tuple[list[dict], Optional[str]]:
+        """Get a page of the locks under a prefix in path order over all groups
+
+        Merges a page of every group, the cursor works the same way as
+        for a single group."""
+        limit = max(1, min(limit, MAX_LIST_LIMIT))
+        pages = [service.list_locks(prefix, limit, cursor) for service in self._groups_for_prefix(prefix)]
+        merged = list(heapq.merge(*(locks for locks, _ in pages), key=_path_key))
+        if len(merged) > limit or any(next_cursor for _, next_cursor in pages):
+            locks = merged[:limit]
+            return locks, locks[-1]['resource']
+        return merged, None
+
+    def watch_cursor(self)->str:
+        """Get the watch cursor of every group, joined by commas"""
+        return ",".join(service.watch_cursor() for service in self.groups)
+
+    def _split_cursor(self, cursor: str)->list[str]:
+        cursors = cursor.split(",")
+        if len(cursors) != len(self.groups):
+            raise ValueError(f"Watch cursor must have {len(self.groups)} parts, got {cursor}")
+        return cursors
+
+    def read_events(self, cursor: Optional[str] = None, prefix: str = "",
+                    limit: int = DEFAULT_WATCH_LIMIT)->tuple[list[dict], str]:
+        """Get the events of every group after cursor, see LockService.read_events
+
+        Events are in log order within a group and tagged with it, the
+        index of an event is the log index in its group."""
+        if cursor is None:
+            return [], self.watch_cursor()
+        events = []
+        next_cursors = []
+        for group, (service, group_cursor) in enumerate(zip(self.groups, self._split_cursor(cursor))):
+            group_events, next_cursor = service.read_events(group_cursor, prefix, limit)
+            events.extend({**event, "group": group} for event in group_events)
+            next_cursors.append(next_cursor)
+        return events, ",".join(next_cursors)
+
+    def wait_events_async(self, cursor: str)->Future:
+        """Get a future that resolves once any group has events after its part of cursor"""
+        return _first([
+            service.wait_events_async(group_cursor)
+            for service, group_cursor in zip(self.groups, self._split_cursor(cursor))
+        ])
+
+    def get_all_session_locks(self, session_id:str)->Optional[list[str]]:
+        group_locks = [service.get_all_session_locks(session_id) for service in self.groups]
+        if None in group_locks:
+            return None
+        return [resource for locks in group_locks for resource in locks]
+
+    def release_expired_sessions(self)->int:
+        return sum(service.release_expired_sessions() for service in self.groups)
+
+    def get_stats(self)->dict:
+        """Get service stats summed over groups, sessions are counted once"""
+        group_stats = [service.get_stats() for service in self.groups]
+        return {
+            "total_session": group_stats[0]['total_session'],
+            "total_locks": sum(stats['total_locks'] for stats in group_stats),
+            "fence_counter": sum(stats['fence_counter'] for stats in group_stats),
+            "active_sessions": group_stats[0]['active_sessions'],
+            "expired_sessions": group_stats[0]['expired_sessions'],
+            "groups": group_stats,
+        }
+
+    def destroy(self)->None:
+        """Stop every group"""
+        for service in self.groups:
+            service.destroy()
@@ -50,20 +50,45 @@ document.addEventListener("DOMContentLoaded", function() {
         }
     }
 
-    async function pollCluster() {
-        const statuses = await Promise.all(
-            NODES.map(node => fetchNodeStatus(node))
-        );
+    // Events pushed by /watch/events that change what the dashboard shows
+    const EVENT_TYPES = [
+        "session_created", "session_deleted", "session_expired",
+        "lock_acquired", "lock_released", "leader_changed", "expired",
+    ];
+    // Events only trigger refreshes, this poll catches nodes going offline
+    const FALLBACK_POLL_INTERVAL = 5000;
+    // Bursts of events are coalesced into one refresh
+    const REFRESH_DELAY = 100;
 
-        NODES.forEach((node, index) => {
-            updateNodeUI(node.id, statuses[index]);
-        });
+    const statuses = NODES.map(() => null);
+    const refreshTimers = NODES.map(() => null);
 
+    async function refreshNode(index) {
+        refreshTimers[index] = null;
+        statuses[index] = await fetchNodeStatus(NODES[index]);
+        updateNodeUI(NODES[index].id, statuses[index]);
         updateStats(statuses);
     }
 
-    // Poll every 500ms
-    setInterval(pollCluster, 500);
+    function scheduleRefresh(index) {
+        if (refreshTimers[index] === null) {
+            refreshTimers[index] = setTimeout(() => refreshNode(index), REFRESH_DELAY);
+        }
+    }
+
+    function pollCluster() {
+        NODES.forEach((node, index) => refreshNode(index));
+    }
+
+    function watchNode(index) {
+        // EventSource reconnects by itself and resumes from the last event ID
+        const source = new EventSource(`${NODES[index].url}/watch/events`);
+        EVENT_TYPES.forEach(type => source.addEventListener(type, () => scheduleRefresh(index)));
+        source.onerror = () => scheduleRefresh(index);
+    }
+
+    NODES.forEach((node, index) => watchNode(index));
+    setInterval(pollCluster, FALLBACK_POLL_INTERVAL);
 
     // Initial poll
     pollCluster();
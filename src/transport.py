@@ -0,0 +1,16 @@
+from pysyncobj.transport import TCPTransport
+
+
+class ContactTrackingTransport(TCPTransport):
+    """TCP transport that reports every Raft message to its SyncObj
+
+    Lets the lock service see when followers acknowledged the leader and
+    when a follower last heard from the leader, which bounded-staleness
+    reads depend on, and exchange the ReadIndex messages of linearizable
+    reads over the Raft connections."""
+
+    def _onMessageReceived(self, node, message):
+        if isinstance(message, dict) and self._syncObj._on_raft_message(node, message):
+            # A message of the lock service itself, Raft has no use for it
+            return
+        super()._onMessageReceived(node, message)
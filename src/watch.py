@@ -0,0 +1,150 @@
+from concurrent.futures import Future
+import bisect
+import json
+import threading
+
+# Events kept per node for watchers to resume from
+WATCH_BUFFER_SIZE = 10000
+DEFAULT_WATCH_LIMIT = 1000
+# Seconds a long-poll waits for events, and the most a client may ask for
+DEFAULT_WATCH_TIMEOUT = 30.0
+MAX_WATCH_TIMEOUT = 60.0
+# Seconds between comments on an idle event stream, so dead clients are noticed
+SSE_HEARTBEAT_INTERVAL = 15.0
+
+# Event types
+SESSION_CREATED = "session_created"
+SESSION_DELETED = "session_deleted"
+SESSION_EXPIRED = "session_expired"
+LOCK_ACQUIRED = "lock_acquired"
+LOCK_RELEASED = "lock_released"
+LEADER_CHANGED = "leader_changed"
+
+
+class CursorExpired(Exception):
+    """The events after a watch cursor are no longer buffered on this node
+
+    floor is the oldest cursor that can still be resumed from. A watcher
+    that gets this re-reads the state it needs, then watches from the
+    current cursor."""
+
+    def __init__(self, cursor: int, floor: int):
+        super().__init__(f"Watch cursor {cursor} is older than the buffered events, which start after {floor}")
+        self.floor = floor
+
+
+def format_sse(events: list[dict], cursor: str)->str:
+    """Format events as server-sent events
+
+    Only the last event carries the cursor as its ID, the one a client
+    sends back as Last-Event-ID when it reconnects."""
+    lines = []
+    for i, event in enumerate(events):
+        lines.append(f"event: {event['type']}\n")
+        if i == len(events) - 1:
+            lines.append(f"id: {cursor}\n")
+        lines.append(f"data: {json.dumps(event)}\n\n")
+    return "".join(lines)
+
+
+class EventLog:
+    """Bounded buffer of the events of applied Raft log entries
+
+    Events are appended by the state machine while an entry is applied,
+    and keyed by the log index of that entry, so every node produces the
+    same events under the same cursors. They become visible once publish
+    is called with an applied index at or past them, which keeps the
+    events of a half-applied batch from being read. A cursor is the last
+    log index a watcher has seen."""
+
+    def __init__(self, size: int = WATCH_BUFFER_SIZE):
+        self.__size = size
+        self.__indexes: list[int] = []
+        self.__events: list[dict] = []
+        # Events at or before floor may be missing, after it they are complete
+        self.__floor = 0
+        self.__head = 0
+        self.__lock = threading.Lock()
+        self.__waiters: list[tuple[int, Future]] = []
+
+    @property
+    def head(self)->int:
+        """The cursor of the last published entry"""
+        return self.__head
+
+    def _last_published(self)->int:
+        """Get the index of the last published event, 0 if there is none, under the lock"""
+        i = bisect.bisect_right(self.__indexes, self.__head)
+        return self.__indexes[i - 1] if i else 0
+
+    def append(self, index: int, event: dict)->None:
+        """Record an event of the log entry being applied"""
+        event['index'] = index
+        with self.__lock:
+            self.__indexes.append(index)
+            self.__events.append(event)
+            if len(self.__events) > 2 * self.__size:
+                # Trimmed in halves, so each append costs O(1) on average
+                trimmed = len(self.__events) - self.__size
+                self.__floor = max(self.__floor, self.__indexes[trimmed - 1])
+                del self.__indexes[:trimmed]
+                del self.__events[:trimmed]
+
+    def reset(self, index: int)->None:
+        """Drop all events, the state jumped to index without applying the entries before it
+
+        Waiting watchers are woken to find out that their cursor expired."""
+        with self.__lock:
+            self.__indexes.clear()
+            self.__events.clear()
+            self.__floor = self.__head = index
+            waiters, self.__waiters = self.__waiters, []
+        for _, waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+    def publish(self, applied: int)->None:
+        """Make the events of entries up to applied visible and wake the watchers waiting for them"""
+        with self.__lock:
+            if applied <= self.__head:
+                return
+            self.__head = applied
+            last_event = self._last_published()
+            waiters = [(cursor, waiter) for cursor, waiter in self.__waiters if not waiter.done()]
+            self.__waiters = [(cursor, waiter) for cursor, waiter in waiters if cursor >= last_event]
+        for cursor, waiter in waiters:
+            if cursor < last_event and not waiter.done():
+                waiter.set_result(True)
+
+    def read(self, cursor: int, prefix: str = "", limit: int = DEFAULT_WATCH_LIMIT)->tuple[list[dict], int]:
+        """Get the published events after cursor and the cursor to continue from
+
+        With a prefix only lock events on resources under it are returned.
+        A page ends on an entry boundary, so it may hold a few more than
+        limit events."""
+        with self.__lock:
+            if cursor < self.__floor:
+                raise CursorExpired(cursor, self.__floor)
+            head = self.__head
+            start = bisect.bisect_right(self.__indexes, cursor)
+            end = bisect.bisect_right(self.__indexes, head)
+            indexes = self.__indexes[start:end]
+            events = self.__events[start:end]
+        matched = []
+        for i, event in enumerate(events):
+            if len(matched) >= limit and indexes[i] != indexes[i - 1]:
+                return matched, indexes[i - 1]
+            if not prefix or event.get('resource', '').startswith(prefix):
+                matched.append(event)
+        return matched, max(head, cursor)
+
+    def wait_async(self, cursor: int)->Future:
+        """Get a future that resolves once an event after cursor is published"""
+        waiter = Future()
+        with self.__lock:
+            if cursor < self._last_published():
+                waiter.set_result(True)
+                return waiter
+            self.__waiters = [(c, w) for c, w in self.__waiters if not w.done()]
+            self.__waiters.append((cursor, waiter))
+        return waiter
@@ -0,0 +1,29 @@
+import socket
+import time
+import uuid
+import pytest
+from src.lock_service import LockService
+
+
+def free_address()->str:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return f"localhost:{s.getsockname()[1]}"
+
+
+@pytest.fixture(scope="session")
+def node():
+    """A single-node LockService, leader of its own cluster"""
+    node = LockService(free_address(), [])
+    deadline = time.monotonic() + 10
+    while not (node.is_leader() and node.is_ready()):
+        assert time.monotonic() < deadline, "single node did not become leader"
+        time.sleep(0.05)
+    yield node
+    node.destroy()
+
+
+@pytest.fixture
+def session(node):
+    """Create sessions of distinct clients on node"""
+    return lambda: node.create_session(f"client-{uuid.uuid4().hex[:8]}", 60)
@@ -21,7 +21,10 @@ def main():
     assert session_info['client_id'] == "test-client-1"
     assert session_info['session_id'] == session_id_1
     assert session_info['timeout'] == 10
-    assert node._is_expired(session_info) == False
+    assert node._is_expired(node._get_session(session_id_1)) == False
+
+    assert node.keepalive(session_id_1) == True
+    assert node.keepalive("missing-session") == False
 
     stats = node.get_stats()
     print(f"stats is {stats}")
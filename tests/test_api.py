@@ -0,0 +1,58 @@
+import json
+import pytest
+from src import api
+from src.api import ApiRequest
+
+
+def call(node, handler, path_params: dict, body: dict)->api.ApiResponse:
+    """Serve a JSON request with a handler of src/api.py, without a web framework"""
+    request = ApiRequest("POST", "/", path_params, {}, {}, json.dumps(body).encode(), api.JSON_CONTENT_TYPE)
+    return api.serve(handler, node, request)
+
+
+@pytest.mark.parametrize("wait_timeout", ["1", -1, float("inf"), True, [1]])
+def test_invalid_wait_timeout_is_rejected_before_queueing(node, session, wait_timeout):
+    holder, waiter = session(), session()
+    node.acquire_lock(holder, "api/wait")
+    response = call(node, api.acquire_lock, {"session_id": waiter, "resource": "api/wait"},
+                    {"wait_timeout": wait_timeout})
+    assert response.status == 400
+    assert node.get_session_info(waiter)["waiting_on"] == []
+    assert node.get_lock_info("api/wait")["waiters"] == 0
+
+
+def test_wait_timeout_of_zero_does_not_wait(node, session):
+    holder, other = session(), session()
+    node.acquire_lock(holder, "api/nowait")
+    response = call(node, api.acquire_lock, {"session_id": other, "resource": "api/nowait"}, {"wait_timeout": 0})
+    assert response.status == 409
+    assert node.get_session_info(other)["waiting_on"] == []
+
+
+@pytest.mark.parametrize("hierarchical", ["false", "true", 1, None])
+def test_hierarchical_must_be_a_boolean(node, session, hierarchical):
+    owner = session()
+    response = call(node, api.acquire_lock, {"session_id": owner, "resource": "api/tree"},
+                    {"hierarchical": hierarchical})
+    assert response.status == 400
+    assert node.get_lock_info("api/tree") is None
+
+
+def test_hierarchical_false_is_a_plain_lock(node, session):
+    owner = session()
+    response = call(node, api.acquire_lock, {"session_id": owner, "resource": "api/plain"}, {"hierarchical": False})
+    assert response.status == 201
+    assert node.get_lock_info("api/plain")["hierarchical"] is False
+
+
+@pytest.mark.parametrize("client_id", [123, "", None, ["worker"]])
+def test_invalid_client_id_is_rejected(node, client_id):
+    response = call(node, api.create_session, {}, {"client_id": client_id, "timeout": 30})
+    assert response.status == 400
+    assert "Client ID" in response.body["error"]
+
+
+def test_create_session(node):
+    response = call(node, api.create_session, {}, {"client_id": "api-client", "timeout": 30})
+    assert response.status == 201
+    assert node.get_session_info(response.body["session_id"])["client_id"] == "api-client"
@@ -0,0 +1,36 @@
+import pytest
+
+
+def test_batch_acquire_is_all_or_nothing(node, session):
+    holder, other = session(), session()
+    node.acquire_lock(holder, "batch/2")
+
+    assert node.acquire_locks(other, ["batch/1", "batch/2", "batch/3"]) is None
+    assert node.get_lock_info("batch/1") is None
+    assert node.get_lock_info("batch/3") is None
+
+    fence_tokens = node.acquire_locks(other, ["batch/1", "batch/3"])
+    assert set(fence_tokens) == {"batch/1", "batch/3"}
+    assert sorted(node.get_all_session_locks(other)) == ["batch/1", "batch/3"]
+
+
+def test_batch_release_is_all_or_nothing(node, session):
+    owner = session()
+    fence_tokens = node.acquire_locks(owner, ["batch/r1", "batch/r2"])
+
+    wrong = dict(fence_tokens, **{"batch/r2": fence_tokens["batch/r2"] + 1000})
+    assert not node.release_locks(owner, wrong)
+    assert node.get_lock_info("batch/r1") is not None
+    assert node.get_lock_info("batch/r2") is not None
+
+    assert node.release_locks(owner, fence_tokens)
+    assert node.get_lock_info("batch/r1") is None
+    assert node.get_lock_info("batch/r2") is None
+
+
+def test_invalid_batches_are_rejected(node, session):
+    owner = session()
+    with pytest.raises(ValueError):
+        node.acquire_locks(owner, [])
+    with pytest.raises(ValueError):
+        node.release_locks(owner, {"batch/x": "1"})
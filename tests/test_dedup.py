@@ -0,0 +1,45 @@
+import uuid
+import pytest
+
+
+def test_retried_acquire_gets_first_result(node, session):
+    owner, other = session(), session()
+    request_id = uuid.uuid4().hex
+    fence_token = node.acquire_lock(owner, "dedup/acquire", request_id=request_id)
+    assert node.acquire_lock(owner, "dedup/acquire", request_id=request_id) == fence_token
+    assert node.get_all_session_locks(owner) == ["dedup/acquire"]
+
+    # A conflict is replayed too, even after the lock is free
+    conflict_id = uuid.uuid4().hex
+    assert node.acquire_lock(other, "dedup/acquire", request_id=conflict_id) is None
+    node.release_lock(owner, "dedup/acquire", fence_token)
+    assert node.acquire_lock(other, "dedup/acquire", request_id=conflict_id) is None
+
+
+def test_retried_release_gets_first_result(node, session):
+    owner = session()
+    fence_token = node.acquire_lock(owner, "dedup/release")
+    request_id = uuid.uuid4().hex
+    assert node.release_lock(owner, "dedup/release", fence_token, request_id)
+    assert node.release_lock(owner, "dedup/release", fence_token, request_id)
+    assert not node.release_lock(owner, "dedup/release", fence_token)
+
+
+def test_retried_batch_gets_first_result(node, session):
+    owner = session()
+    request_id = uuid.uuid4().hex
+    fence_tokens = node.acquire_locks(owner, ["dedup/b1", "dedup/b2"], request_id)
+    assert node.acquire_locks(owner, ["dedup/b1", "dedup/b2"], request_id) == fence_tokens
+
+
+def test_retried_create_gets_same_session(node):
+    request_id = str(uuid.uuid4())
+    session_id = node.create_session("dedup-client", 30, request_id)
+    assert node.create_session("dedup-client", 30, request_id) == session_id
+    assert node.create_session("other-client", 30, request_id) is None
+    assert node.create_session("dedup-client", 31, request_id) is None
+    with pytest.raises(ValueError):
+        node.create_session("dedup-client", 30, "not-a-uuid")
+
+    assert node.delete_session(session_id)
+    assert node.create_session("dedup-client", 30, request_id) != session_id
@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import wait
+from src.lock_service import EXPIRY_COMPACT_MIN
+
+
+def expiry_heap(node)->list:
+    return node._LockService__expiry_heap
+
+
+def replicated_keepalives(node, session_id: str, count: int)->None:
+    for start in range(0, count, 100):
+        futures = [node._submit(node._keepalive_internal, session_id, time.time())
+                   for _ in range(min(100, count - start))]
+        wait(futures, timeout=10)
+        assert all(future.result() for future in futures)
+
+
+def test_stale_entries_do_not_count_as_expired(node):
+    session_id = node.create_session("expiry-client", 0.5)
+    for _ in range(4):
+        replicated_keepalives(node, session_id, 1)
+        time.sleep(0.2)
+    # The deadlines of the earlier keepalives have passed, the session's has not
+    assert node.get_stats()["expired_sessions"] == 0
+    time.sleep(0.1)
+    deadline, top = expiry_heap(node)[0]
+    assert node.get_session_info(top)["expires_at"] == deadline
+
+    time.sleep(1)
+    assert node.get_session_info(session_id) is None
+
+
+def test_expiry_index_is_compacted(node, session):
+    session_id = session()
+    replicated_keepalives(node, session_id, 2 * EXPIRY_COMPACT_MIN)
+    assert len(expiry_heap(node)) <= 2 * node.get_stats()["total_session"] + EXPIRY_COMPACT_MIN + 1
+    assert node.keepalive(session_id)
+
+
+def test_stale_entries_take_no_log_entries(node):
+    session_id = node.create_session("expiry-client", 1)
+    replicated_keepalives(node, session_id, 3)
+    time.sleep(0.5)
+    replicated_keepalives(node, session_id, 1)
+    commit_index = node.raftCommitIndex
+    # The earlier deadlines pass, the reaper has nothing to do yet
+    time.sleep(0.8)
+    assert node.raftCommitIndex == commit_index
+    assert node.get_session_info(session_id) is not None
@@ -0,0 +1,14 @@
+import time
+
+
+def test_failed_operation_leaves_rest_of_group_commit(node, session):
+    owner = session()
+    # Submitted together, so they are applied in one batch entry
+    failing = node._submit(node._acquire_locks_internal, owner, "not a list", time.time())
+    futures = [node.acquire_lock_async(owner, f"group/{i}") for i in range(20)]
+
+    assert failing.result(timeout=5) is None
+    fence_tokens = [future.result(timeout=5) for future in futures]
+    assert None not in fence_tokens
+    assert len(set(fence_tokens)) == len(fence_tokens)
+    assert node.count_locks("group/") == 20
@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import pytest
+from benchmarks.failover import PartitionableLockService
+from src.lock_service import READ_LINEARIZABLE
+from tests.conftest import free_address
+
+
+@pytest.fixture
+def cluster():
+    addresses = [free_address() for _ in range(3)]
+    nodes = [PartitionableLockService(address, [other for other in addresses if other != address])
+             for address in addresses]
+    yield nodes
+    for node in nodes:
+        node.destroy()
+
+
+def wait_for_leader(nodes):
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        for node in nodes:
+            if node.is_leader() and node.read_barrier(READ_LINEARIZABLE, timeout=1):
+                return node
+        time.sleep(0.1)
+    pytest.fail("no leader was elected")
+
+
+def test_leader_acknowledges_keepalives_without_log_entries(cluster):
+    leader = wait_for_leader(cluster)
+    session_id = leader.create_session("keepalive-client", 30)
+    time.sleep(0.3)
+    commit_index = leader.raftCommitIndex
+    for _ in range(20):
+        assert leader.keepalive(session_id)
+    assert leader.raftCommitIndex == commit_index
+
+
+def test_cut_off_leader_does_not_acknowledge_keepalives(cluster):
+    leader = wait_for_leader(cluster)
+    session_id = leader.create_session("keepalive-client", 30)
+    followers = [node for node in cluster if node is not leader]
+    leader.set_partitioned([str(node.selfNode) for node in followers])
+    for node in followers:
+        node.set_partitioned([str(leader.selfNode)])
+    time.sleep(0.5)
+
+    # Still believes it leads, but can no longer vouch for the lease
+    assert leader.is_leader()
+    renewed = leader.keepalive_async(session_id)
+    try:
+        assert not renewed.result(timeout=3)
+    except FutureTimeoutError:
+        pass
@@ -0,0 +1,18 @@
+def test_list_locks_pages_in_path_order(node, session):
+    owner = session()
+    resources = [f"page/{group}/{i}" for group in ("a", "b", "c") for i in range(5)]
+    node.acquire_locks(owner, resources)
+    node.acquire_lock(owner, "pager/outside")
+
+    listed, cursor = [], None
+    while True:
+        locks, cursor = node.list_locks("page/", limit=4, cursor=cursor)
+        assert len(locks) <= 4
+        listed.extend(lock["resource"] for lock in locks)
+        if cursor is None:
+            break
+    assert listed == sorted(resources)
+    assert node.count_locks("page/") == 15
+    assert node.count_locks("page/b/") == 5
+    # A prefix is not split on the separator, so it matches pager/ too
+    assert node.count_locks("page") == 16
@@ -0,0 +1,41 @@
+import pytest
+from src.lock_service import LOCK_SEMAPHORE, LOCK_SHARED
+
+
+def test_shared_locks_exclude_writers(node, session):
+    readers = [session(), session()]
+    writer = session()
+    fence_tokens = [node.acquire_lock(reader, "mode/shared", mode=LOCK_SHARED) for reader in readers]
+    assert None not in fence_tokens
+    assert fence_tokens[0] != fence_tokens[1]
+    assert node.acquire_lock(writer, "mode/shared") is None
+
+    for reader, fence_token in zip(readers, fence_tokens):
+        assert node.release_lock(reader, "mode/shared", fence_token)
+    assert node.acquire_lock(writer, "mode/shared") is not None
+    assert node.acquire_lock(readers[0], "mode/shared", mode=LOCK_SHARED) is None
+
+
+def test_semaphore_admits_up_to_permits(node, session):
+    holders = [session() for _ in range(3)]
+    granted = [node.acquire_lock(holder, "mode/semaphore", mode=LOCK_SEMAPHORE, permits=2) for holder in holders]
+    assert granted[0] is not None and granted[1] is not None
+    assert granted[2] is None
+    assert len(node.get_lock_info("mode/semaphore")["holders"]) == 2
+
+    # Every holder has to agree on the number of permits
+    assert node.acquire_lock(holders[2], "mode/semaphore", mode=LOCK_SEMAPHORE, permits=3) is None
+    node.release_lock(holders[0], "mode/semaphore", granted[0])
+    assert node.acquire_lock(holders[2], "mode/semaphore", mode=LOCK_SEMAPHORE, permits=2) is not None
+
+
+@pytest.mark.parametrize("mode, permits, hierarchical", [
+    (LOCK_SEMAPHORE, None, False),
+    (LOCK_SEMAPHORE, 0, False),
+    (LOCK_SHARED, 2, False),
+    (LOCK_SHARED, None, True),
+    ("upgradable", None, False),
+])
+def test_invalid_lock_modes_are_rejected(node, session, mode, permits, hierarchical):
+    with pytest.raises(ValueError):
+        node.acquire_lock(session(), "mode/invalid", mode=mode, permits=permits, hierarchical=hierarchical)
@@ -0,0 +1,81 @@
+import random
+from src.resource_index import ResourceIndex
+
+
+def index_of(resources)->ResourceIndex:
+    index = ResourceIndex()
+    for resource in resources:
+        index.add(resource)
+    return index
+
+
+def matching(resources, prefix, after=None)->list[str]:
+    """What iter_prefix should yield: the resources starting with prefix in path order, after the cursor"""
+    key = lambda resource: resource.split("/")
+    found = sorted((resource for resource in resources if resource.startswith(prefix)), key=key)
+    if after is not None:
+        found = [resource for resource in found if key(resource) > key(after)]
+    return found
+
+
+def test_prefix_match_is_not_split_on_separator():
+    index = index_of(["a/b", "a/b/c", "a/bc", "a/c", "ab"])
+    assert list(index.iter_prefix("a/b")) == ["a/b", "a/b/c", "a/bc"]
+    assert list(index.iter_prefix("a/b/")) == ["a/b/c"]
+    assert list(index.iter_prefix("a")) == ["a/b", "a/b/c", "a/bc", "a/c", "ab"]
+    assert index.count("a/b") == 3
+    assert index.count("a/b/") == 1
+    assert index.count("") == 5
+    assert index.count("x") == 0
+
+
+def test_pages_resume_after_cursor():
+    resources = [f"jobs/{i // 10}/{i}" for i in range(100)]
+    index = index_of(resources)
+    listed, cursor = [], None
+    while True:
+        page = []
+        for resource in index.iter_prefix("jobs/", cursor):
+            page.append(resource)
+            if len(page) == 7:
+                break
+        listed.extend(page)
+        if len(page) < 7:
+            break
+        cursor = page[-1]
+    assert listed == matching(resources, "jobs/")
+
+
+def test_cursor_need_not_be_locked():
+    index = index_of(["q/a", "q/c", "q/e"])
+    assert list(index.iter_prefix("q/", "q/b")) == ["q/c", "q/e"]
+    index.remove("q/c")
+    assert list(index.iter_prefix("q/", "q/c")) == ["q/e"]
+
+
+def test_matches_a_scan_after_random_changes():
+    rng = random.Random(7)
+    names = ["a", "ab", "b", "ba", "c"]
+    locked = set()
+    index = ResourceIndex()
+    for _ in range(2000):
+        resource = "/".join(rng.choice(names) for _ in range(rng.randint(1, 3)))
+        if resource in locked:
+            index.remove(resource)
+            locked.remove(resource)
+        else:
+            index.add(resource)
+            locked.add(resource)
+    assert len(index) == len(locked)
+    for prefix in ["", "a", "a/", "a/b", "ab/", "b/a", "c/c/c"]:
+        assert index.count(prefix) == len(matching(locked, prefix))
+        assert list(index.iter_prefix(prefix)) == matching(locked, prefix)
+        for after in rng.sample(sorted(locked), 5):
+            assert list(index.iter_prefix(prefix, after)) == matching(locked, prefix, after)
+
+
+def test_ancestors_and_descendants():
+    index = index_of(["org", "org/team", "org/team/a", "org/team/b", "orgs/x"])
+    assert list(index.locked_ancestors("org/team/a")) == ["org", "org/team"]
+    assert index.descendants("org") == 3
+    assert index.descendants("org/team/a") == 0
@@ -0,0 +1,58 @@
+import time
+import uuid
+from concurrent.futures import Future
+import pytest
+from src.admission import Overloaded
+from src.sharding import ShardedLockService
+from tests.conftest import free_address
+
+
+@pytest.fixture(scope="module")
+def sharded():
+    service = ShardedLockService(free_address(), [], groups=3)
+    deadline = time.monotonic() + 10
+    while not all(group.is_leader() and group.is_ready() for group in service.groups):
+        assert time.monotonic() < deadline, "groups did not elect leaders"
+        time.sleep(0.05)
+    yield service
+    service.destroy()
+
+
+def overloaded(*args, **kwargs)->Future:
+    future = Future()
+    future.set_exception(Overloaded("too busy", 0.1))
+    return future
+
+
+def test_session_spans_every_group(sharded):
+    session_id = sharded.create_session("sharded-client", 30)
+    assert all(group.get_session_info(session_id) for group in sharded.groups)
+    assert sharded.delete_session(session_id)
+    assert not any(group.get_session_info(session_id) for group in sharded.groups)
+
+
+def test_failed_create_is_rolled_back(sharded, monkeypatch):
+    created = []
+    for group in sharded.groups[:2]:
+        create = group.create_session_async
+        monkeypatch.setattr(group, "create_session_async",
+                            lambda *args, create=create: created.append(args[2]) or create(*args))
+    monkeypatch.setattr(sharded.groups[2], "create_session_async", overloaded)
+
+    with pytest.raises(Overloaded):
+        sharded.create_session("sharded-client", 30)
+    time.sleep(0.3)
+    assert created
+    assert not any(group.get_session_info(session_id) for group in sharded.groups for session_id in created)
+
+
+def test_failed_create_with_request_id_is_kept_for_the_retry(sharded, monkeypatch):
+    request_id = str(uuid.uuid4())
+    create = sharded.groups[2].create_session_async
+    monkeypatch.setattr(sharded.groups[2], "create_session_async", overloaded)
+    with pytest.raises(Overloaded):
+        sharded.create_session("sharded-client", 30, request_id)
+
+    monkeypatch.setattr(sharded.groups[2], "create_session_async", create)
+    session_id = sharded.create_session("sharded-client", 30, request_id)
+    assert all(group.get_session_info(session_id) for group in sharded.groups)
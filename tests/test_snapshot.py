@@ -0,0 +1,128 @@
+import os
+import time
+import uuid
+import pytest
+from pysyncobj.node import TCPNode
+from src.lock_service import LockService
+from src.records import LOCK_SEMAPHORE, LOCK_SHARED, Lock, Session, SharedLock
+from src.snapshot import SnapshotError, read_snapshot, write_snapshot
+from tests.conftest import free_address
+
+RAFT_META = ((b"last", 42, 3), (b"previous", 41, 3), {TCPNode("localhost:4321"), TCPNode("localhost:4322")})
+
+
+def sample_state()->dict:
+    uuid_session = str(uuid.uuid4())
+    alice = Session(uuid_session, "alice", 30, 1000.0, 1010.5, 1040.5,
+                    create_request=str(uuid.uuid4()))
+    bob = Session("bob-session", "bob", 12.5, 1001.0, 1002.0, 1014.5)
+    carol = Session("carol-session", "alice", 60, 1003.0, 1003.0, 1063.0)
+    for resource in ("jobs/1", "jobs/2", "reports"):
+        alice.locks_held[resource] = None
+    bob.locks_held["reports"] = None
+    bob.locks_held["pool"] = None
+    carol.waiting_on["jobs/1"] = None
+    carol.waiting_on["reports"] = None
+    alice.remember("acquire-1", 7)
+    alice.remember("release-1", True)
+    alice.remember("conflict-1", None)
+    alice.remember("batch-1", {"jobs/1": 5, "jobs/2": 6})
+    bob.remember("release-2", False)
+    locks = {
+        "jobs/1": Lock("jobs/1", uuid_session, 5, 1004.0),
+        "jobs/2": Lock("jobs/2", uuid_session, 6, 1004.0, hierarchical=True),
+        "reports": SharedLock("reports", LOCK_SHARED, None, {
+            uuid_session: Lock("reports", uuid_session, 8, 1005.0),
+            "bob-session": Lock("reports", "bob-session", 9, 1006.0),
+        }),
+        "pool": SharedLock("pool", LOCK_SEMAPHORE, 3, {
+            "bob-session": Lock("pool", "bob-session", 10, 1007.0),
+        }),
+    }
+    return {
+        "sessions": {session.session_id: session for session in (alice, bob, carol)},
+        "locks": locks,
+        "fence_counter": 10,
+        "lease_grace_start": 999.25,
+        "waiters": {
+            "jobs/1": {"carol-session": ("exclusive", None)},
+            "reports": {"carol-session": (LOCK_SEMAPHORE, 2)},
+        },
+    }
+
+
+def test_round_trip(tmp_path):
+    file_name = str(tmp_path / "snapshot")
+    state = sample_state()
+    write_snapshot(file_name, RAFT_META, state)
+    raft_meta, loaded = read_snapshot(file_name)
+
+    assert raft_meta[:2] == RAFT_META[:2]
+    assert {str(node) for node in raft_meta[2]} == {str(node) for node in RAFT_META[2]}
+    assert loaded == state
+    # Insertion order is replicated state too
+    assert list(loaded["sessions"]) == list(state["sessions"])
+    for session_id, session in state["sessions"].items():
+        assert list(loaded["sessions"][session_id].locks_held) == list(session.locks_held)
+        assert list(loaded["sessions"][session_id].waiting_on) == list(session.waiting_on)
+    assert list(loaded["locks"]) == list(state["locks"])
+
+
+def test_round_trip_of_empty_state(tmp_path):
+    file_name = str(tmp_path / "snapshot")
+    state = {"sessions": {}, "locks": {}, "fence_counter": 0, "lease_grace_start": 0.0, "waiters": {}}
+    write_snapshot(file_name, RAFT_META, state)
+    assert read_snapshot(file_name)[1] == state
+
+
+def test_truncated_snapshot_is_rejected(tmp_path):
+    file_name = tmp_path / "snapshot"
+    write_snapshot(str(file_name), RAFT_META, sample_state())
+    file_name.write_bytes(file_name.read_bytes()[:-20])
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(file_name))
+
+
+def test_other_files_are_rejected(tmp_path):
+    file_name = tmp_path / "snapshot"
+    file_name.write_bytes(b"\x80\x04not a snapshot at all")
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(file_name))
+
+
+def start_node(address: str, data_dir: str)->LockService:
+    node = LockService(address, [], data_dir=str(data_dir), snapshot_min_entries=100)
+    deadline = time.monotonic() + 10
+    while not (node.is_leader() and node.is_ready()):
+        assert time.monotonic() < deadline, "single node did not become leader"
+        time.sleep(0.05)
+    return node
+
+
+def test_restart_loads_snapshot(tmp_path):
+    address = free_address()
+    node = start_node(address, tmp_path)
+    request_id = str(uuid.uuid4())
+    first = node.create_session("restart-client", 60, request_id)
+    sessions = [node.create_session(f"client-{i}", 60) for i in range(150)]
+    fence_tokens = {f"restart/{i}": node.acquire_lock(session_id, f"restart/{i}")
+                    for i, session_id in enumerate(sessions[:50])}
+    snapshot_file = tmp_path / f"{address.replace(':', '_')}.snapshot"
+    deadline = time.monotonic() + 20
+    while not snapshot_file.exists():
+        assert time.monotonic() < deadline, "no snapshot was written"
+        time.sleep(0.1)
+    node.destroy()
+
+    _, state = read_snapshot(str(snapshot_file))
+    assert first in state["sessions"]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    node = start_node(address, tmp_path)
+    try:
+        assert node.create_session("restart-client", 60, request_id) == first
+        assert node.get_session_info(sessions[-1]) is not None
+        for resource, fence_token in fence_tokens.items():
+            assert node.get_lock_info(resource)["fence_token"] == fence_token
+    finally:
+        node.destroy()
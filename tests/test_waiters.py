@@ -0,0 +1,80 @@
+import time
+
+
+def test_waiter_gets_lock_on_release(node, session):
+    holder, waiter = session(), session()
+    fence_token = node.acquire_lock(holder, "wait/handover")
+    grant = node.acquire_lock_waiting_async(waiter, "wait/handover")
+    time.sleep(0.2)
+    assert not grant.done()
+    assert node.get_lock_info("wait/handover")["waiters"] == 1
+
+    assert node.release_lock(holder, "wait/handover", fence_token)
+    handed_over = grant.result(timeout=5)
+    assert handed_over > fence_token
+    info = node.get_lock_info("wait/handover")
+    assert info["session_id"] == waiter
+    assert info["fence_token"] == handed_over
+    assert info["waiters"] == 0
+
+
+def test_waiters_are_served_in_order(node, session):
+    holder, first, second = session(), session(), session()
+    fence_token = node.acquire_lock(holder, "wait/fifo")
+    first_grant = node.acquire_lock_waiting_async(first, "wait/fifo")
+    time.sleep(0.1)
+    second_grant = node.acquire_lock_waiting_async(second, "wait/fifo")
+    time.sleep(0.1)
+
+    node.release_lock(holder, "wait/fifo", fence_token)
+    first_token = first_grant.result(timeout=5)
+    assert not second_grant.done()
+    node.release_lock(first, "wait/fifo", first_token)
+    assert second_grant.result(timeout=5) > first_token
+
+
+def test_cancelled_waiter_is_skipped(node, session):
+    holder, waiter = session(), session()
+    fence_token = node.acquire_lock(holder, "wait/cancel")
+    node.acquire_lock_waiting_async(waiter, "wait/cancel")
+    time.sleep(0.1)
+
+    assert node.cancel_wait_async(waiter, "wait/cancel").result(timeout=5) is None
+    assert node.get_session_info(waiter)["waiting_on"] == []
+    node.release_lock(holder, "wait/cancel", fence_token)
+    assert node.get_lock_info("wait/cancel") is None
+
+
+def test_wait_times_out(node, session):
+    holder, waiter = session(), session()
+    node.acquire_lock(holder, "wait/timeout")
+    started = time.monotonic()
+    assert node.acquire_lock(waiter, "wait/timeout", wait_timeout=0.3) is None
+    assert time.monotonic() - started >= 0.3
+    assert node.get_lock_info("wait/timeout")["waiters"] == 0
+
+
+def test_abandoned_waiter_leaves_queue(node, session):
+    holder, waiter = session(), session()
+    fence_token = node.acquire_lock(holder, "wait/abandon")
+    grant = node.acquire_lock_waiting_async(waiter, "wait/abandon")
+    time.sleep(0.1)
+
+    node.abandon_wait(waiter, "wait/abandon", grant)
+    time.sleep(0.2)
+    assert node.get_session_info(waiter)["waiting_on"] == []
+    node.release_lock(holder, "wait/abandon", fence_token)
+    assert node.get_lock_info("wait/abandon") is None
+
+
+def test_abandoned_grant_is_released(node, session):
+    holder, waiter = session(), session()
+    fence_token = node.acquire_lock(holder, "wait/abandon-granted")
+    grant = node.acquire_lock_waiting_async(waiter, "wait/abandon-granted")
+    time.sleep(0.1)
+    node.release_lock(holder, "wait/abandon-granted", fence_token)
+    grant.result(timeout=5)
+
+    node.abandon_wait(waiter, "wait/abandon-granted", grant)
+    time.sleep(0.2)
+    assert node.get_lock_info("wait/abandon-granted") is None